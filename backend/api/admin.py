@@ -1,13 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from pydantic import BaseModel
 from typing import List, Optional
 from passlib.context import CryptContext
 
-from backend.database import get_db
+from backend.database import get_db, get_read_db
 from backend import models, schemas
 from backend.core.permissions import require_admin
+from backend.core import slow_query_log
+from backend.core.pagination import Keyset, PageParams, page_params
+from backend.services import counter_reconciler, doctor_directory, user_directory, user_search
+from backend.services.slot_inventory import inventory
 
 # 所有 admin 接口都需要管理员权限
 router = APIRouter(prefix="/api/admin", tags=["Admin"], dependencies=[Depends(require_admin)])
@@ -18,21 +22,47 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+# 用户列表总数：X-Total-Count；为表统计估算值时另带 X-Total-Count-Estimated: true
+TOTAL_COUNT_HEADER = "X-Total-Count"
+TOTAL_ESTIMATED_HEADER = "X-Total-Count-Estimated"
+
+
+def _user_page(response: Response, role, status, keyword, sort, page: PageParams, db: Session):
+    """管理端用户列表公共部分：一条联表查询取一页，并在响应头写入下一页游标与总数"""
+    try:
+        keyset = user_directory.keyset(sort)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"不支持的排序字段: {sort}")
+    rows = keyset.page(user_directory.fetch(db, role, status, keyword, keyset, page), page, response)
+    total, estimated = user_directory.counter.count(db, role, status, keyword)
+    response.headers[TOTAL_COUNT_HEADER] = str(total)
+    if estimated:
+        response.headers[TOTAL_ESTIMATED_HEADER] = "true"
+    return rows
+
+
 @router.get("/users")
-def users(db: Session = Depends(get_db)):
-    users = db.query(models.User).filter(models.User.role == models.UserRole.user).all()
-    result = []
-    for u in users:
-        p = db.query(models.PatientProfile).filter(models.PatientProfile.user_id == u.id).first()
-        result.append({
+def users(
+    response: Response,
+    status: Optional[models.UserStatus] = None,
+    keyword: Optional[str] = None,
+    sort: str = Query("-created_at", description="排序：created_at / phone，前缀 - 为倒序"),
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_read_db),
+):
+    """患者列表，按 cursor 翻页"""
+    rows = _user_page(response, models.UserRole.user, status, keyword, sort, page, db)
+    return [
+        {
             "id": u.id,
-            "name": getattr(p, "name", None),
+            "name": u.name,
             "phone": u.phone,
             "role": "patient",
-            "status": u.status.value if hasattr(u.status, 'value') else str(u.status),
-            "created_at": str(u.created_at)
-        })
-    return result
+            "status": u.status.value,
+            "created_at": str(u.created_at),
+        }
+        for u in rows
+    ]
 
 
 @router.post("/users", response_model=schemas.UserResponse)
@@ -61,24 +91,9 @@ def add_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
 
 
 @router.get("/doctors")
-def get_doctors(db: Session = Depends(get_db)):
-    """获取所有已审核通过的医生"""
-    doctors = db.query(models.User).filter(
-        models.User.role == models.UserRole.doctor,
-        models.User.status == models.UserStatus.active
-    ).all()
-    # 简单返回，如果需要详细信息可以关联 DoctorProfile
-    result = []
-    for d in doctors:
-        profile = db.query(models.DoctorProfile).filter(models.DoctorProfile.user_id == d.id).first()
-        result.append({
-            "id": d.id,
-            "phone": d.phone,
-            "name": getattr(profile, "name", "未完善信息"),
-            "department": getattr(profile, "department", ""),
-            "title": getattr(profile, "title", "")
-        })
-    return result
+def get_doctors(department: Optional[str] = None, title: Optional[str] = None, db: Session = Depends(get_db)):
+    """获取所有已审核通过的医生，可按科室/职称过滤"""
+    return doctor_directory.admin_view(doctor_directory.directory.entries(db), department, title)
 
 
 @router.get("/admins")
@@ -99,7 +114,7 @@ def get_pending_doctors_count(db: Session = Depends(get_db)):
 
 
 @router.get("/stats")
-def stats(db: Session = Depends(get_db)):
+def stats(db: Session = Depends(get_read_db)):
     total_users = db.query(models.User).count()
     pending_reviews = db.query(models.User).filter(models.User.status == models.UserStatus.pending).count()
     
@@ -135,6 +150,56 @@ def stats(db: Session = Depends(get_db)):
     }
 
 
+@router.get("/slow-queries")
+def slow_queries(limit: int = 20, order_by: str = "total_ms"):
+    """慢查询 Top-N（按 total_ms / max_ms / count 排序），含参数形状、来源路由与执行计划"""
+    return {
+        "threshold_ms": slow_query_log.SLOW_QUERY_MS,
+        "items": slow_query_log.top_offenders(limit=min(max(limit, 1), 200), order_by=order_by),
+    }
+
+
+@router.delete("/slow-queries")
+def reset_slow_queries():
+    slow_query_log.reset()
+    return {"message": "已清空"}
+
+
+# ========== 排班计数对账 ==========
+
+@router.get("/counters")
+def counter_status(db: Session = Depends(get_db)):
+    """待对账的 (医生, 日期) 数"""
+    return {"pending": counter_reconciler.pending(db)}
+
+
+@router.post("/counters/reconcile")
+def reconcile_counters(repair: bool = True, full: bool = False, limit: int = 500, db: Session = Depends(get_db)):
+    """
+    立即对账排班计数：repair=false 只报告漂移；full=true 先把全部有排班的日期记为待对账再核对
+    返回漂移明细（[原值, 实际值]）与修复/跳过数
+    """
+    limit = min(max(limit, 1), 5000)
+    if full:
+        counter_reconciler.mark_all(db)
+    if repair:
+        report = counter_reconciler.reconcile_all(db, limit)
+        db.add(models.AdminAudit(action="reconcile_counters", target_type="schedule", target_id=None,
+                                 info=f"checked={report['checked']} repaired={report['repaired']}"))
+        db.commit()
+        return report
+    return counter_reconciler.reconcile(db, repair=False, limit=limit)
+
+
+@router.post("/search/rebuild")
+def rebuild_user_search(db: Session = Depends(get_db)):
+    """全量重建用户搜索索引（绕过 ORM 改过用户/资料数据后使用）"""
+    indexed = user_search.rebuild(db.connection())
+    db.add(models.AdminAudit(action="rebuild_user_search", target_type="user", target_id=None, info=f"indexed={indexed}"))
+    db.commit()
+    return {"indexed": indexed}
+
+
 class ApproveBody(BaseModel):
     approved: bool
 
@@ -299,7 +364,11 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="用户不存在")
     if u.role == models.UserRole.admin:
         raise HTTPException(status_code=400, detail="不允许删除管理员账户")
-    # 根据角色级联删除相关数据
+    # 根据角色级联删除相关数据；候补与暂占号同时引用预约和排班，须先于它们删除
+    # （删除暂占号/预约由触发器记入计数变更，排班与日聚合计数由计数对账重算）
+    W, H = models.AppointmentWaitlist, models.SlotHold
+    db.query(W).filter(W.patient_id == user_id).delete(synchronize_session=False)
+    db.query(H).filter(H.patient_id == user_id).delete(synchronize_session=False)
     if u.role == models.UserRole.user:
         p = db.query(models.PatientProfile).filter(models.PatientProfile.user_id == user_id).first()
         if p:
@@ -309,11 +378,19 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
         d = db.query(models.DoctorProfile).filter(models.DoctorProfile.user_id == user_id).first()
         if d:
             db.delete(d)
-        # 删除医生排班与相关预约
-        schedules = db.query(models.DoctorSchedule).filter(models.DoctorSchedule.doctor_id == user_id).all()
-        for s in schedules:
-            db.query(models.Appointment).filter(models.Appointment.schedule_id == s.id).delete()
-            db.delete(s)
+        # 删除医生排班与相关候补、暂占号、计数分片、预约，以及日聚合与周模板
+        schedule_ids = db.query(models.DoctorSchedule.id).filter(models.DoctorSchedule.doctor_id == user_id)
+        db.query(W).filter(W.schedule_id.in_(schedule_ids)).delete(synchronize_session=False)
+        db.query(H).filter(H.schedule_id.in_(schedule_ids)).delete(synchronize_session=False)
+        db.query(models.ScheduleCounterStripe).filter(
+            models.ScheduleCounterStripe.schedule_id.in_(schedule_ids)
+        ).delete(synchronize_session=False)
+        db.query(models.Appointment).filter(models.Appointment.schedule_id.in_(schedule_ids)).delete(synchronize_session=False)
+        db.query(models.DoctorSchedule).filter(models.DoctorSchedule.doctor_id == user_id).delete(synchronize_session=False)
+        db.query(models.DoctorDaySchedule).filter(models.DoctorDaySchedule.doctor_id == user_id).delete(synchronize_session=False)
+        db.query(models.DoctorScheduleTemplate).filter(
+            models.DoctorScheduleTemplate.doctor_id == user_id
+        ).delete(synchronize_session=False)
     elif u.role == models.UserRole.pharmacist:
         p = db.query(models.PharmacistProfile).filter(models.PharmacistProfile.user_id == user_id).first()
         if p:
@@ -321,6 +398,8 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
     # 删除用户本身
     db.delete(u)
     db.commit()
+    if u.role == models.UserRole.doctor:
+        inventory.drop_doctor(user_id)
     # 审计日志
     db.add(models.AdminAudit(action="delete_user", target_type="user", target_id=user_id, info=f"role={u.role}"))
     db.commit()
@@ -341,9 +420,13 @@ class MedicationBody(BaseModel):
     description: Optional[str] = None
 
 
+MEDICATION_KEYSET = Keyset(models.Medication.id, desc=False)
+
+
 @router.get("/medications")
-def meds(db: Session = Depends(get_db)):
-    return db.query(models.Medication).all()
+def meds(response: Response, page: PageParams = Depends(page_params), db: Session = Depends(get_db)):
+    meds = MEDICATION_KEYSET.apply(db.query(models.Medication), page).all()
+    return MEDICATION_KEYSET.page(meds, page, response)
 
 
 @router.get("/medications/{med_id}")
@@ -419,39 +502,33 @@ def delete_med(med_id: int, db: Session = Depends(get_db)):
 
 @router.get("/all-users")
 def get_all_users(
+    response: Response,
     role: Optional[str] = None,
+    status: Optional[models.UserStatus] = None,
     keyword: Optional[str] = None,
-    db: Session = Depends(get_db)
+    sort: str = Query("-created_at", description="排序：created_at / phone，前缀 - 为倒序"),
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_read_db),
 ):
-    query = db.query(models.User)
+    """全部用户（可按角色/状态/手机号过滤），按 cursor 翻页"""
+    user_role = None
     if role and role != "all":
-        query = query.filter(models.User.role == role)
-    
-    if keyword:
-        # 简单模糊搜索：手机号
-        query = query.filter(models.User.phone.contains(keyword))
-    
-    users = query.order_by(models.User.created_at.desc()).all()
-    
-    result = []
-    for u in users:
-        name = "未命名"
-        if u.role == models.UserRole.user:
-            p = db.query(models.PatientProfile).filter(models.PatientProfile.user_id == u.id).first()
-            if p and p.name: name = p.name
-        elif u.role == models.UserRole.doctor:
-            p = db.query(models.DoctorProfile).filter(models.DoctorProfile.user_id == u.id).first()
-            if p and p.name: name = p.name
-        
-        result.append({
+        try:
+            user_role = models.UserRole(role)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"未知角色: {role}")
+    rows = _user_page(response, user_role, status, keyword, sort, page, db)
+    return [
+        {
             "id": u.id,
             "phone": u.phone,
             "role": u.role,
-            "name": name,
+            "name": u.name or "未命名",
             "status": u.status,
-            "created_at": u.created_at
-        })
-    return result
+            "created_at": u.created_at,
+        }
+        for u in rows
+    ]
 
 
 @router.get("/users/{user_id}/details")
@@ -0,0 +1,241 @@
+"""
+管理员数据导出（流式）
+- /api/admin/export/{users,appointments,prescriptions,medications}，支持 format=csv|ndjson
+- 服务端游标（yield_per）分批取行，边查边写 StreamingResponse，内存占用与导出行数无关
+- 会话在生成器内部创建并关闭：响应体开始发送时请求依赖已经结束，不能复用 Depends(get_db) 的会话
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+from typing import Callable, Iterator, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import String, func, literal, select
+from sqlalchemy.orm import aliased
+
+from backend.database import read_session_factory
+from backend import models
+from backend.core.permissions import require_admin
+
+router = APIRouter(prefix="/api/admin/export", tags=["Admin Export"], dependencies=[Depends(require_admin)])
+
+# 每批从游标取出并写出的行数
+EXPORT_BATCH_SIZE = 1000
+
+_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+
+
+def _parse_date(value: Optional[str], name: str) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} 格式错误，应为YYYY-MM-DD")
+
+
+def _day(value: date):
+    # 以 YYYY-MM-DD 文本比较 TIMESTAMP 列：SQLite 按文本比较存储值，MySQL 会转换为当天零点
+    return literal(value.isoformat(), String)
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if hasattr(value, "value"):  # Enum
+        return value.value
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _json_value(value):
+    if hasattr(value, "value"):
+        return value.value
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _stream_rows(session_factory: Callable, stmt, fmt: str) -> Iterator[str]:
+    """逐批读取查询结果并编码；每次 yield 一批，减少线程池切换"""
+    with session_factory() as db:
+        result = db.execute(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        columns = list(result.keys())
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            # BOM 让 Excel 按 UTF-8 打开中文
+            buffer.write("\ufeff")
+            writer.writerow(columns)
+            for batch in result.partitions():
+                for row in batch:
+                    writer.writerow([_cell(v) for v in row])
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+            if buffer.tell():
+                yield buffer.getvalue()
+        else:
+            for batch in result.partitions():
+                yield "".join(
+                    json.dumps(dict(zip(columns, row)), default=_json_value, ensure_ascii=False) + "\n"
+                    for row in batch
+                )
+
+
+def _export(request: Request, name: str, stmt, fmt: str) -> StreamingResponse:
+    filename = f"{name}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{fmt}"
+    return StreamingResponse(
+        _stream_rows(read_session_factory(request), stmt, fmt),
+        media_type=_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+_FORMAT = Query("csv", pattern="^(csv|ndjson)$", description="csv 或 ndjson")
+
+
+@router.get("/users")
+def export_users(
+    request: Request,
+    format: str = _FORMAT,
+    role: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = Query(None, description="注册日期起（含），YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="注册日期止（不含），YYYY-MM-DD"),
+):
+    """导出用户（不含密码），姓名/科室取自对应角色的资料"""
+    U = models.User
+    DP, PP, FP = models.DoctorProfile, models.PatientProfile, models.PharmacistProfile
+    stmt = (
+        select(
+            U.id, U.phone, U.role, U.status,
+            func.coalesce(PP.name, DP.name, FP.name).label("name"),
+            func.coalesce(DP.department, FP.department).label("department"),
+            func.coalesce(DP.title, FP.title).label("title"),
+            U.created_at,
+        )
+        .outerjoin(PP, PP.user_id == U.id)
+        .outerjoin(DP, DP.user_id == U.id)
+        .outerjoin(FP, FP.user_id == U.id)
+        .order_by(U.id)
+    )
+    if role and role != "all":
+        stmt = stmt.where(U.role == role)
+    if status and status != "all":
+        stmt = stmt.where(U.status == status)
+    d_from, d_to = _parse_date(date_from, "date_from"), _parse_date(date_to, "date_to")
+    if d_from:
+        stmt = stmt.where(U.created_at >= _day(d_from))
+    if d_to:
+        stmt = stmt.where(U.created_at < _day(d_to))
+    return _export(request, "users", stmt, format)
+
+
+@router.get("/appointments")
+def export_appointments(
+    request: Request,
+    format: str = _FORMAT,
+    status: Optional[str] = None,
+    doctor_id: Optional[int] = None,
+    date_from: Optional[str] = Query(None, description="就诊日期起（含），YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="就诊日期止（不含），YYYY-MM-DD"),
+):
+    """导出预约，按就诊日期（排班日期）过滤"""
+    A, S = models.Appointment, models.DoctorSchedule
+    Patient = aliased(models.User, name="patient")
+    PP, DP = models.PatientProfile, models.DoctorProfile
+    stmt = (
+        select(
+            A.id, A.status,
+            S.date.label("appointment_date"), S.start_time, S.end_time,
+            A.patient_id, Patient.phone.label("patient_phone"), PP.name.label("patient_name"),
+            A.doctor_id, DP.name.label("doctor_name"), DP.department,
+            A.created_at,
+        )
+        .join(S, S.id == A.schedule_id)
+        .outerjoin(Patient, Patient.id == A.patient_id)
+        .outerjoin(PP, PP.user_id == A.patient_id)
+        .outerjoin(DP, DP.user_id == A.doctor_id)
+        .order_by(A.id)
+    )
+    if status and status != "all":
+        stmt = stmt.where(A.status == status)
+    if doctor_id:
+        stmt = stmt.where(A.doctor_id == doctor_id)
+    d_from, d_to = _parse_date(date_from, "date_from"), _parse_date(date_to, "date_to")
+    if d_from:
+        stmt = stmt.where(S.date >= d_from)
+    if d_to:
+        stmt = stmt.where(S.date < d_to)
+    return _export(request, "appointments", stmt, format)
+
+
+@router.get("/prescriptions")
+def export_prescriptions(
+    request: Request,
+    format: str = _FORMAT,
+    status: Optional[str] = None,
+    doctor_id: Optional[int] = None,
+    patient_id: Optional[int] = None,
+    date_from: Optional[str] = Query(None, description="开方日期起（含），YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="开方日期止（不含），YYYY-MM-DD"),
+):
+    """导出处方明细：每个药品一行，处方头信息在每行重复"""
+    P, I, M, R = models.Prescription, models.PrescriptionItem, models.Medication, models.MedicalRecord
+    PP, DP = models.PatientProfile, models.DoctorProfile
+    stmt = (
+        select(
+            P.id.label("prescription_id"), P.status, P.created_at,
+            P.patient_id, PP.name.label("patient_name"),
+            P.doctor_id, DP.name.label("doctor_name"),
+            R.diagnosis, P.total_price, P.notes,
+            I.medication_id, M.name.label("medication_name"), M.specification,
+            I.quantity, I.price_at_time, I.usage_instruction,
+        )
+        .outerjoin(R, R.id == P.medical_record_id)
+        .outerjoin(PP, PP.user_id == P.patient_id)
+        .outerjoin(DP, DP.user_id == P.doctor_id)
+        .outerjoin(I, I.prescription_id == P.id)
+        .outerjoin(M, M.id == I.medication_id)
+        .order_by(P.id, I.id)
+    )
+    if status and status != "all":
+        stmt = stmt.where(P.status == status)
+    if doctor_id:
+        stmt = stmt.where(P.doctor_id == doctor_id)
+    if patient_id:
+        stmt = stmt.where(P.patient_id == patient_id)
+    d_from, d_to = _parse_date(date_from, "date_from"), _parse_date(date_to, "date_to")
+    if d_from:
+        stmt = stmt.where(P.created_at >= _day(d_from))
+    if d_to:
+        stmt = stmt.where(P.created_at < _day(d_to))
+    return _export(request, "prescriptions", stmt, format)
+
+
+@router.get("/medications")
+def export_medications(
+    request: Request,
+    format: str = _FORMAT,
+    status: Optional[str] = None,
+    category: Optional[str] = None,
+):
+    """导出药品目录"""
+    M = models.Medication
+    stmt = select(
+        M.id, M.name, M.category, M.specification, M.unit, M.manufacturer,
+        M.stock, M.min_stock, M.max_stock, M.price, M.status, M.description,
+        M.created_at, M.updated_at,
+    ).order_by(M.id)
+    if status and status != "all":
+        stmt = stmt.where(M.status == status)
+    if category:
+        stmt = stmt.where(M.category == category)
+    return _export(request, "medications", stmt, format)
@@ -1,10 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import select
+from typing import List, Optional
 from backend.database import get_db
 from backend import models, schemas
 from backend.core.permissions import require_doctor
 from backend.core.security import TokenPayload
+from backend.core.query_stats import query_budget
+from backend.core.pagination import Keyset, PageParams, page_params
+from backend.services import prescriptions as prescription_service
+from backend.services import doctor_directory
 
 # 医生列表公开，其他操作需要医生权限
 router = APIRouter(prefix="/api/doctor", tags=["Doctor"])
@@ -13,41 +18,39 @@ router = APIRouter(prefix="/api/doctor", tags=["Doctor"])
 protected_router = APIRouter(dependencies=[Depends(require_doctor)])
 
 # 医生列表接口
-@router.get("/")
-def list_doctors(db: Session = Depends(get_db)):
-    users = db.query(models.User).filter(models.User.role == models.UserRole.doctor).all()
-    result = []
-    for u in users:
-        p = db.query(models.DoctorProfile).filter(models.DoctorProfile.user_id == u.id).first()
-        result.append({
-            "id": u.id,
-            "name": getattr(p, "name", None),
-            "department": getattr(p, "department", None),
-            "title": getattr(p, "title", None),
-            "license_number": getattr(p, "license_number", None),
-            "hospital": getattr(p, "hospital", None),
-            "is_approved": u.status == models.UserStatus.active,
-            "user_id": u.id,
-        })
-    return result
+@router.get("/", dependencies=[Depends(query_budget(1))])
+async def list_doctors(
+    department: Optional[str] = None,
+    title: Optional[str] = None,
+):
+    return doctor_directory.doctor_list_view(await doctor_directory.directory.entries_async(), department, title)
 
 # ==================== 病历管理 ====================
 
+MEDICAL_RECORD_KEYSET = Keyset(models.MedicalRecord.created_at, models.MedicalRecord.id)
+
 @router.get("/records", response_model=List[schemas.MedicalRecordResponse], dependencies=[Depends(require_doctor)])
 def list_medical_records(
+    response: Response,
     patient_id: int = None, 
     doctor_id: int = None, 
     skip: int = 0, 
     limit: int = 20, 
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
+    """病历列表：按 cursor 翻页（下一页游标见响应头 X-Next-Cursor）；skip 仅为兼容旧调用保留"""
+    page = PageParams.of(cursor, limit)
     q = db.query(models.MedicalRecord)
     if patient_id:
         q = q.filter(models.MedicalRecord.patient_id == patient_id)
     if doctor_id:
         q = q.filter(models.MedicalRecord.doctor_id == doctor_id)
-    records = q.order_by(models.MedicalRecord.created_at.desc()).offset(skip).limit(limit).all()
-    return records
+    q = MEDICAL_RECORD_KEYSET.apply(q, page)
+    if skip and not cursor:
+        q = q.offset(skip)
+    records = q.all()
+    return MEDICAL_RECORD_KEYSET.page(records, page, response)
 
 @router.get("/records/{record_id}", response_model=schemas.MedicalRecordResponse, dependencies=[Depends(require_doctor)])
 def get_medical_record(record_id: int, db: Session = Depends(get_db)):
@@ -92,107 +95,69 @@ def create_prescription(prescription: schemas.PrescriptionCreate, db: Session =
     if not record:
         raise HTTPException(status_code=404, detail="关联病历不存在")
     
-    # 2. 计算总价并检查库存
+    # 2. 计算总价并检查库存（药品一次性取出）
+    med_ids = {item.medication_id for item in prescription.items}
+    meds = {m.id: m for m in db.query(models.Medication).filter(models.Medication.id.in_(med_ids))}
     total_price = 0
     items_to_add = []
     
     for item in prescription.items:
-        med = db.query(models.Medication).filter(models.Medication.id == item.medication_id).first()
+        med = meds.get(item.medication_id)
         if not med:
             raise HTTPException(status_code=400, detail=f"药品ID {item.medication_id} 不存在")
         if med.stock < item.quantity:
             raise HTTPException(status_code=400, detail=f"药品 {med.name} 库存不足 (剩余: {med.stock})")
         
         total_price += med.price * item.quantity
-        items_to_add.append({
-            "medication_id": item.medication_id,
-            "quantity": item.quantity,
-            "price_at_time": med.price,
-            "usage_instruction": item.usage_instruction
-        })
-
-    # 3. 创建处方
+        items_to_add.append(models.PrescriptionItem(
+            medication=med,
+            quantity=item.quantity,
+            price_at_time=med.price,
+            usage_instruction=item.usage_instruction
+        ))
+
+    # 3. 创建处方及明细（同一事务提交）
     new_prescription = models.Prescription(
         medical_record_id=record.id,
         doctor_id=record.doctor_id,
         patient_id=record.patient_id,
         status=models.PrescriptionStatus.pending,
         total_price=total_price,
-        notes=prescription.notes
+        notes=prescription.notes,
+        items=items_to_add
     )
     db.add(new_prescription)
     db.commit()
-    db.refresh(new_prescription)
-
-    # 4. 创建处方明细
-    for item_data in items_to_add:
-        db_item = models.PrescriptionItem(
-            prescription_id=new_prescription.id,
-            **item_data
-        )
-        db.add(db_item)
-    
-    db.commit()
-    
-    # 重新查询以包含 items
-    return new_prescription
+    return prescription_service.to_response(prescription_service.get_prescription_view(db, new_prescription.id))
 
-@router.get("/prescriptions", response_model=List[schemas.PrescriptionResponse], dependencies=[Depends(require_doctor)])
-def list_doctor_prescriptions(doctor_id: int, db: Session = Depends(get_db)):
-    prescriptions = db.query(models.Prescription).filter(models.Prescription.doctor_id == doctor_id).order_by(models.Prescription.created_at.desc()).all()
-    
+
+@router.get("/prescriptions", response_model=List[schemas.PrescriptionResponse], dependencies=[Depends(require_doctor), Depends(query_budget(1))])
+def list_doctor_prescriptions(
+    doctor_id: int,
+    response: Response,
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_db)
+):
+    views = prescription_service.fetch_prescriptions(db, doctor_id=doctor_id, page=page)
     result = []
-    for p in prescriptions:
-        # Get patient info
-        patient = db.query(models.User).filter(models.User.id == p.patient_id).first()
-        profile = db.query(models.PatientProfile).filter(models.PatientProfile.user_id == p.patient_id).first()
-        
-        # Get medical record for diagnosis
-        record = db.query(models.MedicalRecord).filter(models.MedicalRecord.id == p.medical_record_id).first()
-        
-        # Get items with names
-        items = db.query(models.PrescriptionItem).filter(models.PrescriptionItem.prescription_id == p.id).all()
-        p_items = []
-        for i in items:
-            med = db.query(models.Medication).filter(models.Medication.id == i.medication_id).first()
-            item_dict = schemas.PrescriptionItemResponse.from_orm(i)
-            if med:
-                item_dict.medication_name = med.name
-                item_dict.specification = med.specification
-                item_dict.unit = med.unit
-            else:
-                item_dict.medication_name = "未知药品"
-            p_items.append(item_dict)
-            
-        p_resp = schemas.PrescriptionResponse.from_orm(p)
-        p_resp.items = p_items
-        if patient:
-            p_resp.patient_name = (getattr(profile, "name", None) or "").strip() or patient.phone
-            p_resp.patient_phone = patient.phone
+    for view in prescription_service.PRESCRIPTION_KEYSET.page(views, page, response):
+        p_resp = prescription_service.to_response(view)
+        if view.patient_user_phone is not None:
+            p_resp.patient_name = (view.patient_profile_name or "").strip() or view.patient_user_phone
+            p_resp.patient_phone = view.patient_user_phone
         else:
             p_resp.patient_name = "未知患者"
             p_resp.patient_phone = ""
             
-        p_resp.diagnosis = record.diagnosis if record else "未知诊断"
+        p_resp.diagnosis = view.record_diagnosis if view.record_diagnosis is not None else "未知诊断"
         
         result.append(p_resp)
         
     return result
 
-@router.get("/prescriptions/{prescription_id}", response_model=schemas.PrescriptionResponse, dependencies=[Depends(require_doctor)])
+@router.get("/prescriptions/{prescription_id}", response_model=schemas.PrescriptionResponse, dependencies=[Depends(require_doctor), Depends(query_budget(1))])
 def get_prescription(prescription_id: int, db: Session = Depends(get_db)):
-    p = db.query(models.Prescription).filter(models.Prescription.id == prescription_id).first()
-    if not p:
+    view = prescription_service.get_prescription_view(db, prescription_id)
+    if not view:
         raise HTTPException(status_code=404, detail="处方不存在")
-    
-    # 手动填充 items 的 medication_name
-    items = db.query(models.PrescriptionItem).filter(models.PrescriptionItem.prescription_id == p.id).all()
-    p_items = []
-    for i in items:
-        med = db.query(models.Medication).filter(models.Medication.id == i.medication_id).first()
-        item_dict = i.__dict__
-        item_dict["medication_name"] = med.name if med else "未知药品"
-        p_items.append(item_dict)
-    
-    p.items = p_items
-    return p
+    return prescription_service.to_response(view)
@@ -1,34 +1,41 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from backend.database import get_db
+from backend.database import get_read_db
 from backend import models, schemas
+from backend.core.query_stats import query_budget
+from backend.core.pagination import PageParams, page_params
+from backend.services import prescriptions as prescription_service
 from datetime import datetime
 
 router = APIRouter(prefix="/api/orders", tags=["Orders"])
 
-@router.get("/my")
-def my_orders(patient_id: int, db: Session = Depends(get_db)):
+@router.get("/my", dependencies=[Depends(query_budget(1))])
+def my_orders(
+    patient_id: int,
+    response: Response,
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_read_db)
+):
     """
     获取我的订单（基于处方生成）
     """
     # 获取该患者的所有处方
-    prescriptions = db.query(models.Prescription).filter(
-        models.Prescription.patient_id == patient_id
-    ).order_by(models.Prescription.created_at.desc()).all()
+    # 处方、明细、药品与患者信息由处方投影一次查询取回
+    prescriptions = prescription_service.fetch_prescriptions(db, patient_id=patient_id, page=page)
+    prescriptions = prescription_service.PRESCRIPTION_KEYSET.page(prescriptions, page, response)
 
     results = []
     for p in prescriptions:
         # 获取处方项
-        items = db.query(models.PrescriptionItem).filter(models.PrescriptionItem.prescription_id == p.id).all()
         order_items = []
-        for i in items:
-            med = db.query(models.Medication).filter(models.Medication.id == i.medication_id).first()
+        for i in p.items:
+            known = i.medication_name is not None
             order_items.append({
                 "drug": {
-                    "name": med.name if med else "未知药品",
-                    "specification": med.specification if med else "",
-                    "manufacturer": med.manufacturer if med else ""
+                    "name": i.medication_name if known else "未知药品",
+                    "specification": i.specification if known else "",
+                    "manufacturer": i.manufacturer if known else ""
                 },
                 "unit_price": i.price_at_time,
                 "quantity": i.quantity
@@ -55,11 +62,8 @@ def my_orders(patient_id: int, db: Session = Depends(get_db)):
             payment_status = "unpaid" # or refunded
 
         # 获取患者信息
-        patient_profile = db.query(models.PatientProfile).filter(models.PatientProfile.user_id == p.patient_id).first()
-        patient_user = db.query(models.User).filter(models.User.id == p.patient_id).first()
-        
-        receiver_name = patient_profile.name if patient_profile else "用户"
-        receiver_phone = patient_user.phone if patient_user else ""
+        receiver_name = p.patient_profile_name or "用户"
+        receiver_phone = p.patient_user_phone or ""
 
         results.append({
             "id": p.id,
@@ -1,60 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import update
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from backend.database import get_db
+from backend.database import get_db, get_async_read_db
 from backend import models, schemas
 from backend.core.permissions import require_pharmacist
+from backend.core.query_stats import query_budget
+from backend.core.pagination import PageParams, page_params
+from backend.services import prescriptions as prescription_service
 
 # 所有药房接口需要药剂师权限
 router = APIRouter(prefix="/api/pharmacy", tags=["Pharmacy"], dependencies=[Depends(require_pharmacist)])
 
-@router.get("/prescriptions", response_model=List[schemas.PrescriptionResponse])
-def list_prescriptions(
+@router.get("/prescriptions", response_model=List[schemas.PrescriptionResponse], dependencies=[Depends(query_budget(1))])
+async def list_prescriptions(
+    response: Response,
     status: Optional[str] = None,
     patient_id: Optional[int] = None,
-    db: Session = Depends(get_db)
+    page: PageParams = Depends(page_params),
+    db: AsyncSession = Depends(get_async_read_db)
 ):
-    q = db.query(models.Prescription)
-    if status:
-        q = q.filter(models.Prescription.status == status)
-    if patient_id:
-        q = q.filter(models.Prescription.patient_id == patient_id)
+    views = await prescription_service.fetch_prescriptions_async(db, status=status, patient_id=patient_id or None, page=page)
+    views = prescription_service.PRESCRIPTION_KEYSET.page(views, page, response)
     
-    prescriptions = q.order_by(models.Prescription.created_at.desc()).all()
-    
-    # 填充详情
+    # 填充患者/医生信息
     results = []
-    for p in prescriptions:
-        items = db.query(models.PrescriptionItem).filter(models.PrescriptionItem.prescription_id == p.id).all()
-        p_items = []
-        for i in items:
-            med = db.query(models.Medication).filter(models.Medication.id == i.medication_id).first()
-            item_dict = schemas.PrescriptionItemResponse.from_orm(i)
-            if med:
-                item_dict.medication_name = med.name
-                item_dict.specification = med.specification
-                item_dict.unit = med.unit
-            else:
-                item_dict.medication_name = "未知药品"
-            p_items.append(item_dict)
-        
-        p_resp = schemas.PrescriptionResponse.from_orm(p)
-        p_resp.items = p_items
-        
-        # 填充患者信息
-        patient_profile = db.query(models.PatientProfile).filter(models.PatientProfile.user_id == p.patient_id).first()
-        if patient_profile:
-            p_resp.patient_name = patient_profile.name
-            
-        # 填充医生信息
-        doctor_profile = db.query(models.DoctorProfile).filter(models.DoctorProfile.user_id == p.doctor_id).first()
-        if doctor_profile:
-            p_resp.doctor_name = doctor_profile.name
-        else:
-            doctor_user = db.query(models.User).filter(models.User.id == p.doctor_id).first()
-            if doctor_user:
-                p_resp.doctor_name = doctor_user.phone
-
+    for view in views:
+        p_resp = prescription_service.to_response(view)
+        if view.patient_profile_name is not None:
+            p_resp.patient_name = view.patient_profile_name
+        p_resp.doctor_name = view.doctor_profile_name or view.doctor_user_phone
         results.append(p_resp)
         
     return results
@@ -72,21 +48,36 @@ def dispense_prescription(prescription_id: int, db: Session = Depends(get_db)):
     if p.status == models.PrescriptionStatus.cancelled:
         raise HTTPException(status_code=400, detail="该处方已取消")
 
-    # 检查库存是否足够
+    # 先以条件更新占住状态：并发的重复发药只有一次能继续，不会重复扣库存
+    P, M = models.Prescription, models.Medication
+    claimed = db.execute(
+        update(P)
+        .where(P.id == p.id, P.status.notin_([models.PrescriptionStatus.dispensed, models.PrescriptionStatus.cancelled]))
+        .values(status=models.PrescriptionStatus.dispensed)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="该处方已发药")
+
+    # 检查并扣减库存（药品一次性取出，扣减为条件更新，任一不足整单回滚）
     items = db.query(models.PrescriptionItem).filter(models.PrescriptionItem.prescription_id == p.id).all()
+    meds = {m.id: m for m in db.query(M).filter(M.id.in_({item.medication_id for item in items}))}
     for item in items:
-        med = db.query(models.Medication).filter(models.Medication.id == item.medication_id).first()
+        med = meds.get(item.medication_id)
         if not med:
+            db.rollback()
             raise HTTPException(status_code=400, detail=f"药品ID {item.medication_id} 不存在")
-        if med.stock < item.quantity:
+        taken = db.execute(
+            update(M)
+            .where(M.id == med.id, M.stock >= item.quantity)
+            .values(stock=M.stock - item.quantity)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not taken:
+            db.rollback()
             raise HTTPException(status_code=400, detail=f"药品 {med.name} 库存不足 (需: {item.quantity}, 剩: {med.stock})")
 
-    # 扣减库存
-    for item in items:
-        med = db.query(models.Medication).filter(models.Medication.id == item.medication_id).first()
-        med.stock -= item.quantity
-    
-    p.status = models.PrescriptionStatus.dispensed
     db.commit()
     
     return {"message": "发药成功", "prescription_id": p.id}
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from pydantic import BaseModel, Field
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 
 from backend.database import get_db
 from backend import models
 from backend.core.security import TokenPayload, get_current_user
 from backend.core.permissions import require_self_or_admin
+from backend.core.query_stats import query_budget
+from backend.core.pagination import Keyset, PageParams, page_params
+from backend.services import prescriptions as prescription_service
 
 router = APIRouter(prefix="/api/profile", tags=["Profile"])
 
@@ -83,38 +87,59 @@ def update_me(
         return {"message": "ok"}
 
 
+MEDICAL_RECORD_KEYSET = Keyset(models.MedicalRecord.created_at, models.MedicalRecord.id)
+
+
 @router.get("/my-records")
 def get_my_records(
+    response: Response,
+    page: PageParams = Depends(page_params),
     current_user: TokenPayload = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """获取我的病历（患者）"""
+    """获取我的病历（患者），按 cursor 翻页"""
     user_id = current_user.user_id
-    records = db.query(models.MedicalRecord).filter(models.MedicalRecord.patient_id == user_id).order_by(models.MedicalRecord.created_at.desc()).all()
-    return records
+    q = db.query(models.MedicalRecord).filter(models.MedicalRecord.patient_id == user_id)
+    records = MEDICAL_RECORD_KEYSET.apply(q, page).all()
+    return MEDICAL_RECORD_KEYSET.page(records, page, response)
 
 
-@router.get("/my-prescriptions")
+@router.get("/my-prescriptions", dependencies=[Depends(query_budget(1))])
 def get_my_prescriptions(
+    response: Response,
+    page: PageParams = Depends(page_params),
     current_user: TokenPayload = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """获取我的处方（患者）"""
+    """获取我的处方（患者），按 cursor 翻页"""
     user_id = current_user.user_id
-    prescriptions = db.query(models.Prescription).filter(models.Prescription.patient_id == user_id).order_by(models.Prescription.created_at.desc()).all()
-    
-    # 填充详情
+    views = prescription_service.fetch_prescriptions(db, patient_id=user_id, page=page)
+    # 填充详情（明细与药品名称由处方投影一次查询取回）
     results = []
-    for p in prescriptions:
-        items = db.query(models.PrescriptionItem).filter(models.PrescriptionItem.prescription_id == p.id).all()
-        p_items = []
-        for i in items:
-            med = db.query(models.Medication).filter(models.Medication.id == i.medication_id).first()
-            item_dict = i.__dict__
-            item_dict["medication_name"] = med.name if med else "未知药品"
-            p_items.append(item_dict)
-        p.items = p_items
-        results.append(p)
+    for p in prescription_service.PRESCRIPTION_KEYSET.page(views, page, response):
+        results.append({
+            "id": p.id,
+            "medical_record_id": p.medical_record_id,
+            "doctor_id": p.doctor_id,
+            "patient_id": p.patient_id,
+            "status": p.status,
+            "total_price": p.total_price,
+            "notes": p.notes,
+            "created_at": p.created_at,
+            "updated_at": p.updated_at,
+            "items": [
+                {
+                    "id": i.id,
+                    "prescription_id": i.prescription_id,
+                    "medication_id": i.medication_id,
+                    "quantity": i.quantity,
+                    "price_at_time": i.price_at_time,
+                    "usage_instruction": i.usage_instruction,
+                    "medication_name": i.medication_name or "未知药品",
+                }
+                for i in p.items
+            ],
+        })
     return results
 
 
@@ -133,9 +158,15 @@ def pay_prescription(
     if p.patient_id != user_id:
         raise HTTPException(status_code=403, detail="无权操作此处方")
 
-    if p.status != models.PrescriptionStatus.pending:
+    # 条件更新：并发的重复支付只有一次生效（带 Idempotency-Key 的重试直接回放首次响应）
+    paid = db.execute(
+        update(models.Prescription)
+        .where(models.Prescription.id == p.id, models.Prescription.status == models.PrescriptionStatus.pending)
+        .values(status=models.PrescriptionStatus.paid)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not paid:
+        db.rollback()
         raise HTTPException(status_code=400, detail="当前状态无法支付")
-        
-    p.status = models.PrescriptionStatus.paid
     db.commit()
     return {"message": "支付成功", "prescription_id": p.id}
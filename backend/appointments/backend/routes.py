@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, func, insert, select, update
 from typing import List, Optional
+import json
 import sys
 import os
 from datetime import datetime, timedelta, date
@@ -9,10 +12,15 @@ from datetime import datetime, timedelta, date
 # 添加backend目录到路径
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'backend'))
 
-from database import get_db
+from database import get_db, get_async_db, get_async_read_db, get_read_db
 import models, schemas
+from core import conditional
 from core.security import TokenPayload, get_current_user
 from core.permissions import require_doctor
+from core.pagination import Keyset, PageParams, page_params
+from backend.services import admission, booking, doctor_appointments, doctor_directory, schedule_materializer, slot_holds, striped_counters, waitlist
+from backend.services.slot_feed import feed
+from backend.services.slot_inventory import inventory
 
 router = APIRouter(prefix="", tags=["预约管理"])
 
@@ -28,66 +36,33 @@ def _ensure_within_next_week(target_date: date):
 # ========== 公共/患者端 ==========
 
 @router.get("/appointments/doctors")
-def list_available_doctors(db: Session = Depends(get_db)):
-    """列出可预约医生及其可用排班数量（仅未来7天）"""
-    doctors = db.query(models.User).filter(
-        models.User.role == models.UserRole.doctor,
-        models.User.status == models.UserStatus.active
-    ).all()
-
-    today = datetime.today().date()
-    last = today + timedelta(days=7)
-    result = []
-    for d in doctors:
-        profile = db.query(models.DoctorProfile).filter(models.DoctorProfile.user_id == d.id).first()
-        available_query = db.query(models.DoctorSchedule).filter(
-            models.DoctorSchedule.doctor_id == d.id,
-            models.DoctorSchedule.status == models.ScheduleStatus.open,
-            models.DoctorSchedule.date >= today,
-            models.DoctorSchedule.date <= last,
-            models.DoctorSchedule.capacity > models.DoctorSchedule.booked_count
-        )
-        available_count = available_query.count()
-        result.append({
-            "id": d.id,
-            "name": getattr(profile, "name", None),
-            "department": getattr(profile, "department", None),
-            "title": getattr(profile, "title", None),
-            "phone": d.phone,
-            "available_schedules": available_count,
-            "fully_booked": available_count == 0
-        })
-    return result
+async def list_available_doctors(
+    department: Optional[str] = Query(None),
+    title: Optional[str] = Query(None),
+):
+    """列出可预约医生及其可用排班数量（仅未来7天），可按科室/职称过滤"""
+    # 余号数取自号源库存缓存（写穿实时），名录本身按 TTL 缓存
+    await inventory.ensure_loaded_async()
+    return doctor_directory.public_view(await doctor_directory.directory.entries_async(), department, title)
 
 
 @router.get("/appointments/doctor/{doctor_id}/schedules", response_model=List[schemas.ScheduleResponse])
-def list_doctor_schedules(doctor_id: int, date: Optional[str] = Query(None), db: Session = Depends(get_db)):
-    """获取医生的可用排班（可按日期过滤），仅未来7日"""
-    today = datetime.today().date()
-    last = today + timedelta(days=7)
-    q = db.query(models.DoctorSchedule).filter(
-        models.DoctorSchedule.doctor_id == doctor_id,
-        models.DoctorSchedule.status == models.ScheduleStatus.open,
-        models.DoctorSchedule.date >= today,
-        models.DoctorSchedule.date <= last
-    )
+def list_doctor_schedules(doctor_id: int, date: Optional[str] = Query(None)):
+    """获取医生的可用排班（可按日期过滤），仅未来7日；直接读号源库存缓存"""
+    day = None
     if date:
         try:
-            dt = datetime.strptime(date, "%Y-%m-%d").date()
-            _ensure_within_next_week(dt)
-            q = q.filter(models.DoctorSchedule.date == dt)
+            day = datetime.strptime(date, "%Y-%m-%d").date()
         except ValueError:
             raise HTTPException(status_code=400, detail="日期格式错误，应为YYYY-MM-DD")
-    schedules = q.all()
-    for s in schedules:
-        s.fully_booked = s.booked_count >= s.capacity  # type: ignore
-    return schedules
+        _ensure_within_next_week(day)
+    return inventory.schedules(doctor_id, day)
 
 
 @router.post("/appointments", response_model=schemas.AppointmentResponse)
-def create_appointment(payload: schemas.AppointmentCreate, db: Session = Depends(get_db)):
+async def create_appointment(payload: schemas.AppointmentCreate, db: AsyncSession = Depends(get_async_db)):
     """创建预约（最简版本：若患者不存在则自动创建激活患者）"""
-    patient = db.query(models.User).filter(models.User.id == payload.patient_id).first()
+    patient = await db.get(models.User, payload.patient_id)
     if not patient:
         try:
             pid = int(payload.patient_id)
@@ -101,19 +76,19 @@ def create_appointment(payload: schemas.AppointmentCreate, db: Session = Depends
             status=models.UserStatus.active,
         )
         db.add(patient)
-        db.commit()
+        await db.commit()
     # 确保患者档案存在，便于医生端显示实名
-    profile = db.query(models.PatientProfile).filter(models.PatientProfile.user_id == patient.id).first()
+    profile = await db.scalar(select(models.PatientProfile).where(models.PatientProfile.user_id == patient.id))
     if not profile:
         profile = models.PatientProfile(user_id=patient.id, name=patient.phone)
         db.add(profile)
-        db.commit()
+        await db.commit()
 
-    doctor = db.query(models.User).filter(models.User.id == payload.doctor_id).first()
+    doctor = await db.get(models.User, payload.doctor_id)
     if not doctor or doctor.role != models.UserRole.doctor or doctor.status != models.UserStatus.active:
         raise HTTPException(status_code=400, detail="医生不存在或未激活")
 
-    schedule = db.query(models.DoctorSchedule).filter(models.DoctorSchedule.id == payload.schedule_id).first()
+    schedule = await db.get(models.DoctorSchedule, payload.schedule_id)
     if not schedule or schedule.doctor_id != doctor.id:
         raise HTTPException(status_code=400, detail="排班不存在或不属于该医生")
     if schedule.status != models.ScheduleStatus.open:
@@ -121,70 +96,93 @@ def create_appointment(payload: schemas.AppointmentCreate, db: Session = Depends
     # 限制未来7天
     _ensure_within_next_week(schedule.date)
 
-    # 重复预约检查
-    exists = db.query(models.Appointment).filter(
-        and_(
-            models.Appointment.patient_id == patient.id,
-            models.Appointment.schedule_id == schedule.id,
-            models.Appointment.status != models.AppointmentStatus.cancelled,
-        )
-    ).first()
-    if exists:
-        return exists  # 幂等返回
-
-    # 容量检查
-    if schedule.booked_count >= schedule.capacity:
-        raise HTTPException(status_code=400, detail="排班容量不足")
-
-    # 创建预约（简单事务）
-    appt = models.Appointment(
-        patient_id=patient.id,
-        doctor_id=doctor.id,
-        schedule_id=schedule.id,
-        status=models.AppointmentStatus.scheduled,
-    )
-    schedule.booked_count += 1
-    # 同步日聚合表计数
-    day = db.query(models.DoctorDaySchedule).filter(
-        models.DoctorDaySchedule.doctor_id == doctor.id,
-        models.DoctorDaySchedule.date == schedule.date
-    ).first()
-    if not day:
-        day = models.DoctorDaySchedule(doctor_id=doctor.id, date=schedule.date)
-        db.add(day)
-    sh = int(str(schedule.start_time).split(":")[0])
-    if sh < 12:
-        day.am_booked_count = (day.am_booked_count or 0) + 1
-        if day.am_capacity and day.am_booked_count > day.am_capacity:
-            raise HTTPException(status_code=400, detail="上午容量已满")
-    else:
-        day.pm_booked_count = (day.pm_booked_count or 0) + 1
-        if day.pm_capacity and day.pm_booked_count > day.pm_capacity:
-            raise HTTPException(status_code=400, detail="下午容量已满")
-    db.add(appt)
-    db.commit()
-    db.refresh(appt)
+    if admission.ENABLED:
+        # 放号高峰削峰：按医生/日期排队成批受理；等待超时返回 202 与票据，客户端轮询票据取结果
+        patient_id, doctor_id, schedule_id, day = patient.id, doctor.id, schedule.id, schedule.date
+        # 批事务在工作线程里用另一个会话提交：先结束本会话的事务，排队期间不占连接，
+        # 之后的读取开新事务（MySQL 可重复读下沿用旧快照读不到批里刚提交的预约）
+        await db.rollback()
+        ticket = admission.controller.submit(patient_id, doctor_id, schedule_id, day)
+        if not await admission.controller.wait(ticket, admission.WAIT_SECONDS):
+            return JSONResponse(status_code=202, content=admission.controller.view(ticket))
+        if ticket.status == "rejected":
+            raise HTTPException(status_code=400, detail=ticket.detail)
+        appt = await db.get(models.Appointment, ticket.appointment_id)
+        if appt is None:
+            # 已挂上但本连接暂时还读不到：返回票据，客户端轮询票据取结果
+            return JSONResponse(status_code=202, content=admission.controller.view(ticket))
+        return appt
+
+    # 占号（条件 UPDATE）+ 创建预约在同一事务内完成；已有有效预约时幂等返回
+    try:
+        appt, _ = await db.run_sync(booking.book, patient.id, doctor.id, schedule.id,
+                                    daily_cap=booking.PATIENT_DAILY_CAP)
+    except booking.BookingError as e:
+        raise HTTPException(status_code=400, detail=e.detail)
     return appt
 
 
+@router.get("/appointments/slots/stream")
+async def stream_slots(
+    request: Request,
+    doctor_id: Optional[int] = Query(None),
+    department: Optional[str] = Query(None),
+    date: Optional[str] = Query(None),
+):
+    """号源变化推送（SSE）：先发 snapshot（当前号源），之后发合并后的 slots 变化；可按医生、科室、日期过滤"""
+    day = None
+    if date:
+        try:
+            day = datetime.strptime(date, "%Y-%m-%d").date()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="日期格式错误，应为YYYY-MM-DD")
+        _ensure_within_next_week(day)
+    doctor_ids = None
+    if doctor_id is not None:
+        doctor_ids = {doctor_id}
+    if department:
+        members = {e.id for e in await doctor_directory.directory.entries_async() if e.department == department}
+        doctor_ids = members if doctor_ids is None else doctor_ids & members
+    await inventory.ensure_loaded_async()
+    sub = feed.subscribe(doctor_ids, day)
+    return StreamingResponse(
+        feed.stream(sub, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/appointments/tickets/{ticket_id}")
+def get_booking_ticket(ticket_id: str):
+    """查询挂号排队票据：排队位置、状态（queued/processing/booked/rejected）与结果"""
+    ticket = admission.controller.get(ticket_id)
+    if not ticket:
+        raise HTTPException(status_code=404, detail="票据不存在或已过期")
+    return admission.controller.view(ticket)
+
+
+APPOINTMENT_KEYSET = Keyset(models.Appointment.created_at, models.Appointment.id)
+
+
 @router.get("/appointments/my")
-def my_appointments(
+async def my_appointments(
+    response: Response,
+    page: PageParams = Depends(page_params),
     current_user: TokenPayload = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
-    """患者查看自己的预约（含医生和时间信息）"""
+    """患者查看自己的预约（含医生和时间信息），按 cursor 翻页"""
     patient_id = current_user.user_id
-    rows = (
-        db.query(models.Appointment, models.DoctorSchedule, models.User, models.DoctorProfile)
+    q = (
+        select(models.Appointment, models.DoctorSchedule, models.User, models.DoctorProfile)
         .join(models.DoctorSchedule, models.Appointment.schedule_id == models.DoctorSchedule.id)
         .join(models.User, models.Appointment.doctor_id == models.User.id)
         .outerjoin(models.DoctorProfile, models.DoctorProfile.user_id == models.User.id)
-        .filter(models.Appointment.patient_id == patient_id)
-        .order_by(models.Appointment.created_at.desc())
-        .all()
+        .where(models.Appointment.patient_id == patient_id)
     )
+    rows = (await db.execute(APPOINTMENT_KEYSET.apply(q, page))).all()
     result = []
-    for appt, sched, doctor_user, doctor_profile in rows:
+    for appt, sched, doctor_user, doctor_profile in APPOINTMENT_KEYSET.page(rows, page, response, key=lambda row: row[0]):
         appt_time = f"{str(sched.start_time)[:5]}-{str(sched.end_time)[:5]}"
         result.append({
             "id": appt.id,
@@ -212,28 +210,123 @@ def cancel_appointment(
     appt = db.query(models.Appointment).filter(models.Appointment.id == appointment_id).first()
     if not appt or appt.patient_id != patient_id:
         raise HTTPException(status_code=404, detail="预约不存在或无权限")
-    if appt.status == models.AppointmentStatus.cancelled:
-        return {"message": "已取消"}
-    appt.status = models.AppointmentStatus.cancelled
-    # 回滚容量
-    schedule = db.query(models.DoctorSchedule).filter(models.DoctorSchedule.id == appt.schedule_id).first()
-    if schedule and schedule.booked_count > 0:
-        schedule.booked_count -= 1
-        # 同步日聚合表计数回滚
-        day = db.query(models.DoctorDaySchedule).filter(
-            models.DoctorDaySchedule.doctor_id == appt.doctor_id,
-            models.DoctorDaySchedule.date == schedule.date
-        ).first()
-        if day:
-            sh = int(str(schedule.start_time).split(":")[0])
-            if sh < 12 and day.am_booked_count > 0:
-                day.am_booked_count -= 1
-            elif sh >= 12 and day.pm_booked_count > 0:
-                day.pm_booked_count -= 1
-    db.commit()
+    # 状态条件更新 + 退号在同一事务内完成，重复取消不会重复回补容量
+    booking.cancel(db, appt.id)
     return {"message": "已取消"}
 
 
+@router.post("/appointments/holds", response_model=schemas.HoldResponse)
+def hold_slot(
+    payload: schemas.HoldCreate,
+    current_user: TokenPayload = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """两段式挂号第一步：暂占一个号，有效期内确认后转为预约，过期自动释放"""
+    doctor = db.get(models.User, payload.doctor_id)
+    if not doctor or doctor.role != models.UserRole.doctor or doctor.status != models.UserStatus.active:
+        raise HTTPException(status_code=400, detail="医生不存在或未激活")
+    schedule = db.get(models.DoctorSchedule, payload.schedule_id)
+    if not schedule or schedule.doctor_id != doctor.id:
+        raise HTTPException(status_code=400, detail="排班不存在或不属于该医生")
+    if schedule.status != models.ScheduleStatus.open:
+        raise HTTPException(status_code=400, detail="排班未开放")
+    _ensure_within_next_week(schedule.date)
+    try:
+        entry, _ = slot_holds.hold(db, current_user.user_id, doctor.id, schedule.id,
+                                   daily_cap=booking.PATIENT_DAILY_CAP)
+    except booking.BookingError as e:
+        raise HTTPException(status_code=400, detail=e.detail)
+    return entry
+
+
+@router.post("/appointments/holds/{hold_id}/confirm", response_model=schemas.AppointmentResponse)
+def confirm_hold(
+    hold_id: int,
+    current_user: TokenPayload = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """两段式挂号第二步：有效期内把暂占号转为预约"""
+    try:
+        return slot_holds.confirm(db, hold_id, current_user.user_id, daily_cap=booking.PATIENT_DAILY_CAP)
+    except booking.BookingError as e:
+        raise HTTPException(status_code=400, detail=e.detail)
+
+
+@router.delete("/appointments/holds/{hold_id}")
+def release_hold(
+    hold_id: int,
+    current_user: TokenPayload = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """放弃暂占号"""
+    entry = db.get(models.SlotHold, hold_id)
+    if not entry or entry.patient_id != current_user.user_id:
+        raise HTTPException(status_code=404, detail="暂占号不存在或无权限")
+    if not slot_holds.release(db, entry.id, current_user.user_id):
+        raise HTTPException(status_code=400, detail="暂占号已确认或已失效")
+    return {"message": "已释放"}
+
+
+@router.post("/appointments/waitlist", response_model=schemas.WaitlistResponse)
+def join_waitlist(
+    payload: schemas.WaitlistCreate,
+    current_user: TokenPayload = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """排班满员时加入候补；有人退号时按加入顺序自动转为预约"""
+    schedule = db.get(models.DoctorSchedule, payload.schedule_id)
+    if not schedule or schedule.doctor_id != payload.doctor_id:
+        raise HTTPException(status_code=400, detail="排班不存在或不属于该医生")
+    _ensure_within_next_week(schedule.date)
+    try:
+        entry = waitlist.join(db, current_user.user_id, payload.doctor_id, payload.schedule_id)
+    except booking.BookingError as e:
+        raise HTTPException(status_code=400, detail=e.detail)
+    result = schemas.WaitlistResponse.model_validate(entry)
+    result.position = waitlist.position(db, entry)
+    return result
+
+
+@router.get("/appointments/waitlist/my", response_model=List[schemas.WaitlistResponse])
+def my_waitlist(
+    current_user: TokenPayload = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """患者查看自己的候补（最近 50 条），等待中的附排位"""
+    W = models.AppointmentWaitlist
+    ahead = W.__table__.alias("ahead")
+    position = (
+        select(func.count())
+        .where(ahead.c.schedule_id == W.schedule_id, ahead.c.status == models.WaitlistStatus.waiting,
+               ahead.c.id <= W.id)
+        .scalar_subquery()
+    )
+    rows = db.execute(
+        select(W, position).where(W.patient_id == current_user.user_id).order_by(W.id.desc()).limit(50)
+    ).all()
+    result = []
+    for entry, pos in rows:
+        item = schemas.WaitlistResponse.model_validate(entry)
+        item.position = pos if entry.status == models.WaitlistStatus.waiting else None
+        result.append(item)
+    return result
+
+
+@router.delete("/appointments/waitlist/{entry_id}")
+def leave_waitlist(
+    entry_id: int,
+    current_user: TokenPayload = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """退出候补"""
+    entry = db.get(models.AppointmentWaitlist, entry_id)
+    if not entry or entry.patient_id != current_user.user_id:
+        raise HTTPException(status_code=404, detail="候补不存在或无权限")
+    if not waitlist.leave(db, entry.id):
+        raise HTTPException(status_code=400, detail="候补已结束，无法退出")
+    return {"message": "已退出候补"}
+
+
 @router.post("/appointments/{appointment_id}/status", dependencies=[Depends(require_doctor)])
 def update_appointment_status(
     appointment_id: int,
@@ -252,23 +345,11 @@ def update_appointment_status(
         models.AppointmentStatus.cancelled.value,
     ]:
         raise HTTPException(status_code=400, detail="非法状态")
-    appt.status = models.AppointmentStatus(status)
-    # 如取消则回滚容量
-    if appt.status == models.AppointmentStatus.cancelled:
-        schedule = db.query(models.DoctorSchedule).filter(models.DoctorSchedule.id == appt.schedule_id).first()
-        if schedule and schedule.booked_count > 0:
-            schedule.booked_count -= 1
-            day = db.query(models.DoctorDaySchedule).filter(
-                models.DoctorDaySchedule.doctor_id == appt.doctor_id,
-                models.DoctorDaySchedule.date == schedule.date
-            ).first()
-            if day:
-                sh = int(str(schedule.start_time).split(":")[0])
-                if sh < 12 and day.am_booked_count > 0:
-                    day.am_booked_count -= 1
-                elif sh >= 12 and day.pm_booked_count > 0:
-                    day.pm_booked_count -= 1
-    db.commit()
+    # 改为取消时退号，从取消恢复时重新占号
+    try:
+        booking.set_status(db, appt.id, models.AppointmentStatus(status))
+    except booking.BookingError as e:
+        raise HTTPException(status_code=400, detail=e.detail)
     return {"message": "状态已更新"}
 
 
@@ -283,6 +364,44 @@ def doctor_my_schedules(
     return db.query(models.DoctorSchedule).filter(models.DoctorSchedule.doctor_id == doctor_id).all()
 
 
+@router.get("/doctor/schedules/calendar", dependencies=[Depends(require_doctor)])
+def doctor_schedule_calendar(
+    request: Request,
+    month: str = Query(..., description="起始月份 YYYY-MM"),
+    months: int = Query(1, ge=1, le=3, description="月数，1 为月视图，3 为季度视图"),
+    current_user: TokenPayload = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    """
+    医生日历：按列返回区间内各出诊日的上午/下午容量与已约数（含暂占），只读日聚合表的覆盖索引（见迁移 9）
+    带 ETag，内容未变时 If-None-Match 返回 304
+    """
+    try:
+        first = datetime.strptime(month, "%Y-%m").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="月份格式错误，应为YYYY-MM")
+    y, m = divmod(first.month - 1 + months, 12)
+    end = date(first.year + y, m + 1, 1)
+    D = models.DoctorDaySchedule
+    rows = db.execute(
+        select(D.date, D.am_capacity, D.am_booked_count, D.pm_capacity, D.pm_booked_count)
+        .where(D.doctor_id == current_user.user_id, D.date >= first, D.date < end)
+        .order_by(D.date)
+    ).all()
+    body = json.dumps({
+        "start": first.isoformat(),
+        "end": (end - timedelta(days=1)).isoformat(),
+        "dates": [r.date.isoformat() for r in rows],
+        "am_capacity": [r.am_capacity for r in rows],
+        "am_booked": [r.am_booked_count for r in rows],
+        "pm_capacity": [r.pm_capacity for r in rows],
+        "pm_booked": [r.pm_booked_count for r in rows],
+    }, separators=(",", ":"))
+    etag = conditional.make_etag(body)
+    return conditional.not_modified(request, etag) \
+        or conditional.apply(Response(content=body, media_type="application/json"), etag)
+
+
 @router.post("/doctor/schedules", response_model=schemas.ScheduleResponse, dependencies=[Depends(require_doctor)])
 def create_schedule(payload: schemas.ScheduleCreate, db: Session = Depends(get_db)):
     doctor = db.query(models.User).filter(models.User.id == payload.doctor_id).first()
@@ -309,6 +428,8 @@ def create_schedule(payload: schemas.ScheduleCreate, db: Session = Depends(get_d
         exist.end_time = payload.end_time
         exist.status = models.ScheduleStatus.open
         db.commit()
+        # 分片计数的排班按新容量重新分配各分片，随日聚合容量一起提交
+        striped_counters.resync(db, exist.id)
         db.refresh(exist)
         # 同步日聚合表容量
         day = db.query(models.DoctorDaySchedule).filter(
@@ -323,6 +444,7 @@ def create_schedule(payload: schemas.ScheduleCreate, db: Session = Depends(get_d
         else:
             day.pm_capacity = payload.capacity
         db.commit()
+        inventory.refresh(db, [exist.id])
         return exist
     else:
         schedule = models.DoctorSchedule(
@@ -349,6 +471,7 @@ def create_schedule(payload: schemas.ScheduleCreate, db: Session = Depends(get_d
         else:
             day.pm_capacity = payload.capacity
         db.commit()
+        inventory.refresh(db, [schedule.id])
         return schedule
 
 
@@ -362,114 +485,177 @@ def delete_schedule(
     schedule = db.query(models.DoctorSchedule).filter(models.DoctorSchedule.id == schedule_id).first()
     if not schedule or schedule.doctor_id != doctor_id:
         raise HTTPException(status_code=404, detail="排班不存在或无权限")
-    # 若已有非取消预约则禁止删除
+    S, H, W = models.DoctorSchedule, models.SlotHold, models.AppointmentWaitlist
+    # 先关闭排班：条件 UPDATE 拿到行锁，之后的挂号、暂占、候补都会因排班未开放而失败，检查与删除之间不会再有新占用
+    db.execute(update(S).where(S.id == schedule.id).values(status=models.ScheduleStatus.closed)
+               .execution_options(synchronize_session=False))
+    # 若已有非取消预约、未了结的暂占号或等待中的候补则禁止删除（暂占号确认、候补转预约都要用到排班）
     has_appt = db.query(models.Appointment).filter(
         models.Appointment.schedule_id == schedule.id,
         models.Appointment.status != models.AppointmentStatus.cancelled
     ).count() > 0
-    if has_appt:
-        raise HTTPException(status_code=400, detail="该排班已有预约，不可删除")
+    has_hold = db.scalar(select(H.id).where(H.schedule_id == schedule.id, H.status == models.HoldStatus.held).limit(1))
+    has_waiting = db.scalar(
+        select(W.id).where(W.schedule_id == schedule.id, W.status == models.WaitlistStatus.waiting).limit(1)
+    )
+    if has_appt or has_hold is not None or has_waiting is not None:
+        db.rollback()
+        if has_appt:
+            raise HTTPException(status_code=400, detail="该排班已有预约，不可删除")
+        if has_hold is not None:
+            raise HTTPException(status_code=400, detail="该排班有患者正在暂占号源，不可删除")
+        raise HTTPException(status_code=400, detail="该排班有候补中的患者，不可删除")
+    # 已了结的暂占号、候补记录与计数分片只依附于该排班，随排班一起删除
+    for model in (H, W, models.ScheduleCounterStripe):
+        db.execute(delete(model).where(model.schedule_id == schedule.id).execution_options(synchronize_session=False))
     db.delete(schedule)
     db.commit()
+    inventory.refresh(db, [schedule_id])
     return {"message": "已删除"}
 
 
+@router.get("/doctor/schedule-templates/my", response_model=List[schemas.ScheduleTemplateResponse], dependencies=[Depends(require_doctor)])
+def my_schedule_templates(
+    current_user: TokenPayload = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """当前医生的周排班模板"""
+    T = models.DoctorScheduleTemplate
+    return db.query(T).filter(T.doctor_id == current_user.user_id).order_by(T.weekday).all()
+
+
+@router.put("/doctor/schedule-templates", response_model=List[schemas.ScheduleTemplateResponse], dependencies=[Depends(require_doctor)])
+def save_schedule_templates(
+    items: List[schemas.ScheduleTemplateItem],
+    current_user: TokenPayload = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """按星期覆盖周模板（未提交的星期保持不变），并立即为该医生生成窗口内尚未存在的排班"""
+    weekdays = [item.weekday for item in items]
+    if len(set(weekdays)) != len(weekdays):
+        raise HTTPException(status_code=400, detail="同一星期只能提交一条模板")
+    doctor_id = current_user.user_id
+    T = models.DoctorScheduleTemplate
+    existing = {t.weekday: t for t in db.query(T).filter(T.doctor_id == doctor_id).all()}
+    created = []
+    for item in items:
+        template = existing.get(item.weekday)
+        if template is None:
+            created.append({"doctor_id": doctor_id, **item.model_dump()})
+        else:
+            template.am_capacity = item.am_capacity
+            template.pm_capacity = item.pm_capacity
+    if created:
+        db.execute(insert(T), created)
+    db.commit()
+    schedule_materializer.materialize(db, doctor_ids=[doctor_id])
+    return db.query(T).filter(T.doctor_id == doctor_id).order_by(T.weekday).all()
+
+
 @router.get("/doctor/appointments/my", response_model=List[schemas.AppointmentResponse], dependencies=[Depends(require_doctor)])
 def doctor_my_appointments(
+    response: Response,
+    page: PageParams = Depends(page_params),
     current_user: TokenPayload = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     doctor_id = current_user.user_id
-    return db.query(models.Appointment).filter(models.Appointment.doctor_id == doctor_id).all()
+    q = db.query(models.Appointment).filter(models.Appointment.doctor_id == doctor_id)
+    return APPOINTMENT_KEYSET.page(APPOINTMENT_KEYSET.apply(q, page).all(), page, response)
 
 
-@router.get("/appointments/doctor/{doctor_id}")
-def doctor_appointments(
+def _parse_day(value: Optional[str], name: str) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} 格式错误，应为YYYY-MM-DD")
+
+
+def _doctor_appointment_rows(
+    request: Request,
+    response: Response,
     doctor_id: int,
-    date_from: Optional[str] = Query(None),
-    date_to: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    date_from: Optional[str],
+    date_to: Optional[str],
+    status: Optional[models.AppointmentStatus],
+    page: PageParams,
+    db: Session,
 ):
-    """医生端查看预约列表，附带患者姓名/电话"""
-    q = (
-        db.query(models.Appointment, models.DoctorSchedule, models.User, models.PatientProfile)
-        .join(models.DoctorSchedule, models.Appointment.schedule_id == models.DoctorSchedule.id)
-        .join(models.User, models.Appointment.patient_id == models.User.id)
-        .outerjoin(models.PatientProfile, models.PatientProfile.user_id == models.User.id)
-        .filter(models.Appointment.doctor_id == doctor_id)
-    )
+    """
+    医生端预约列表公共部分：窗口内的版本戳与分页参数组成 ETag，命中 If-None-Match 时返回 304 响应，
+    否则返回本页行（下一页游标写入 X-Next-Cursor）
+    """
+    try:
+        start, end = doctor_appointments.window(_parse_day(date_from, "date_from"), _parse_day(date_to, "date_to"))
+    except doctor_appointments.WindowError as e:
+        raise HTTPException(status_code=400, detail=e.detail)
+    stamp = doctor_appointments.version(db, doctor_id, start, end, status)
+    etag = conditional.make_etag(request.url.path, doctor_id, start, end, status and status.value,
+                                 page.cursor, page.limit, stamp)
+    cached = conditional.not_modified(request, etag)
+    if cached is not None:
+        return cached
+    conditional.apply(response, etag)
+    rows = doctor_appointments.fetch(db, doctor_id, start, end, status, page)
+    return doctor_appointments.KEYSET.page(rows, page, response)
 
-    if date_from:
-        try:
-            dtf = datetime.strptime(date_from, "%Y-%m-%d").date()
-            q = q.filter(models.DoctorSchedule.date >= dtf)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="date_from 格式错误，应为YYYY-MM-DD")
-    if date_to:
-        try:
-            dtt = datetime.strptime(date_to, "%Y-%m-%d").date()
-            q = q.filter(models.DoctorSchedule.date < dtt)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="date_to 格式错误，应为YYYY-MM-DD")
 
-    rows = q.order_by(models.DoctorSchedule.date, models.DoctorSchedule.start_time).all()
-    result = []
-    for appt, sched, patient_user, patient_profile in rows:
-        patient_name = (getattr(patient_profile, "name", None) or "").strip() or patient_user.phone
-        result.append({
-            "id": appt.id,
-            "appointment_date": sched.date.isoformat(),
-            "appointment_time": f"{str(sched.start_time)[:5]}-{str(sched.end_time)[:5]}",
-            "status": appt.status.value if hasattr(appt.status, 'value') else appt.status,
-            "patient_id": patient_user.id,
-            "patient_name": patient_name,
-            "patient_phone": patient_user.phone,
-            "created_at": appt.created_at,
-        })
-    return result
+@router.get("/appointments/doctor/{doctor_id}")
+def doctor_appointments_list(
+    doctor_id: int,
+    request: Request,
+    response: Response,
+    date_from: Optional[str] = Query(None, description="起始日期（含），YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="结束日期（不含），YYYY-MM-DD"),
+    status: Optional[models.AppointmentStatus] = Query(None),
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_read_db)
+):
+    """医生端查看预约列表，附带患者姓名/电话；限定日期窗口、按 cursor 翻页，未变化时返回 304"""
+    rows = _doctor_appointment_rows(request, response, doctor_id, date_from, date_to, status, page, db)
+    if isinstance(rows, Response):
+        return rows
+    return [
+        {
+            "id": row.id,
+            "appointment_date": row.date.isoformat(),
+            "appointment_time": f"{str(row.start_time)[:5]}-{str(row.end_time)[:5]}",
+            "status": row.status.value,
+            "patient_id": row.patient_id,
+            "patient_name": doctor_appointments.display_name(row),
+            "patient_phone": row.patient_phone,
+            "created_at": row.created_at,
+        }
+        for row in rows
+    ]
 
 
 @router.get("/doctor/appointments/my_detailed")
 def doctor_my_appointments_detailed(
     doctor_id: int,
-    date_from: Optional[str] = Query(None),
-    date_to: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    date_from: Optional[str] = Query(None, description="起始日期（含），YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="结束日期（不含），YYYY-MM-DD"),
+    status: Optional[models.AppointmentStatus] = Query(None),
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_read_db)
 ):
-    """医生端查看自己的预约（含患者信息与预约时间）"""
-    q = (
-        db.query(models.Appointment, models.DoctorSchedule, models.User, models.PatientProfile)
-        .join(models.DoctorSchedule, models.Appointment.schedule_id == models.DoctorSchedule.id)
-        .join(models.User, models.Appointment.patient_id == models.User.id)
-        .outerjoin(models.PatientProfile, models.PatientProfile.user_id == models.User.id)
-        .filter(models.Appointment.doctor_id == doctor_id)
-    )
-
-    if date_from:
-        try:
-            dtf = datetime.strptime(date_from, "%Y-%m-%d").date()
-            q = q.filter(models.DoctorSchedule.date >= dtf)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="date_from 格式错误，应为 YYYY-MM-DD")
-    if date_to:
-        try:
-            dtt = datetime.strptime(date_to, "%Y-%m-%d").date()
-            q = q.filter(models.DoctorSchedule.date < dtt)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="date_to 格式错误，应为 YYYY-MM-DD")
-
-    rows = q.order_by(models.DoctorSchedule.date, models.DoctorSchedule.start_time).all()
-    result = []
-    for appt, sched, patient, patient_profile in rows:
-        appt_dt = datetime.combine(sched.date, sched.start_time)
-        patient_name = (getattr(patient_profile, "name", None) or "").strip() or getattr(patient, "phone", "")
-        result.append({
-            "id": appt.id,
-            "appointment_date": appt_dt.isoformat(),
-            "status": appt.status.value if hasattr(appt.status, "value") else appt.status,
+    """医生端查看自己的预约（含患者信息与预约时间）；与上一个接口共用查询，只是返回形状不同"""
+    rows = _doctor_appointment_rows(request, response, doctor_id, date_from, date_to, status, page, db)
+    if isinstance(rows, Response):
+        return rows
+    return [
+        {
+            "id": row.id,
+            "appointment_date": datetime.combine(row.date, row.start_time).isoformat(),
+            "status": row.status.value,
             "patient": {
-                "name": patient_name,
-                "phone": getattr(patient, "phone", "")
-            }
-        })
-    return result
+                "name": doctor_appointments.display_name(row),
+                "phone": row.patient_phone,
+            },
+        }
+        for row in rows
+    ]
@@ -0,0 +1,159 @@
+"""
+放号高峰压测：同一秒内大量挂号请求，对比“每个请求各自一个写事务”与“排队成批受理”
+
+    cd backend
+    python bench_booking_admission.py                          # direct 与 fifo 各跑一遍
+    python bench_booking_admission.py --modes fifo lottery --requests 5000
+    python bench_booking_admission.py --daily-cap 1
+
+每种模式使用全新的 SQLite 库：若干医生同一天的上午/下午排班，所有请求在同一时刻并发发起（asyncio），
+统计吞吐、延迟分位与结果分布（成功/满员/超上限/数据库繁忙），结束后核对没有超卖、计数一致。
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+from datetime import date, time as dtime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+from database import build_async_engine, build_engine
+from migrations import apply_migrations
+from backend.services import admission, booking
+
+DB_PATH = "./medical_bench_admission.db"
+
+
+def setup(doctors: int, capacity: int, patients: int):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+    url = f"sqlite:///{DB_PATH}"
+    engine = build_engine(url, profile="bench", name="bench")
+    models.Base.metadata.create_all(bind=engine)
+    apply_migrations(engine)
+    day = date.today() + timedelta(days=1)
+    with sessionmaker(bind=engine)() as db:
+        doctor_rows = [
+            models.User(phone=f"159{i:08d}", password="hash", role=models.UserRole.doctor, status=models.UserStatus.active)
+            for i in range(doctors)
+        ]
+        patient_rows = [
+            models.User(phone=f"13{i:09d}", password="hash", role=models.UserRole.user, status=models.UserStatus.active)
+            for i in range(patients)
+        ]
+        db.add_all(doctor_rows + patient_rows)
+        db.flush()
+        schedules = []
+        for d in doctor_rows:
+            for start, end in ((dtime(9), dtime(12)), (dtime(13), dtime(17))):
+                s = models.DoctorSchedule(doctor_id=d.id, date=day, start_time=start, end_time=end, capacity=capacity)
+                db.add(s)
+                schedules.append(s)
+            db.add(models.DoctorDaySchedule(doctor_id=d.id, date=day, am_capacity=capacity, pm_capacity=capacity))
+        db.commit()
+        targets = [(s.doctor_id, s.id) for s in schedules]
+        patient_ids = [p.id for p in patient_rows]
+    async_engine = build_async_engine(url, profile="bench", name="bench_async")
+    factory = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    return engine, async_engine, factory, targets, patient_ids, day
+
+
+async def direct_request(factory, patient_id, doctor_id, schedule_id, daily_cap):
+    async with factory() as db:
+        try:
+            _, created = await db.run_sync(booking.book, patient_id, doctor_id, schedule_id, daily_cap=daily_cap)
+            return "booked" if created else "duplicate"
+        except booking.BookingError as e:
+            return "cap" if e.reason == booking.DAILY_CAP else "full"
+        except OperationalError:
+            return "busy"
+
+
+async def queued_request(controller, patient_id, doctor_id, schedule_id, day):
+    ticket = controller.submit(patient_id, doctor_id, schedule_id, day)
+    await controller.wait(ticket, 60)
+    if ticket.status == "booked":
+        return "booked" if ticket.created else "duplicate"
+    if ticket.reason == booking.DAILY_CAP:
+        return "cap"
+    return "full" if ticket.reason in (booking.FULL, booking.DAY_FULL) else "busy"
+
+
+async def run_mode(mode: str, args) -> dict:
+    engine, async_engine, factory, targets, patient_ids, day = setup(args.doctors, args.capacity, args.patients)
+    rnd = random.Random(42)
+    plan = [(rnd.choice(patient_ids), *rnd.choice(targets)) for _ in range(args.requests)]
+    controller = None
+    if mode != "direct":
+        controller = admission.AdmissionController(mode=mode, batch_size=args.batch, window=args.window / 1000,
+                                                   daily_cap=args.daily_cap, session_factory=sessionmaker(bind=engine, autoflush=False))
+
+    async def timed(patient_id, doctor_id, schedule_id):
+        started = time.perf_counter()
+        if controller is None:
+            outcome = await direct_request(factory, patient_id, doctor_id, schedule_id, args.daily_cap)
+        else:
+            outcome = await queued_request(controller, patient_id, doctor_id, schedule_id, day)
+        return outcome, time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(timed(*p) for p in plan))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(r[1] for r in results)
+    summary = {
+        "mode": mode,
+        "requests": len(results),
+        "seconds": round(elapsed, 2),
+        "requests_per_sec": round(len(results) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+        **Counter(r[0] for r in results),
+    }
+    if controller is not None:
+        summary["batches"] = controller.batches
+
+    async with factory() as db:
+        A, S = models.Appointment, models.DoctorSchedule
+        active = dict((await db.execute(
+            select(A.schedule_id, func.count(A.id)).where(A.status != models.AppointmentStatus.cancelled).group_by(A.schedule_id)
+        )).all())
+        problems = [
+            s.id for s in (await db.scalars(select(S))).all()
+            if active.get(s.id, 0) != s.booked_count or s.booked_count > s.capacity
+        ]
+    await async_engine.dispose()
+    engine.dispose()
+    assert not problems, f"{mode}: 排班计数不一致/超卖: {problems[:10]}"
+    return summary
+
+
+def run():
+    parser = argparse.ArgumentParser(description="放号高峰挂号压测")
+    parser.add_argument("--modes", nargs="+", default=["direct", "fifo"], choices=["direct", *admission.MODES])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--doctors", type=int, default=4)
+    parser.add_argument("--capacity", type=int, default=100)
+    parser.add_argument("--patients", type=int, default=3000)
+    parser.add_argument("--batch", type=int, default=admission.BATCH_SIZE)
+    parser.add_argument("--window", type=float, default=200, help="lottery 收集窗口（毫秒）")
+    parser.add_argument("--daily-cap", type=int, default=booking.PATIENT_DAILY_CAP)
+    args = parser.parse_args()
+    for mode in args.modes:
+        print(asyncio.run(run_mode(mode, args)))
+    print("OK: 各模式均无超卖，排班计数一致")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,129 @@
+"""
+按周模板生成排班性能对比：逐医生逐天查询再插入 vs 一条 INSERT … SELECT
+
+    cd backend
+    python bench_schedule_materializer.py                  # 默认 2000 名医生，生成 14 天
+    python bench_schedule_materializer.py --doctors 5000 --days 30
+
+两种方式各用一个全新的 SQLite 库、相同的周模板（每人工作日上午/下午、周六仅上午），
+统计耗时与语句数；随后再跑一次集合式生成，确认重复执行不会新增任何行。
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+from database import build_engine
+from migrations import apply_migrations
+from backend.services import schedule_materializer
+
+DB_PATH = "./medical_bench_materializer.db"
+
+
+def setup(doctors: int):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+    engine = build_engine(f"sqlite:///{DB_PATH}", profile="bench", name="bench")
+    models.Base.metadata.create_all(bind=engine)
+    apply_migrations(engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with SessionLocal() as db:
+        doctor_rows = [
+            models.User(phone=f"159{i:08d}", password="hash", role=models.UserRole.doctor, status=models.UserStatus.active)
+            for i in range(doctors)
+        ]
+        db.add_all(doctor_rows)
+        db.flush()
+        db.add_all([
+            models.DoctorScheduleTemplate(doctor_id=d.id, weekday=w, am_capacity=10, pm_capacity=0 if w == 5 else 8)
+            for d in doctor_rows for w in range(6)
+        ])
+        db.commit()
+    return engine, SessionLocal
+
+
+def count_statements(engine):
+    counter = {"n": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        counter["n"] += 1
+
+    return counter
+
+
+def legacy(db, days: int) -> int:
+    """原启动逻辑的写法：每个医生、每一天、每个时段先查是否存在，再逐行插入"""
+    S, D, T = models.DoctorSchedule, models.DoctorDaySchedule, models.DoctorScheduleTemplate
+    start = date.today()
+    created = 0
+    for template in db.scalars(select(T)).all():
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            if day.weekday() != template.weekday:
+                continue
+            for capacity, (start_time, end_time) in (
+                (template.am_capacity, schedule_materializer.AM_SLOT),
+                (template.pm_capacity, schedule_materializer.PM_SLOT),
+            ):
+                if capacity <= 0:
+                    continue
+                exists = db.scalar(select(S.id).where(
+                    S.doctor_id == template.doctor_id, S.date == day, S.start_time == start_time))
+                if exists is None:
+                    db.add(S(doctor_id=template.doctor_id, date=day, start_time=start_time, end_time=end_time,
+                             capacity=capacity, booked_count=0, status=models.ScheduleStatus.open))
+                    db.flush()
+                    created += 1
+            if db.scalar(select(D.id).where(D.doctor_id == template.doctor_id, D.date == day)) is None:
+                db.add(D(doctor_id=template.doctor_id, date=day,
+                         am_capacity=template.am_capacity, pm_capacity=template.pm_capacity))
+                db.flush()
+    db.commit()
+    return created
+
+
+def run_mode(mode: str, args) -> dict:
+    engine, SessionLocal = setup(args.doctors)
+    counter = count_statements(engine)
+    with SessionLocal() as db:
+        started = time.perf_counter()
+        if mode == "legacy":
+            created = legacy(db, args.days)
+        else:
+            created = schedule_materializer.materialize(db, args.days)["schedules"]
+        elapsed = time.perf_counter() - started
+        total = db.scalar(select(func.count(models.DoctorSchedule.id)))
+        summary = {"mode": mode, "schedules": created, "seconds": round(elapsed, 2), "statements": counter["n"]}
+        if mode == "set":
+            again = schedule_materializer.materialize(db, args.days)
+            summary["rerun_inserted"] = again["schedules"] + again["day_schedules"]
+            assert summary["rerun_inserted"] == 0, "重复生成插入了新行"
+    engine.dispose()
+    summary["total"] = total
+    return summary
+
+
+def run():
+    parser = argparse.ArgumentParser(description="按周模板生成排班性能对比")
+    parser.add_argument("--doctors", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=schedule_materializer.MATERIALIZE_DAYS)
+    args = parser.parse_args()
+    results = [run_mode(mode, args) for mode in ("legacy", "set")]
+    for r in results:
+        print(r)
+    assert results[0]["total"] == results[1]["total"], "两种方式生成的排班数不一致"
+    print(f"OK: 生成结果一致，集合式提升 {results[0]['seconds'] / max(results[1]['seconds'], 1e-3):.0f}x")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,144 @@
+"""
+号源推送合并效果：一批挂号/退号期间，各订阅实际收到多少条 SSE 消息
+
+    cd backend
+    python bench_slot_feed.py                          # 100 次挂号落在同一医生的两个排班上
+    python bench_slot_feed.py --bookings 1000 --subscribers 200 --coalesce 200
+
+全新的 SQLite 库：一名医生当天上午/下午排班；若干订阅（按医生/按日期/不过滤）同时在线，
+工作线程里连续挂号（部分随即退号），统计每个订阅收到的消息数与条目数，
+并核对各订阅最后看到的已约数与数据库一致；同时给出同样时长内按 1 秒轮询需要的请求数作对比。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, time as dtime
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+from database import build_engine
+from migrations import apply_migrations
+from backend.services import booking
+from backend.services.slot_feed import SlotFeed
+from backend.services.slot_inventory import inventory
+
+DB_PATH = "./medical_bench_feed.db"
+
+
+def setup(capacity: int, patients: int):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+    engine = build_engine(f"sqlite:///{DB_PATH}", profile="bench", name="bench")
+    models.Base.metadata.create_all(bind=engine)
+    apply_migrations(engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with SessionLocal() as db:
+        doctor = models.User(phone="15900000000", password="hash", role=models.UserRole.doctor, status=models.UserStatus.active)
+        patient_rows = [
+            models.User(phone=f"13{i:09d}", password="hash", role=models.UserRole.user, status=models.UserStatus.active)
+            for i in range(patients)
+        ]
+        db.add_all([doctor, *patient_rows])
+        db.flush()
+        for start, end in ((dtime(9), dtime(12)), (dtime(13), dtime(17))):
+            db.add(models.DoctorSchedule(doctor_id=doctor.id, date=date.today(), start_time=start, end_time=end,
+                                         capacity=capacity, booked_count=0))
+        db.commit()
+        schedule_ids = db.scalars(select(models.DoctorSchedule.id)).all()
+        return engine, SessionLocal, doctor.id, schedule_ids, [p.id for p in patient_rows]
+
+
+def write_burst(SessionLocal, doctor_id, schedule_ids, patient_ids, bookings: int, pace: float):
+    rnd = random.Random(7)
+    with SessionLocal() as db:
+        for _ in range(bookings):
+            try:
+                appt, created = booking.book(db, rnd.choice(patient_ids), doctor_id, rnd.choice(schedule_ids), daily_cap=0)
+            except booking.BookingError:
+                continue
+            if created and rnd.random() < 0.2:
+                booking.cancel(db, appt.id)
+            if pace:
+                time.sleep(pace)
+
+
+async def consume(feed: SlotFeed, sub, stop: asyncio.Event, seen: dict):
+    stream = feed.stream(sub)
+    messages = items = 0
+    async for chunk in stream:
+        if chunk.startswith(":"):
+            if stop.is_set() and not sub.pending:
+                break
+            continue
+        data = json.loads(chunk.split("data: ", 1)[1])
+        if "event: slots" in chunk:
+            messages += 1
+            items += len(data)
+        for slot in data:
+            seen[slot["id"]] = slot["booked_count"]
+        if stop.is_set() and not sub.pending:
+            break
+    await stream.aclose()
+    return messages, items
+
+
+async def run_bench(args):
+    engine, SessionLocal, doctor_id, schedule_ids, patient_ids = setup(args.capacity, args.patients)
+    inventory.configure(SessionLocal)
+    inventory.ensure_loaded()
+    feed = SlotFeed(coalesce=args.coalesce / 1000, heartbeat=0.2)
+    inventory.add_listener(feed.publish)
+    filters = [({doctor_id}, None), (None, date.today()), (None, None)]
+    subs = [feed.subscribe(*filters[i % len(filters)]) for i in range(args.subscribers)]
+    stop = asyncio.Event()
+    views = [dict() for _ in subs]
+    readers = [asyncio.create_task(consume(feed, sub, stop, seen)) for sub, seen in zip(subs, views)]
+
+    started = time.perf_counter()
+    await asyncio.to_thread(write_burst, SessionLocal, doctor_id, schedule_ids, patient_ids, args.bookings, args.pace / 1000)
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(args.coalesce / 1000 * 2 + 0.3)
+    stop.set()
+    results = await asyncio.gather(*readers)
+
+    with SessionLocal() as db:
+        truth = dict(db.execute(select(models.DoctorSchedule.id, models.DoctorSchedule.booked_count)).all())
+    engine.dispose()
+    stale = [i for i, seen in enumerate(views) if any(seen.get(k) != v for k, v in truth.items())]
+    messages = [m for m, _ in results]
+    print({
+        "bookings": args.bookings,
+        "write_seconds": round(elapsed, 2),
+        "changes_published": feed.published,
+        "subscribers": len(subs),
+        "messages_per_subscriber_avg": round(sum(messages) / len(messages), 1),
+        "messages_per_subscriber_max": max(messages),
+        "polling_requests_equivalent": round(len(subs) * max(elapsed, 1)),
+    })
+    assert not stale, f"订阅最终状态与数据库不一致: {stale[:10]}"
+    print("OK: 各订阅最终看到的已约数与数据库一致")
+
+
+def run():
+    parser = argparse.ArgumentParser(description="号源推送合并效果")
+    parser.add_argument("--bookings", type=int, default=100)
+    parser.add_argument("--subscribers", type=int, default=30)
+    parser.add_argument("--capacity", type=int, default=200)
+    parser.add_argument("--patients", type=int, default=500)
+    parser.add_argument("--coalesce", type=float, default=500, help="合并窗口（毫秒）")
+    parser.add_argument("--pace", type=float, default=0, help="每次挂号后的间隔（毫秒），模拟分散到达")
+    asyncio.run(run_bench(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    run()
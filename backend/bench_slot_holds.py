@@ -0,0 +1,150 @@
+"""
+过期暂占号清理性能对比：逐条加锁释放 vs 按批次整批释放（services.slot_holds.sweep）
+
+    cd backend
+    python bench_slot_holds.py                       # 默认 500 个排班、20000 个过期暂占号
+    python bench_slot_holds.py --schedules 2000 --holds 100000 --batch 1000
+
+两种方式各用一个全新的 SQLite 库、相同的数据（暂占号平均分布到各排班，held_count 与日聚合计数与之一致），
+统计耗时与语句数，并确认清理后排班 held_count、日聚合计数两种方式完全一致且全部归零。
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, datetime, time as dtime, timedelta
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+from database import build_engine
+from migrations import apply_migrations
+from backend.services import booking, slot_holds
+
+DB_PATH = "./medical_bench_holds.db"
+
+
+def setup(schedules: int, holds: int):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+    engine = build_engine(f"sqlite:///{DB_PATH}", profile="bench", name="bench")
+    models.Base.metadata.create_all(bind=engine)
+    apply_migrations(engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    per_schedule = -(-holds // schedules)
+    with SessionLocal() as db:
+        doctors = [
+            models.User(phone=f"158{i:08d}", password="hash", role=models.UserRole.doctor, status=models.UserStatus.active)
+            for i in range(max(schedules // 10, 1))
+        ]
+        patients = [
+            models.User(phone=f"157{i:08d}", password="hash", role=models.UserRole.user, status=models.UserStatus.active)
+            for i in range(per_schedule)
+        ]
+        db.add_all(doctors + patients)
+        db.flush()
+        day = date.today() + timedelta(days=1)
+        rows = []
+        for i in range(schedules):
+            morning = i % 2 == 0
+            rows.append(models.DoctorSchedule(
+                doctor_id=doctors[i // 2 % len(doctors)].id, date=day + timedelta(days=i // (2 * len(doctors))),
+                start_time=dtime(9) if morning else dtime(13), end_time=dtime(12) if morning else dtime(17),
+                capacity=per_schedule, status=models.ScheduleStatus.open,
+            ))
+        db.add_all(rows)
+        db.flush()
+        expired = datetime.now() - timedelta(minutes=1)
+        hold_rows, held = [], {}
+        for n in range(holds):
+            s = rows[n % schedules]
+            hold_rows.append({"patient_id": patients[n // schedules].id, "doctor_id": s.doctor_id,
+                              "schedule_id": s.id, "expires_at": expired})
+            held[s.id] = held.get(s.id, 0) + 1
+        db.execute(models.SlotHold.__table__.insert(), hold_rows)
+        days = {}
+        for s in rows:
+            s.held_count = held.get(s.id, 0)
+            days.setdefault((s.doctor_id, s.date), [0, 0])[0 if booking.is_morning(s.start_time) else 1] += s.held_count
+        db.add_all([
+            models.DoctorDaySchedule(doctor_id=d, date=dt, am_capacity=0, am_booked_count=am,
+                                     pm_capacity=0, pm_booked_count=pm)
+            for (d, dt), (am, pm) in days.items()
+        ])
+        db.commit()
+    return engine, SessionLocal
+
+
+def count_statements(engine):
+    counter = {"n": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        counter["n"] += 1
+
+    return counter
+
+
+def per_row(db) -> int:
+    """逐条写法：每个过期暂占号单独加锁读取、改状态、退号、提交"""
+    H = models.SlotHold
+    released = 0
+    now = datetime.now()
+    for hold_id in db.scalars(select(H.id).where(H.status == models.HoldStatus.held, H.expires_at < now)).all():
+        entry = db.scalar(select(H).where(H.id == hold_id).with_for_update())
+        if entry.status != models.HoldStatus.held:
+            continue
+        entry.status = models.HoldStatus.expired
+        entry.resolved_at = now
+        booking.release_slot(db, entry.schedule_id, held=True)
+        db.commit()
+        released += 1
+    return released
+
+
+def counters(db):
+    S, D = models.DoctorSchedule, models.DoctorDaySchedule
+    return (
+        db.execute(select(S.id, S.held_count).order_by(S.id)).all(),
+        db.execute(select(D.doctor_id, D.date, D.am_booked_count, D.pm_booked_count).order_by(D.id)).all(),
+    )
+
+
+def run_mode(mode: str, args) -> dict:
+    engine, SessionLocal = setup(args.schedules, args.holds)
+    counter = count_statements(engine)
+    with SessionLocal() as db:
+        started = time.perf_counter()
+        if mode == "per_row":
+            released = per_row(db)
+        else:
+            released = slot_holds.sweep(db, args.batch)
+        elapsed = time.perf_counter() - started
+        state = counters(db)
+        left = db.scalar(select(func.count(models.SlotHold.id)).where(models.SlotHold.status == models.HoldStatus.held))
+    engine.dispose()
+    assert left == 0, "仍有未释放的过期暂占号"
+    assert all(c == 0 for _, c in state[0]) and all(am == pm == 0 for *_, am, pm in state[1]), "计数未归零"
+    return {"mode": mode, "released": released, "seconds": round(elapsed, 2), "statements": counter["n"], "state": state}
+
+
+def run():
+    parser = argparse.ArgumentParser(description="过期暂占号清理性能对比")
+    parser.add_argument("--schedules", type=int, default=500)
+    parser.add_argument("--holds", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=slot_holds.SWEEP_BATCH)
+    args = parser.parse_args()
+    results = [run_mode(mode, args) for mode in ("per_row", "batch")]
+    for r in results:
+        print({k: v for k, v in r.items() if k != "state"})
+    assert results[0]["state"] == results[1]["state"], "两种方式清理后的计数不一致"
+    print(f"OK: 清理结果一致，整批释放提升 {results[0]['seconds'] / max(results[1]['seconds'], 1e-3):.0f}x")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,180 @@
+"""
+号源库存缓存读性能对比：直接查库 vs 读内存
+
+    cd backend
+    python bench_slot_inventory.py                     # 默认 200 名医生，每人 7 天上午/下午排班
+    python bench_slot_inventory.py --doctors 1000 --threads 16 --seconds 5
+
+对比两条患者端轮询路径：
+- schedules: 某医生未来 7 天的开放排班（原 list_doctor_schedules 的查询）
+- doctors:   所有医生的余号排班数（原 list_available_doctors 中逐个医生 COUNT）
+最后随机挂号/退号一批，核对缓存与数据库一致（写穿 + 版本号），不一致即以非零状态退出。
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from datetime import date, time as dtime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+from database import build_engine
+from migrations import apply_migrations
+from backend.services import booking
+from backend.services.slot_inventory import inventory
+
+DEFAULT_URL = "sqlite:///./medical_bench_inventory.db"
+
+
+def setup(url: str, doctors: int, capacity: int):
+    if url.startswith("sqlite:///"):
+        path = url[len("sqlite:///"):]
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    engine = build_engine(url, profile="bench", name="bench")
+    models.Base.metadata.create_all(bind=engine)
+    apply_migrations(engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    today = date.today()
+    with SessionLocal() as db:
+        doctor_rows = [
+            models.User(phone=f"159{i:08d}", password="hash", role=models.UserRole.doctor, status=models.UserStatus.active)
+            for i in range(doctors)
+        ]
+        patient_rows = [
+            models.User(phone=f"13{i:09d}", password="hash", role=models.UserRole.user, status=models.UserStatus.active)
+            for i in range(500)
+        ]
+        db.add_all(doctor_rows + patient_rows)
+        db.flush()
+        for d in doctor_rows:
+            for offset in range(7):
+                day = today + timedelta(days=offset)
+                db.add(models.DoctorSchedule(doctor_id=d.id, date=day, start_time=dtime(9), end_time=dtime(12),
+                                             capacity=capacity, booked_count=0))
+                db.add(models.DoctorSchedule(doctor_id=d.id, date=day, start_time=dtime(13), end_time=dtime(17),
+                                             capacity=capacity, booked_count=0))
+                db.add(models.DoctorDaySchedule(doctor_id=d.id, date=day, am_capacity=capacity, pm_capacity=capacity))
+        db.commit()
+        ids = [d.id for d in doctor_rows], [p.id for p in patient_rows]
+    return SessionLocal, ids
+
+
+def db_schedules(db, doctor_id):
+    S = models.DoctorSchedule
+    today = date.today()
+    return db.scalars(select(S).where(
+        S.doctor_id == doctor_id, S.status == models.ScheduleStatus.open,
+        S.date >= today, S.date <= today + timedelta(days=7),
+    )).all()
+
+
+def db_doctor_counts(db, doctor_ids):
+    S = models.DoctorSchedule
+    today = date.today()
+    return {
+        d: db.scalar(select(func.count(S.id)).where(
+            S.doctor_id == d, S.status == models.ScheduleStatus.open,
+            S.date >= today, S.date <= today + timedelta(days=7), S.capacity > S.booked_count,
+        ))
+        for d in doctor_ids
+    }
+
+
+def measure(fn, threads: int, seconds: float) -> float:
+    """多线程在固定时长内反复调用 fn，返回每秒调用次数"""
+    done = []
+    deadline = time.perf_counter() + seconds
+
+    def loop(seed):
+        rnd = random.Random(seed)
+        n = 0
+        while time.perf_counter() < deadline:
+            fn(rnd)
+            n += 1
+        done.append(n)
+
+    workers = [threading.Thread(target=loop, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return sum(done) / (time.perf_counter() - started)
+
+
+def run():
+    parser = argparse.ArgumentParser(description="号源库存缓存读性能对比")
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--doctors", type=int, default=200)
+    parser.add_argument("--capacity", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    SessionLocal, (doctor_ids, patient_ids) = setup(args.url, args.doctors, args.capacity)
+    inventory.configure(SessionLocal)
+    started = time.perf_counter()
+    inventory.ensure_loaded()
+    print(f"加载 {inventory.stats()['schedules']} 个排班耗时 {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, "db"):
+            local.db = SessionLocal()
+        return local.db
+
+    def db_schedules_call(rnd):
+        db = session()
+        db_schedules(db, rnd.choice(doctor_ids))
+        db.rollback()
+
+    def db_doctors_call(rnd):
+        db = session()
+        db_doctor_counts(db, doctor_ids)
+        db.rollback()
+
+    results = {
+        "schedules_db_rps": measure(db_schedules_call, args.threads, args.seconds),
+        "schedules_memory_rps": measure(lambda rnd: inventory.schedules(rnd.choice(doctor_ids)), args.threads, args.seconds),
+        "doctors_db_rps": measure(db_doctors_call, args.threads, args.seconds),
+        "doctors_memory_rps": measure(lambda rnd: inventory.available_counts(), args.threads, args.seconds),
+    }
+    print({k: round(v, 1) for k, v in results.items()})
+    print(f"schedules 提升 {results['schedules_memory_rps'] / results['schedules_db_rps']:.0f}x，"
+          f"doctors 提升 {results['doctors_memory_rps'] / results['doctors_db_rps']:.0f}x")
+
+    # 写穿一致性：随机挂号/退号后逐条核对
+    rnd = random.Random(0)
+    with SessionLocal() as db:
+        schedule_ids = db.scalars(select(models.DoctorSchedule.id).where(
+            models.DoctorSchedule.doctor_id.in_(doctor_ids[:10]))).all()
+        doctor_of = dict(db.execute(select(models.DoctorSchedule.id, models.DoctorSchedule.doctor_id)).all())
+        for _ in range(500):
+            schedule_id = rnd.choice(schedule_ids)
+            try:
+                appt, created = booking.book(db, rnd.choice(patient_ids), doctor_of[schedule_id], schedule_id)
+            except booking.BookingError:
+                continue
+            if created and rnd.random() < 0.3:
+                booking.cancel(db, appt.id)
+        mismatched = [
+            (s.id, s.booked_count, inventory.get(s.id).booked_count)
+            for s in db.scalars(select(models.DoctorSchedule).where(models.DoctorSchedule.id.in_(schedule_ids)))
+            if inventory.get(s.id) is None or inventory.get(s.id).booked_count != s.booked_count
+        ]
+    assert not mismatched, f"缓存与数据库不一致: {mismatched[:10]}"
+    print(f"OK: 写穿后缓存与数据库一致（version={inventory.version}）")
+
+
+if __name__ == "__main__":
+    run()
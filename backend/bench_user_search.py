@@ -0,0 +1,155 @@
+"""
+用户搜索压测：大量患者下按手机号片段、姓名、姓氏、身份证号尾号搜索，对比搜索索引与原来的前置通配 LIKE
+
+    cd backend
+    python bench_user_search.py                      # 20 万患者
+    python bench_user_search.py --users 1000000      # 100 万患者（建库约需数分钟）
+
+新建 SQLite 库：create_all 后批量写入患者与资料，再执行迁移（迁移 12 用 SQL 回填搜索索引），
+每类关键字随机取若干个（姓氏命中多，走逐行探测；其余走 id 列表），分别计时管理端用户列表的一页（user_directory.fetch，按创建时间倒序 20 条）与精确总数，
+输出 p50/p99（毫秒）；LIKE 基线只跑少量几次。结束后核对索引结果与 LIKE 全表扫描结果一致。
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+from sqlalchemy import and_, func, insert, or_, select, text
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+from database import build_engine
+from migrations import apply_migrations
+from backend.core.pagination import PageParams
+from backend.services import user_directory, user_search
+
+DB_PATH = "./medical_bench_user_search.db"
+
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤"
+GIVEN = "伟芳娜秀英敏静丽强磊军洋勇艳杰娟涛明超兰霞平刚桂华建国红玉文辉鹏飞宇浩然子轩梓涵欣怡晨阳思雨博文佳琪志强海燕春梅俊杰婷婷雪丽嘉慧天翼"
+
+
+def make_name(rnd: random.Random) -> str:
+    return rnd.choice(SURNAMES) + "".join(rnd.choice(GIVEN) for _ in range(rnd.choice((1, 2, 2))))
+
+
+def make_id_card(rnd: random.Random) -> str:
+    return f"{rnd.randint(110000, 659999)}{rnd.randint(1950, 2020)}{rnd.randint(1, 12):02d}{rnd.randint(1, 28):02d}" \
+           f"{rnd.randint(0, 999):03d}{rnd.choice('0123456789X')}"
+
+
+def setup(users: int, seed: int):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+    engine = build_engine(f"sqlite:///{DB_PATH}", profile="bench", name="bench")
+    models.Base.metadata.create_all(bind=engine)
+    rnd = random.Random(seed)
+    started = time.perf_counter()
+    batch = 20000
+    with engine.begin() as conn:
+        for first in range(1, users + 1, batch):
+            ids = range(first, min(first + batch, users + 1))
+            conn.execute(insert(models.User), [
+                {"id": i, "phone": f"13{i * 7919 % 10 ** 9:09d}", "password": "hash",
+                 "role": models.UserRole.user, "status": models.UserStatus.active}
+                for i in ids
+            ])
+            conn.execute(insert(models.PatientProfile), [
+                {"user_id": i, "name": make_name(rnd), "id_card": make_id_card(rnd)} for i in ids
+            ])
+    seeded = time.perf_counter()
+    apply_migrations(engine)
+    print(f"写入 {users} 个患者 {seeded - started:.1f}s，迁移与搜索索引回填 {time.perf_counter() - seeded:.1f}s")
+    return engine
+
+
+def keywords(db, kind: str, n: int, rnd: random.Random) -> list:
+    P = models.PatientProfile
+    sample = db.execute(select(P.user_id, P.name, P.id_card).order_by(func.random()).limit(n)).all()
+    U = models.User
+    phones = dict(db.execute(select(U.id, U.phone).where(U.id.in_([s.user_id for s in sample]))).all())
+    result = []
+    for s in sample:
+        if kind == "phone_fragment":
+            start = rnd.randint(2, 6)
+            result.append(phones[s.user_id][start:start + 5])
+        elif kind == "phone_3_digits":
+            start = rnd.randint(2, 8)
+            result.append(phones[s.user_id][start:start + 3])
+        elif kind == "full_name":
+            result.append(s.name)
+        elif kind == "given_name":
+            result.append(s.name[1:3])
+        elif kind == "surname":
+            result.append(s.name[:1])
+        elif kind == "id_card_suffix":
+            result.append(s.id_card[-6:])
+    return result
+
+
+def like_filter(keyword: str):
+    """原实现的基线：手机号/姓名子串、身份证号尾号的前置通配 LIKE"""
+    U, P = models.User, models.PatientProfile
+    return U.id.in_(select(U.id).outerjoin(P, P.user_id == U.id).where(or_(
+        U.phone.contains(keyword, autoescape=True),
+        P.name.contains(keyword, autoescape=True),
+        P.id_card.endswith(keyword, autoescape=True),
+    )))
+
+
+def timed(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+
+def summarize(samples: list) -> dict:
+    samples = sorted(samples)
+    return {"p50_ms": round(statistics.median(samples), 2), "p99_ms": round(samples[max(0, int(len(samples) * 0.99) - 1)], 2)}
+
+
+def run():
+    parser = argparse.ArgumentParser(description="用户搜索压测")
+    parser.add_argument("--users", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=200, help="每类关键字的查询次数")
+    parser.add_argument("--baseline", type=int, default=5, help="每类关键字跑 LIKE 基线的次数")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    engine = setup(args.users, args.seed)
+    rnd = random.Random(args.seed)
+    page = PageParams.of(None, 20)
+    sort = user_directory.keyset("-created_at")
+    U = models.User
+    with sessionmaker(bind=engine)() as db:
+        for kind in ("phone_fragment", "phone_3_digits", "full_name", "given_name", "surname", "id_card_suffix"):
+            words = keywords(db, kind, args.queries, rnd)
+            fetch_ms, count_ms, hits = [], [], []
+            for word in words:
+                fetch_ms.append(timed(lambda: user_directory.fetch(db, None, None, word, sort, page)))
+                user_directory.counter.invalidate()
+                count_ms.append(timed(lambda: hits.append(user_directory.counter.count(db, keyword=word)[0])))
+            baseline = [
+                timed(lambda: db.execute(select(U.id).where(like_filter(word)).order_by(U.created_at.desc(), U.id.desc()).limit(20)).all())
+                for word in words[:args.baseline]
+            ]
+            # 正确性：索引命中的用户与 LIKE 全表扫描一致
+            for word in words[:args.baseline]:
+                indexed = set(db.scalars(select(U.id).where(user_search.condition(db, word, page.limit))))
+                scanned = set(db.scalars(select(U.id).where(like_filter(word.lower()))))
+                assert indexed == scanned, f"{kind} {word!r}: 索引 {len(indexed)} 条 / LIKE {len(scanned)} 条"
+            print({
+                "keyword": kind, "example": words[0], "median_hits": statistics.median(hits),
+                "page": summarize(fetch_ms), "count": summarize(count_ms), "like_baseline": summarize(baseline),
+            })
+    engine.dispose()
+    print("OK: 索引结果与 LIKE 全表扫描一致")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,187 @@
+"""
+热点查询执行计划回归检查（SQLite）
+
+对新建的临时库执行 create_all + 迁移，然后对每条热点查询跑 EXPLAIN QUERY PLAN：
+只要有一条查询退化为全表扫描（SCAN），或要求有序的查询用了临时排序，即以非零状态退出。
+新增热点查询或调整索引时在 HOT_QUERIES 中补充对应条目。
+
+    cd backend
+    python check_query_plans.py            # 使用临时内存库
+    python check_query_plans.py <db_url>   # 检查指定 SQLite 库（需先执行迁移）
+"""
+import sys
+import os
+from datetime import date
+
+from sqlalchemy import create_engine, text
+
+sys.path.append(os.path.dirname(__file__))
+
+import models
+from migrations import apply_migrations
+
+TODAY = date.today().isoformat()
+
+# 名称 -> (SQL, 参数, 是否禁止临时排序)
+HOT_QUERIES = {
+    "doctor appointments by status": (
+        "SELECT id FROM appointments WHERE doctor_id = :doctor_id AND status != 'cancelled'",
+        {"doctor_id": 1}, False,
+    ),
+    "duplicate booking check": (
+        "SELECT id FROM appointments WHERE patient_id = :patient_id AND schedule_id = :schedule_id AND status != 'cancelled'",
+        {"patient_id": 1, "schedule_id": 1}, False,
+    ),
+    "doctor schedules in window": (
+        "SELECT id FROM doctor_schedules WHERE doctor_id = :doctor_id AND status = 'open' AND date >= :start AND date <= :end",
+        {"doctor_id": 1, "start": TODAY, "end": TODAY}, False,
+    ),
+    "schedule upsert lookup": (
+        "SELECT id FROM doctor_schedules WHERE doctor_id = :doctor_id AND date = :d AND start_time = :t",
+        {"doctor_id": 1, "d": TODAY, "t": "09:00:00.000000"}, False,
+    ),
+    "doctor calendar range": (
+        "SELECT date, am_capacity, am_booked_count, pm_capacity, pm_booked_count FROM doctor_day_schedules "
+        "WHERE doctor_id = :doctor_id AND date >= :start AND date < :end ORDER BY date",
+        {"doctor_id": 1, "start": TODAY, "end": TODAY}, True,
+    ),
+    "day aggregate lookup": (
+        "SELECT id FROM doctor_day_schedules WHERE doctor_id = :doctor_id AND date = :d",
+        {"doctor_id": 1, "d": TODAY}, False,
+    ),
+    "patient prescriptions": (
+        "SELECT id FROM prescriptions WHERE patient_id = :patient_id ORDER BY created_at DESC",
+        {"patient_id": 1}, True,
+    ),
+    "doctor prescriptions": (
+        "SELECT id FROM prescriptions WHERE doctor_id = :doctor_id ORDER BY created_at DESC",
+        {"doctor_id": 1}, True,
+    ),
+    "prescription items": (
+        "SELECT id FROM prescription_items WHERE prescription_id = :prescription_id",
+        {"prescription_id": 1}, False,
+    ),
+    "patient medical records": (
+        "SELECT id FROM medical_records WHERE patient_id = :patient_id ORDER BY created_at DESC",
+        {"patient_id": 1}, True,
+    ),
+    "prescription projection by patient": (
+        "SELECT p.id, i.id, m.name, pu.phone, pp.name, du.phone, dp.name, r.diagnosis FROM prescriptions p "
+        "LEFT JOIN medical_records r ON r.id = p.medical_record_id "
+        "LEFT JOIN users pu ON pu.id = p.patient_id LEFT JOIN patient_profiles pp ON pp.user_id = p.patient_id "
+        "LEFT JOIN users du ON du.id = p.doctor_id LEFT JOIN doctor_profiles dp ON dp.user_id = p.doctor_id "
+        "LEFT JOIN prescription_items i ON i.prescription_id = p.id LEFT JOIN medications m ON m.id = i.medication_id "
+        "WHERE p.patient_id = :patient_id ORDER BY p.created_at DESC, p.id DESC, i.id",
+        {"patient_id": 1}, False,
+    ),
+    "patient appointments page": (
+        "SELECT id FROM appointments WHERE patient_id = :patient_id AND (created_at, id) < (:c, :id) "
+        "ORDER BY created_at DESC, id DESC LIMIT 201",
+        {"patient_id": 1, "c": TODAY, "id": 1}, True,
+    ),
+    "all users page": (
+        "SELECT id FROM users WHERE role = :role AND (created_at, id) < (:c, :id) ORDER BY created_at DESC, id DESC LIMIT 201",
+        {"role": "doctor", "c": TODAY, "id": 1}, True,
+    ),
+    "admin user list page": (
+        "SELECT u.id, coalesce(pp.name, dp.name, hp.name) FROM users u "
+        "LEFT JOIN patient_profiles pp ON pp.user_id = u.id AND u.role = 'user' "
+        "LEFT JOIN doctor_profiles dp ON dp.user_id = u.id AND u.role = 'doctor' "
+        "LEFT JOIN pharmacist_profiles hp ON hp.user_id = u.id AND u.role = 'pharmacist' "
+        "WHERE u.role = :role AND (u.phone, u.id) > (:p, :id) ORDER BY u.phone, u.id LIMIT 201",
+        {"role": "user", "p": "13000000000", "id": 1}, True,
+    ),
+    "user search short keyword": (
+        "SELECT user_id FROM user_search_grams WHERE gram = :g",
+        {"g": "王"}, False,
+    ),
+    "pharmacy queue page": (
+        "SELECT id FROM prescriptions WHERE status = :status AND (created_at, id) < (:c, :id) "
+        "ORDER BY created_at DESC, id DESC LIMIT 201",
+        {"status": "paid", "c": TODAY, "id": 1}, True,
+    ),
+    "doctor appointments version": (
+        "SELECT count(a.id), sum(a.id), sum(a.revision) FROM doctor_schedules s JOIN appointments a ON a.schedule_id = s.id "
+        "WHERE s.doctor_id = :doctor_id AND s.date >= :start AND s.date < :end AND a.doctor_id = :doctor_id",
+        {"doctor_id": 1, "start": TODAY, "end": TODAY}, False,
+    ),
+    # 同一排班内的预约按 id 排序只是“RIGHT PART”的小排序，不算整体临时排序
+    "doctor appointments window page": (
+        "SELECT a.id, u.phone, p.name FROM doctor_schedules s JOIN appointments a ON a.schedule_id = s.id "
+        "JOIN users u ON a.patient_id = u.id LEFT JOIN patient_profiles p ON p.user_id = u.id "
+        "WHERE s.doctor_id = :doctor_id AND s.date >= :start AND s.date < :end AND a.doctor_id = :doctor_id "
+        "AND (s.date, s.start_time, a.id) > (:d, :t, :id) ORDER BY s.date, s.start_time, a.id LIMIT 201",
+        {"doctor_id": 1, "start": TODAY, "end": TODAY, "d": TODAY, "t": "09:00:00.000000", "id": 1}, True,
+    ),
+    "doctor stats today": (
+        "SELECT count(a.id) FROM appointments a JOIN doctor_schedules s ON a.schedule_id = s.id "
+        "WHERE a.doctor_id = :doctor_id AND s.date = :d AND a.status != 'cancelled'",
+        {"doctor_id": 1, "d": TODAY}, False,
+    ),
+    "waitlist head": (
+        "SELECT id FROM appointment_waitlist WHERE schedule_id = :schedule_id AND status = 'waiting' ORDER BY id LIMIT 1",
+        {"schedule_id": 1}, True,
+    ),
+    "waitlist position": (
+        "SELECT count(*) FROM appointment_waitlist WHERE schedule_id = :schedule_id AND status = 'waiting' AND id <= :id",
+        {"schedule_id": 1, "id": 10}, False,
+    ),
+    "expired slot holds": (
+        "SELECT id FROM slot_holds WHERE status = 'held' AND expires_at < :now ORDER BY expires_at LIMIT 500",
+        {"now": TODAY}, True,
+    ),
+    "slot hold sweep batch": (
+        "SELECT schedule_id, count(id) FROM slot_holds WHERE sweep_batch = :token GROUP BY schedule_id",
+        {"token": "x"}, False,
+    ),
+    "patient slot hold": (
+        "SELECT id FROM slot_holds WHERE patient_id = :patient_id AND schedule_id = :schedule_id AND status = 'held'",
+        {"patient_id": 1, "schedule_id": 1}, False,
+    ),
+    "counter recount": (
+        "SELECT s.id, count(a.id), (SELECT count(h.id) FROM slot_holds h WHERE h.schedule_id = s.id AND h.status = 'held') "
+        "FROM doctor_schedules s LEFT JOIN appointments a ON a.schedule_id = s.id AND a.status != 'cancelled' "
+        "WHERE s.doctor_id = :doctor_id AND s.date = :d GROUP BY s.id",
+        {"doctor_id": 1, "d": TODAY}, False,
+    ),
+    "striped schedules": (
+        "SELECT id, date FROM doctor_schedules WHERE stripes > 0",
+        {}, False,
+    ),
+}
+
+
+def explain(conn, sql: str, params: dict) -> list:
+    return [row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql), params)]
+
+
+def check_plan(details: list, forbid_temp_sort: bool) -> list:
+    """返回违规的计划行"""
+    problems = []
+    for detail in details:
+        if detail.startswith("SCAN "):
+            problems.append(detail)
+        if forbid_temp_sort and "USE TEMP B-TREE FOR ORDER BY" in detail:
+            problems.append(detail)
+    return problems
+
+
+def run(url: str = "sqlite://") -> int:
+    engine = create_engine(url)
+    if url == "sqlite://":
+        models.Base.metadata.create_all(bind=engine)
+        apply_migrations(engine)
+    failures = 0
+    with engine.connect() as conn:
+        for name, (sql, params, forbid_temp_sort) in HOT_QUERIES.items():
+            details = explain(conn, sql, params)
+            problems = check_plan(details, forbid_temp_sort)
+            status = "FAIL" if problems else "ok"
+            print(f"[{status}] {name}: {' | '.join(details)}")
+            failures += bool(problems)
+    print(f"{len(HOT_QUERIES) - failures}/{len(HOT_QUERIES)} 条热点查询命中索引")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run(sys.argv[1] if len(sys.argv) > 1 else "sqlite://"))
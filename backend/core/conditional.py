@@ -0,0 +1,38 @@
+"""
+条件 GET（ETag / If-None-Match）
+- 轮询的医生端接口按版本戳或响应体生成弱 ETag，客户端带 If-None-Match 且未变化时返回空的 304
+- Cache-Control: private, no-cache：浏览器可以缓存但每次都回源校验，响应按用户区分，不进共享缓存
+"""
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    raw = "|".join("" if p is None else str(p) for p in parts)
+    return f'W/"{hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]}"'
+
+
+def matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {t.strip() for t in header.split(",")}
+    # 弱比较：W/ 前缀不影响是否匹配
+    return "*" in tags or etag in tags or etag[2:] in tags
+
+
+def apply(response: Response, etag: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """If-None-Match 命中时返回 304 响应，否则 None"""
+    if matches(request, etag):
+        return apply(Response(status_code=304), etag)
+    return None
@@ -0,0 +1,275 @@
+"""
+写接口幂等键（Idempotency-Key）
+- 客户端超时重试时带上同一个 Idempotency-Key 请求头：首个请求正常执行并保存响应（状态码、类型、响应体），
+  之后同键的重试直接回放保存的响应（响应头 Idempotent-Replayed: true），不再重复挂号/开处方/支付/发药
+- 适用于所有带该请求头的 POST/PUT/PATCH/DELETE；键按令牌解析出的调用方（用户 id + 角色）隔离，
+  同一个键换了方法/路径/请求体视为误用，返回 422
+- 未登录（没有令牌或令牌无效）的请求带该请求头返回 401：匿名请求无法区分调用方，共用一个键空间时
+  一个客户端就能回放或占住另一个客户端的键
+- 存储：idempotency_keys 表 + 进程内 LRU 前置缓存；已完成的键命中缓存时一次字典查找即可回放，
+  未命中再查一次表。记录 IDEMPOTENCY_TTL 秒后过期，过期行定期整批删除
+- 并发重复：首个请求先插入“处理中”的记录占住键（唯一索引），本进程内的重复请求等待其完成后回放，
+  其它进程的重复请求返回 409；处理中的记录 IDEMPOTENCY_LOCK 秒后过期，进程崩溃后可被接管
+- 5xx 与异常不保存，删除占位让客户端重试时重新执行；响应体超过 IDEMPOTENCY_MAX_BODY 字节也不保存
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time as _time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from backend import models
+from backend.core.security import verify_token
+
+logger = logging.getLogger("medical-system.idempotency")
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK", "60"))
+CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+MAX_BODY = int(os.getenv("IDEMPOTENCY_MAX_BODY", str(1024 * 1024)))
+# 本进程内重复请求等待首个请求完成的最长时间
+WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT", "10"))
+MAX_KEY_LENGTH = 255
+# 每保存多少个键清理一次过期记录
+PURGE_EVERY = 500
+
+MUTATING_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    fingerprint: str
+    status_code: Optional[int]  # None 表示处理中
+    content_type: Optional[str]
+    body: Optional[bytes]
+    expires_at: datetime
+
+    @property
+    def completed(self) -> bool:
+        return self.status_code is not None
+
+
+def _sha256(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def principal(request: Request) -> Optional[str]:
+    """令牌解析出的调用方（用户 id:角色）；没有令牌或令牌无效返回 None"""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = verify_token(token)
+    except HTTPException:
+        return None
+    return f"{payload.user_id}:{payload.role}"
+
+
+def scoped_key(caller: str, key: str) -> str:
+    return _sha256(caller, key)
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: int = TTL_SECONDS, lock: int = LOCK_SECONDS, cache_size: int = CACHE_SIZE,
+                 session_factory: Optional[Callable] = None):
+        self.ttl = ttl
+        self.lock = lock
+        self.cache_size = cache_size
+        self._session_factory = session_factory
+        # key_hash -> (已完成的响应, 缓存到期的 monotonic 时间)
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        # 本进程内正在处理的键
+        self._inflight: Dict[str, asyncio.Event] = {}
+        self._saved = 0
+        self.replayed = 0
+        self.conflicts = 0
+
+    def configure(self, session_factory: Callable):
+        self._session_factory = session_factory
+        self._cache.clear()
+
+    def _factory(self):
+        if self._session_factory is None:
+            from backend.database import AsyncSessionLocal
+            self._session_factory = AsyncSessionLocal
+        return self._session_factory
+
+    # ---------- 前置缓存 ----------
+
+    def _cached(self, key_hash: str) -> Optional[StoredResponse]:
+        item = self._cache.get(key_hash)
+        if item is None:
+            return None
+        stored, expires = item
+        if expires < _time.monotonic():
+            self._cache.pop(key_hash, None)
+            return None
+        self._cache.move_to_end(key_hash)
+        return stored
+
+    def _remember(self, key_hash: str, stored: StoredResponse):
+        remaining = (stored.expires_at - datetime.now()).total_seconds()
+        if remaining <= 0:
+            return
+        self._cache[key_hash] = (stored, _time.monotonic() + remaining)
+        self._cache.move_to_end(key_hash)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    # ---------- 存储 ----------
+
+    async def lookup(self, key_hash: str) -> Optional[StoredResponse]:
+        """缓存 → 表；过期记录视为不存在"""
+        stored = self._cached(key_hash)
+        if stored is not None:
+            return stored
+        K = models.IdempotencyKey
+        async with self._factory()() as db:
+            row = (await db.execute(
+                select(K.fingerprint, K.status_code, K.content_type, K.body, K.expires_at).where(K.key_hash == key_hash)
+            )).first()
+        if row is None or row.expires_at < datetime.now():
+            return None
+        stored = StoredResponse(**row._mapping)
+        if stored.completed:
+            self._remember(key_hash, stored)
+        return stored
+
+    async def claim(self, key_hash: str, fingerprint: str) -> Optional[StoredResponse]:
+        """插入处理中的占位；成功返回 None，键已被占用返回现有记录"""
+        K = models.IdempotencyKey
+        now = datetime.now()
+        async with self._factory()() as db:
+            # 过期的旧记录（含崩溃遗留的占位）先删掉再占
+            await db.execute(delete(K).where(K.key_hash == key_hash, K.expires_at < now))
+            db.add(K(key_hash=key_hash, fingerprint=fingerprint, expires_at=now + timedelta(seconds=self.lock)))
+            try:
+                await db.commit()
+                return None
+            except IntegrityError:
+                await db.rollback()
+        existing = await self.lookup(key_hash)
+        # 极少数情况下对方刚好删除了占位：按处理中处理，客户端稍后重试
+        return existing or StoredResponse(fingerprint, None, None, None, now)
+
+    async def save(self, key_hash: str, fingerprint: str, status_code: int, content_type: Optional[str], body: bytes):
+        K = models.IdempotencyKey
+        expires_at = datetime.now() + timedelta(seconds=self.ttl)
+        async with self._factory()() as db:
+            saved = (await db.execute(
+                update(K).where(K.key_hash == key_hash, K.fingerprint == fingerprint)
+                .values(status_code=status_code, content_type=content_type, body=body, expires_at=expires_at)
+            )).rowcount
+            await db.commit()
+        if saved:
+            self._remember(key_hash, StoredResponse(fingerprint, status_code, content_type, body, expires_at))
+        self._saved += 1
+        if self._saved % PURGE_EVERY == 0:
+            await self.purge()
+
+    async def release(self, key_hash: str):
+        """删除占位（处理失败时），让重试重新执行"""
+        K = models.IdempotencyKey
+        async with self._factory()() as db:
+            await db.execute(delete(K).where(K.key_hash == key_hash, K.status_code.is_(None)))
+            await db.commit()
+
+    async def purge(self) -> int:
+        """整批删除过期记录"""
+        K = models.IdempotencyKey
+        async with self._factory()() as db:
+            removed = (await db.execute(delete(K).where(K.expires_at < datetime.now()))).rowcount
+            await db.commit()
+        if removed:
+            logger.info("清理过期幂等键 %d 条", removed)
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._cache),
+            "inflight": len(self._inflight),
+            "replayed": self.replayed,
+            "conflicts": self.conflicts,
+        }
+
+    # ---------- 请求处理 ----------
+
+    def _replay(self, stored: StoredResponse, fingerprint: str) -> Response:
+        if stored.fingerprint != fingerprint:
+            return JSONResponse(status_code=422, content={"detail": f"{HEADER} 已用于不同的请求"})
+        if not stored.completed:
+            self.conflicts += 1
+            return JSONResponse(status_code=409, content={"detail": "相同请求正在处理中，请稍后重试"},
+                                headers={"Retry-After": "1"})
+        self.replayed += 1
+        return Response(content=stored.body, status_code=stored.status_code, media_type=stored.content_type,
+                        headers={REPLAYED_HEADER: "true"})
+
+    async def handle(self, request: Request, call_next) -> Response:
+        key = request.headers.get(HEADER)
+        if not key or request.method not in MUTATING_METHODS:
+            return await call_next(request)
+        if len(key) > MAX_KEY_LENGTH:
+            return JSONResponse(status_code=400, content={"detail": f"{HEADER} 过长"})
+        caller = principal(request)
+        if caller is None:
+            return JSONResponse(status_code=401, content={"detail": f"{HEADER} 仅限登录后使用"},
+                                headers={"WWW-Authenticate": "Bearer"})
+        key_hash = scoped_key(caller, key)
+        fingerprint = _sha256(request.method, request.url.path, request.url.query, await request.body())
+
+        stored = await self.lookup(key_hash)
+        while (stored is None or not stored.completed) and key_hash in self._inflight:
+            # 本进程内的重复请求：等首个请求完成后回放
+            try:
+                await asyncio.wait_for(self._inflight[key_hash].wait(), WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                return self._replay(StoredResponse(fingerprint, None, None, None, datetime.now()), fingerprint)
+            stored = await self.lookup(key_hash)
+        if stored is not None:
+            return self._replay(stored, fingerprint)
+
+        # 检查与登记之间没有 await：本进程内同一个键只会有一个请求走到这里
+        waiter = self._inflight[key_hash] = asyncio.Event()
+        try:
+            existing = await self.claim(key_hash, fingerprint)
+            if existing is not None:
+                return self._replay(existing, fingerprint)
+            try:
+                response = await call_next(request)
+            except Exception:
+                await self.release(key_hash)
+                raise
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            if response.status_code >= 500 or len(body) > MAX_BODY:
+                await self.release(key_hash)
+            else:
+                await self.save(key_hash, fingerprint, response.status_code, response.headers.get("content-type"), body)
+            result = Response(content=body, status_code=response.status_code)
+            result.raw_headers = response.raw_headers
+            return result
+        finally:
+            self._inflight.pop(key_hash, None)
+            waiter.set()
+
+
+store = IdempotencyStore()
+
+
+async def idempotency_middleware(request: Request, call_next) -> Response:
+    return await store.handle(request, call_next)
@@ -0,0 +1,130 @@
+"""
+游标（keyset）分页
+- 按 (created_at, id) 或 (date, start_time, id) 这类唯一且有索引的排序键翻页，用行值比较 (a, b) < (?, ?) 定位下一页，
+  不依赖 OFFSET，翻到第几页耗时都一样
+- 游标对客户端不透明：排序键值经 JSON + base64url 编码
+- 列表接口仍返回数组，下一页游标放在响应头 X-Next-Cursor，没有下一页时不返回该头
+- 每页条数受 API_PAGE_SIZE_MAX 限制，不传 limit 时每页 API_PAGE_SIZE_DEFAULT 条；
+  需要完整列表的前端页面按 X-Next-Cursor 逐页取完（frontend/src/lib/api.ts 的 getAll）
+"""
+import base64
+import json
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from typing import Any, List, Optional, Sequence
+
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import String, literal, tuple_
+
+DEFAULT_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE_DEFAULT", "200"))
+MAX_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE_MAX", "1000"))
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+@dataclass
+class PageParams:
+    cursor: Optional[str]
+    limit: int
+
+    @classmethod
+    def of(cls, cursor: Optional[str], limit: int) -> "PageParams":
+        return cls(cursor=cursor or None, limit=max(1, min(limit, MAX_PAGE_SIZE)))
+
+
+def page_params(
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 的值"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, description=f"每页条数，默认 {DEFAULT_PAGE_SIZE}，最大 {MAX_PAGE_SIZE}"),
+) -> PageParams:
+    """分页参数依赖：超过上限的 limit 按上限处理"""
+    return PageParams.of(cursor, limit)
+
+
+def _db_text(value: datetime) -> str:
+    # SQLite 中 CURRENT_TIMESTAMP 写入的是不带微秒的文本，按同样格式比较才能与存储值一致；MySQL 也接受该格式
+    text = value.strftime("%Y-%m-%d %H:%M:%S")
+    return text + f".{value.microsecond:06d}" if value.microsecond else text
+
+
+def _encode_value(value: Any):
+    if isinstance(value, datetime):
+        return _db_text(value)
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    return value
+
+
+class Keyset:
+    """
+    一组排序键；所有键同向（默认倒序，最新在前），最后一列须唯一（一般是 id）
+
+    用法:
+        RECORDS = Keyset(models.MedicalRecord.created_at, models.MedicalRecord.id)
+        q = RECORDS.apply(q, page)          # Query / select 均可
+        return RECORDS.page(q.all(), page, response)
+    """
+
+    def __init__(self, *columns, desc: bool = True):
+        self.columns = columns
+        self.desc = desc
+
+    def encode(self, obj) -> str:
+        """按排序列的属性名从 ORM 对象/Row/DTO 上取值生成游标"""
+        values = [_encode_value(getattr(obj, c.key)) for c in self.columns]
+        raw = json.dumps(values, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+    def decode(self, cursor: str) -> list:
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            values = json.loads(raw.decode("utf-8"))
+            if not isinstance(values, list) or len(values) != len(self.columns):
+                raise ValueError(cursor)
+            return [self._bind(column, value) for column, value in zip(self.columns, values)]
+        except (ValueError, TypeError, UnicodeDecodeError):
+            raise HTTPException(status_code=400, detail="无效的分页游标")
+
+    @staticmethod
+    def _bind(column, value):
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            python_type = None
+        if value is None:
+            raise ValueError("null key")
+        if python_type is datetime:
+            # 以文本绑定，避免被方言的日期格式（如 SQLite 的 .000000 后缀）改写
+            return literal(str(value), String)
+        if python_type is date:
+            return literal(date.fromisoformat(value), column.type)
+        if python_type is time:
+            return literal(time.fromisoformat(value), column.type)
+        if python_type is int:
+            return literal(int(value), column.type)
+        return literal(value, column.type)
+
+    def order_by(self) -> list:
+        return [c.desc() if self.desc else c.asc() for c in self.columns]
+
+    def after(self, cursor: str):
+        """位于游标之后的行"""
+        row = tuple_(*self.columns)
+        bound = tuple_(*self.decode(cursor))
+        return row < bound if self.desc else row > bound
+
+    def apply(self, query, page: PageParams):
+        """加上游标条件、排序与 limit；多取一条用于判断是否还有下一页"""
+        if page.cursor:
+            query = query.where(self.after(page.cursor))
+        return query.order_by(*self.order_by()).limit(page.limit + 1)
+
+    def page(self, rows: Sequence, page: PageParams, response: Optional[Response] = None, key=None) -> List:
+        """截取本页并在响应头写入下一页游标；key 用于从联表查询的行中取出带排序键的对象"""
+        rows = list(rows)
+        if len(rows) > page.limit:
+            rows = rows[:page.limit]
+            if response is not None:
+                last = rows[-1]
+                response.headers[NEXT_CURSOR_HEADER] = self.encode(key(last) if key else last)
+        return rows
@@ -0,0 +1,113 @@
+"""
+请求级 SQL 统计与 N+1 检测
+- 挂在 SQLAlchemy Engine 的 before/after_cursor_execute 事件上，累计每个请求的语句数与数据库耗时
+- 同一请求内相同语句形状（参数已占位的 SQL 文本）重复执行达到阈值即判定为 N+1
+- 路由可通过 query_budget(n) 声明查询预算；测试模式（APP_ENV=test）下超预算直接返回 500
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("medical-system.sql")
+
+# 同一语句形状在一个请求内执行次数达到该值即视为 N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", "5"))
+# 全局默认查询预算（0 表示不限制），路由可用 query_budget() 单独覆盖
+DEFAULT_QUERY_BUDGET = int(os.getenv("DB_QUERY_BUDGET", "0"))
+# 严格模式：超出预算的请求直接失败，便于在测试中发现回归
+STRICT_QUERY_BUDGET = os.getenv("APP_ENV") == "test" or os.getenv("DB_QUERY_BUDGET_STRICT", "").lower() in ("1", "true", "yes")
+
+
+class RequestQueryStats:
+    """单个请求的 SQL 统计"""
+
+    def __init__(self, request: Request):
+        self.request = request
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.budget: Optional[int] = DEFAULT_QUERY_BUDGET or None
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, elapsed: float):
+        with self._lock:
+            self.count += 1
+            self.duration += elapsed
+            self.shapes[statement] += 1
+
+    @property
+    def route(self) -> str:
+        return route_label(self.request)
+
+    def n_plus_one(self) -> List[Tuple[str, int]]:
+        """重复次数达到阈值的语句形状"""
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= N_PLUS_ONE_THRESHOLD]
+
+    def over_budget(self) -> bool:
+        return self.budget is not None and self.count > self.budget
+
+
+_current_stats: contextvars.ContextVar = contextvars.ContextVar("request_query_stats", default=None)
+
+
+def current_stats() -> Optional[RequestQueryStats]:
+    return _current_stats.get()
+
+
+def begin_request(request: Request):
+    """开始统计一个请求，返回用于 end_request 的令牌"""
+    stats = RequestQueryStats(request)
+    return stats, _current_stats.set(stats)
+
+
+def end_request(token):
+    _current_stats.reset(token)
+
+
+def query_budget(limit: int):
+    """
+    路由级查询预算依赖
+
+    用法:
+        @router.get("/users", dependencies=[Depends(query_budget(3))])
+    """
+    def _apply_budget():
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.budget = limit
+    return _apply_budget
+
+
+def route_label(request: Request) -> str:
+    """优先使用路由模板（/api/doctor/records/{record_id}），便于按路由聚合"""
+    route = request.scope.get("route")
+    return f"{request.method} {getattr(route, 'path', request.url.path)}"
+
+
+def shorten(statement: str, limit: int = 160) -> str:
+    flat = " ".join(statement.split())
+    return flat if len(flat) <= limit else flat[:limit] + "..."
+
+
+# ==================== SQLAlchemy 事件 ====================
+# 注册在 Engine 类上，对同步引擎、异步引擎（sync_engine）和只读副本统一生效
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_start_time"].pop()
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(statement, time.perf_counter() - started)
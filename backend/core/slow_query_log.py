@@ -0,0 +1,181 @@
+"""
+慢查询日志
+- 执行耗时超过阈值（DB_SLOW_QUERY_MS）的语句记录：SQL、参数形状（只记类型不记值）、耗时、来源路由
+- 同时在同一连接上抓取执行计划：SQLite 为 EXPLAIN QUERY PLAN，MySQL 为 EXPLAIN
+- 明细写入滚动日志文件，按语句形状聚合的统计供 /api/admin/slow-queries 查看
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .query_stats import current_stats
+
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG_FILE = os.getenv(
+    "DB_SLOW_QUERY_LOG",
+    os.path.join(os.path.dirname(__file__), "..", "logs", "slow_query.log"),
+)
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("DB_SLOW_QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("DB_SLOW_QUERY_LOG_BACKUPS", "5"))
+# 同一语句形状的执行计划最多每隔多少秒重新抓取一次
+PLAN_REFRESH_SECONDS = 60
+# 内存中最多保留的语句形状数，超出时淘汰累计耗时最少的
+MAX_TRACKED_SHAPES = 500
+
+_EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE")
+
+_file_logger: Optional[logging.Logger] = None
+_entries = {}
+_lock = threading.Lock()
+
+
+def _get_file_logger() -> logging.Logger:
+    global _file_logger
+    if _file_logger is None:
+        os.makedirs(os.path.dirname(os.path.abspath(SLOW_QUERY_LOG_FILE)), exist_ok=True)
+        handler = RotatingFileHandler(
+            SLOW_QUERY_LOG_FILE,
+            maxBytes=SLOW_QUERY_LOG_MAX_BYTES,
+            backupCount=SLOW_QUERY_LOG_BACKUPS,
+            encoding="utf-8",
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger = logging.getLogger("medical-system.slow_query")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        _file_logger = logger
+    return _file_logger
+
+
+def param_shape(parameters, executemany: bool = False):
+    """参数形状：只保留类型，避免患者信息等敏感值落盘"""
+    if executemany and parameters:
+        return {"batch": len(parameters), "row": param_shape(parameters[0])}
+    if isinstance(parameters, dict):
+        return {k: type(v).__name__ for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(v).__name__ for v in parameters]
+    return type(parameters).__name__
+
+
+def capture_plan(conn, statement: str, parameters) -> Optional[List[str]]:
+    """在当前连接上抓取执行计划；直接使用 DBAPI 游标，不会再次触发 SQL 事件"""
+    if not statement.lstrip().upper().startswith(_EXPLAINABLE):
+        return None
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    elif dialect == "mysql":
+        prefix = "EXPLAIN "
+    else:
+        return None
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        rows = cursor.fetchall()
+        if dialect == "sqlite":
+            return [row[-1] for row in rows]
+        columns = [d[0] for d in cursor.description]
+        return [json.dumps(dict(zip(columns, row)), default=str, ensure_ascii=False) for row in rows]
+    except Exception as e:
+        return [f"<plan unavailable: {e}>"]
+    finally:
+        cursor.close()
+
+
+def record_slow_query(conn, statement: str, parameters, executemany: bool, elapsed_ms: float, explain: bool = True):
+    stats = current_stats()
+    route = stats.route if stats is not None else None
+    now = time.time()
+    with _lock:
+        entry = _entries.get(statement)
+        need_plan = explain and not executemany and (entry is None or now - entry["plan_at"] > PLAN_REFRESH_SECONDS)
+    plan = capture_plan(conn, statement, parameters) if need_plan else None
+    shape = param_shape(parameters, executemany)
+
+    with _lock:
+        entry = _entries.get(statement)
+        if entry is None:
+            if len(_entries) >= MAX_TRACKED_SHAPES:
+                del _entries[min(_entries, key=lambda k: _entries[k]["total_ms"])]
+            entry = _entries[statement] = {
+                "statement": statement,
+                "params": shape,
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "routes": {},
+                "plan": None,
+                "plan_at": 0.0,
+                "last_seen": None,
+            }
+        entry["count"] += 1
+        entry["total_ms"] += elapsed_ms
+        entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+        entry["last_seen"] = datetime.now().isoformat(timespec="seconds")
+        if route:
+            entry["routes"][route] = entry["routes"].get(route, 0) + 1
+        if plan is not None:
+            entry["plan"] = plan
+            entry["plan_at"] = now
+
+    _get_file_logger().info(json.dumps({
+        "ts": datetime.now().isoformat(timespec="milliseconds"),
+        "duration_ms": round(elapsed_ms, 2),
+        "route": route,
+        "statement": " ".join(statement.split()),
+        "params": shape,
+        "plan": plan,
+    }, ensure_ascii=False))
+
+
+def top_offenders(limit: int = 20, order_by: str = "total_ms") -> List[dict]:
+    """按累计耗时/最大耗时/次数排序的慢查询形状"""
+    if order_by not in ("total_ms", "max_ms", "count"):
+        order_by = "total_ms"
+    with _lock:
+        entries = sorted(_entries.values(), key=lambda e: e[order_by], reverse=True)[:limit]
+        return [
+            {
+                "statement": " ".join(e["statement"].split()),
+                "params": e["params"],
+                "count": e["count"],
+                "total_ms": round(e["total_ms"], 2),
+                "avg_ms": round(e["total_ms"] / e["count"], 2),
+                "max_ms": round(e["max_ms"], 2),
+                "routes": dict(sorted(e["routes"].items(), key=lambda kv: kv[1], reverse=True)),
+                "plan": e["plan"],
+                "last_seen": e["last_seen"],
+            }
+            for e in entries
+        ]
+
+
+def reset():
+    with _lock:
+        _entries.clear()
+
+
+# ==================== SQLAlchemy 事件 ====================
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _slow_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _slow_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["slow_query_start"].pop()) * 1000
+    if elapsed_ms >= SLOW_QUERY_MS:
+        # 服务端游标（stream_results）尚未读完时不能在同一连接上再执行 EXPLAIN
+        streaming = context is not None and context.execution_options.get("stream_results", False)
+        record_slow_query(conn, statement, parameters, executemany, elapsed_ms, explain=not streaming)
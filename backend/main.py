@@ -2,17 +2,18 @@ from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from passlib.context import CryptContext
+import asyncio
 import sys
 import os
 import logging
 
 # 兼容直接脚本运行（python main.py/uvicorn main:app）与包导入（backend.main）
 try:
-    from .database import engine, get_db, Base
+    from .database import engine, get_db, get_pool_stats, stamp_write, Base
     from . import models
 except ImportError:
     sys.path.append(os.path.dirname(__file__))
-    from database import engine, get_db, Base  # type: ignore
+    from database import engine, get_db, get_pool_stats, stamp_write, Base  # type: ignore
     import models  # type: ignore
 
 # 添加模块路径
@@ -25,14 +26,23 @@ from appointments.backend.routes import router as appointments_router
 from ai.routes import router as ai_router
 from api.auth import router as api_auth_router
 from api.admin import router as api_admin_router
+from api.admin_export import router as api_admin_export_router
 from api.doctor import router as api_doctor_router
 from api.pharmacy import router as api_pharmacy_router
 from api.ai_consult import router as api_ai_consult_router
 from api.profile import router as api_profile_router
 from api.orders import router as api_orders_router
 from api.stats import router as api_stats_router
+from backend.migrations import apply_migrations
+from backend.services import admission, counter_reconciler, schedule_materializer, slot_holds, striped_counters
+from backend.services.slot_feed import feed as slot_feed
+from backend.services.slot_inventory import inventory
+from backend.core.query_stats import STRICT_QUERY_BUDGET, begin_request, end_request, shorten
+from backend.core.idempotency import idempotency_middleware, store as idempotency_store
 
 models.Base.metadata.create_all(bind=engine)
+# 已有数据库的索引等结构变更由版本化迁移补齐
+apply_migrations(engine)
 
 # 启动时尝试加载初始数据
 try:
@@ -50,6 +60,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 游标分页的下一页游标；幂等回放标记；用户列表总数及是否为估算值
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed", "X-Total-Count", "X-Total-Count-Estimated"],
 )
 
 app.include_router(login_router)
@@ -58,6 +70,7 @@ app.include_router(appointments_router)
 app.include_router(ai_router)
 app.include_router(api_auth_router)
 app.include_router(api_admin_router)
+app.include_router(api_admin_export_router)
 app.include_router(api_doctor_router)
 app.include_router(api_pharmacy_router)
 app.include_router(api_ai_consult_router)
@@ -87,7 +100,7 @@ def create_default_admin():
         print("Default admin created: 13800138000 / admin")
 
 @app.on_event("startup")
-def create_default_doctor_and_schedules():
+def create_default_doctor():
     db = next(get_db())
     doctor = db.query(models.User).filter(models.User.role == models.UserRole.doctor).first()
     if not doctor:
@@ -112,62 +125,30 @@ def create_default_doctor_and_schedules():
         db.commit()
         print("Default doctor created: 13900000000 / doctor")
 
-    from datetime import date, timedelta, time
-    today = date.today()
-    for i in range(0, 7):
-        d = today + timedelta(days=i)
-        am_exists = db.query(models.DoctorSchedule).filter(
-            models.DoctorSchedule.doctor_id == doctor.id,
-            models.DoctorSchedule.date == d,
-            models.DoctorSchedule.start_time == time(9, 0)
-        ).first()
-        if not am_exists:
-            am = models.DoctorSchedule(
-                doctor_id=doctor.id,
-                date=d,
-                start_time=time(9, 0),
-                end_time=time(12, 0),
-                capacity=0,
-                booked_count=0,
-                status=models.ScheduleStatus.open
-            )
-            db.add(am)
-        pm_exists = db.query(models.DoctorSchedule).filter(
-            models.DoctorSchedule.doctor_id == doctor.id,
-            models.DoctorSchedule.date == d,
-            models.DoctorSchedule.start_time == time(13, 0)
-        ).first()
-        if not pm_exists:
-            pm = models.DoctorSchedule(
-                doctor_id=doctor.id,
-                date=d,
-                start_time=time(13, 0),
-                end_time=time(17, 0),
-                capacity=0,
-                booked_count=0,
-                status=models.ScheduleStatus.open
-            )
-            db.add(pm)
-    db.commit()
-
-    # 建立未来一个月的日期表（按天聚合容量）
-    for i in range(0, 30):
-        d = today + timedelta(days=i)
-        exists_day = db.query(models.DoctorDaySchedule).filter(
-            models.DoctorDaySchedule.doctor_id == doctor.id,
-            models.DoctorDaySchedule.date == d
-        ).first()
-        if not exists_day:
-            dayrow = models.DoctorDaySchedule(
-                doctor_id=doctor.id,
-                date=d,
-                am_capacity=0,
-                am_booked_count=0,
-                pm_capacity=0,
-                pm_booked_count=0,
-            )
-            db.add(dayrow)
-    db.commit()
+
+# 排班按周模板滚动生成，放到后台任务里执行，不再在启动时逐天逐时段查询补齐
+@app.on_event("startup")
+async def start_schedule_materializer():
+    # 保存任务引用，避免被垃圾回收
+    app.state.schedule_materializer = asyncio.create_task(schedule_materializer.run_periodically())
+
+
+# 两段式挂号的过期暂占号整批释放
+@app.on_event("startup")
+async def start_slot_hold_sweeper():
+    app.state.slot_hold_sweeper = asyncio.create_task(slot_holds.run_periodically())
+
+
+# 排班计数增量对账：只重算触发器记录过变化的 (医生, 日期)
+@app.on_event("startup")
+async def start_counter_reconciler():
+    app.state.counter_reconciler = asyncio.create_task(counter_reconciler.run_periodically())
+
+
+# 热点排班分片计数：切换、汇总写回、合并
+@app.on_event("startup")
+async def start_striped_counters():
+    app.state.striped_counters = asyncio.create_task(striped_counters.run_periodically())
 
 @app.get("/")
 def read_root():
@@ -209,7 +190,13 @@ def metrics():
             "total": ap_total,
             "confirmed": ap_confirmed,
             "cancelled": ap_cancelled,
-        }
+        },
+        "db_pool": get_pool_stats(),
+        "slot_inventory": inventory.stats(),
+        "booking_admission": admission.controller.stats(),
+        "slot_feed": slot_feed.stats(),
+        "idempotency": idempotency_store.stats(),
+        "striped_counters": striped_counters.stats(db),
     }
 # 基础日志配置与请求日志中间件
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(name)s: %(message)s')
@@ -225,3 +212,38 @@ async def log_requests(request: Request, call_next):
     except Exception as e:
         logger.exception(f"Unhandled error on {request.method} {request.url.path}: {e}")
         return JSONResponse(status_code=500, content={"detail": "服务器内部错误"})
+
+# 请求级 SQL 统计：响应头返回语句数与数据库耗时，疑似 N+1 与超出查询预算写日志；
+# 测试模式下超预算的请求直接返回 500
+@app.middleware("http")
+async def sql_query_stats(request: Request, call_next):
+    stats, token = begin_request(request)
+    try:
+        response = await call_next(request)
+    finally:
+        end_request(token)
+    suspects = stats.n_plus_one()
+    for shape, times in suspects:
+        logger.warning(f"N+1 suspected on {stats.route}: {times}x {shorten(shape)}")
+    if stats.over_budget():
+        logger.warning(f"Query budget exceeded on {stats.route}: {stats.count} > {stats.budget}")
+        if STRICT_QUERY_BUDGET:
+            response = JSONResponse(status_code=500, content={"detail": f"查询预算超限: {stats.count} > {stats.budget}"})
+    if stats.count:
+        logger.info(f"{stats.route} sql={stats.count} db_ms={stats.duration * 1000:.1f}")
+    response.headers["X-DB-Query-Count"] = str(stats.count)
+    response.headers["X-DB-Time-ms"] = f"{stats.duration * 1000:.2f}"
+    if suspects:
+        response.headers["X-DB-N-Plus-One"] = str(len(suspects))
+    return response
+
+# 写接口幂等键：带 Idempotency-Key 的重试直接回放首个请求的响应（位于读己之写之内，回放的响应同样下发令牌）
+app.middleware("http")(idempotency_middleware)
+
+# 读写分离：成功的写请求下发读己之写令牌，随后短时间内该客户端的读请求走主库
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    response = await call_next(request)
+    if request.method in ("POST", "PUT", "PATCH", "DELETE") and response.status_code < 400:
+        stamp_write(response)
+    return response
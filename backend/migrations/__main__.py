@@ -0,0 +1,18 @@
+"""
+手动执行迁移：
+    cd backend
+    python -m migrations
+"""
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from database import engine
+import models
+from migrations import apply_migrations
+
+if __name__ == "__main__":
+    models.Base.metadata.create_all(bind=engine)
+    executed = apply_migrations(engine)
+    print(f"已执行迁移: {executed}" if executed else "数据库已是最新版本")
@@ -1,10 +1,16 @@
-from sqlalchemy import Column, Integer, String, Enum, TIMESTAMP, Date, Time, ForeignKey, CheckConstraint
-from sqlalchemy.sql import func
+from sqlalchemy import Column, Integer, String, Enum, TIMESTAMP, Date, Time, ForeignKey, CheckConstraint, UniqueConstraint, LargeBinary
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func, text
 try:
     from .database import Base
 except ImportError:
     from database import Base
 import enum
+import sys
+
+# 与 database 相同：database / backend.database 共用一个 Base，模型模块也只能加载一次
+sys.modules.setdefault("models", sys.modules[__name__])
+sys.modules.setdefault("backend.models", sys.modules[__name__])
 
 class UserRole(str, enum.Enum):
     admin = "admin"
@@ -36,6 +42,11 @@ class User(Base):
     status = Column(Enum(UserStatus), default=UserStatus.active)
     created_at = Column(TIMESTAMP, server_default=func.now())
 
+    # 各角色资料（一对一）；只读，资料的增删仍由各接口显式处理，删除用户时不会去改写资料外键
+    doctor_profile = relationship("DoctorProfile", uselist=False, viewonly=True)
+    patient_profile = relationship("PatientProfile", uselist=False, viewonly=True)
+    pharmacist_profile = relationship("PharmacistProfile", uselist=False, viewonly=True)
+
 # ==================== 预约与排班 ====================
 
 class ScheduleStatus(str, enum.Enum):
@@ -59,9 +70,24 @@ class DoctorSchedule(Base):
     end_time = Column(Time, nullable=False)
     capacity = Column(Integer, nullable=False, default=1)
     booked_count = Column(Integer, nullable=False, default=0)
+    # 患者确认/支付前暂占的号数（见 services.slot_holds）；余号 = capacity - booked_count - held_count
+    held_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # 分片计数的分片数，0 为单行计数；分片时实时计数在 schedule_counter_stripes，上面两个计数定期汇总（见 services.striped_counters）
+    stripes = Column(Integer, nullable=False, default=0, server_default="0")
     status = Column(Enum(ScheduleStatus), nullable=False, default=ScheduleStatus.open)
     created_at = Column(TIMESTAMP, server_default=func.now())
 
+# 热点排班的分片计数：排班容量按分片拆开，占号/退号只更新其中一个分片，余号为各分片之和
+class ScheduleCounterStripe(Base):
+    __tablename__ = "schedule_counter_stripes"
+
+    id = Column(Integer, primary_key=True)
+    schedule_id = Column(Integer, ForeignKey("doctor_schedules.id"), nullable=False)
+    stripe = Column(Integer, nullable=False)
+    capacity = Column(Integer, nullable=False, default=0)
+    booked_count = Column(Integer, nullable=False, default=0)
+    held_count = Column(Integer, nullable=False, default=0)
+
 # 按天聚合的排班容量（上午/下午）
 class DoctorDaySchedule(Base):
     __tablename__ = "doctor_day_schedules"
@@ -75,6 +101,22 @@ class DoctorDaySchedule(Base):
     pm_booked_count = Column(Integer, nullable=False, default=0)
     created_at = Column(TIMESTAMP, server_default=func.now())
 
+# 医生周排班模板：每周几上午/下午放多少号，0 表示该时段不出诊；具体排班由 services.schedule_materializer 按滚动窗口生成
+class DoctorScheduleTemplate(Base):
+    __tablename__ = "doctor_schedule_templates"
+    __table_args__ = (
+        UniqueConstraint("doctor_id", "weekday", name="ux_schedule_templates_doctor_weekday"),
+        CheckConstraint("weekday BETWEEN 0 AND 6", name="ck_schedule_templates_weekday"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    doctor_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    weekday = Column(Integer, nullable=False)  # 0=周一 … 6=周日
+    am_capacity = Column(Integer, nullable=False, default=0)
+    pm_capacity = Column(Integer, nullable=False, default=0)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
 class Appointment(Base):
     __tablename__ = "appointments"
 
@@ -84,6 +126,60 @@ class Appointment(Base):
     schedule_id = Column(Integer, ForeignKey("doctor_schedules.id"), nullable=False)
     status = Column(Enum(AppointmentStatus), nullable=False, default=AppointmentStatus.pending)
     created_at = Column(TIMESTAMP, server_default=func.now())
+    # 每次 UPDATE（ORM 与 Core 的 update() 都会带上）加 1，医生端列表的版本戳据此感知状态变化，见 services.doctor_appointments
+    revision = Column(Integer, nullable=False, default=0, server_default="0", onupdate=text("revision + 1"))
+
+class HoldStatus(str, enum.Enum):
+    held = "held"
+    confirmed = "confirmed"  # 已转为预约
+    released = "released"    # 患者主动放弃
+    expired = "expired"      # 超时未确认，由后台清理释放
+
+# 两段式挂号的暂占号：占住 held_count 直到确认（转为预约）、放弃或过期，索引见迁移 6
+class SlotHold(Base):
+    __tablename__ = "slot_holds"
+
+    id = Column(Integer, primary_key=True, index=True)
+    patient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    doctor_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    schedule_id = Column(Integer, ForeignKey("doctor_schedules.id"), nullable=False)
+    status = Column(Enum(HoldStatus), nullable=False, default=HoldStatus.held)
+    expires_at = Column(TIMESTAMP, nullable=False)
+    appointment_id = Column(Integer, ForeignKey("appointments.id"), nullable=True)
+    # 过期清理批次号：同一批被标记过期的暂占号据此整批回补计数
+    sweep_batch = Column(String(32), nullable=True)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    resolved_at = Column(TIMESTAMP, nullable=True)
+
+# 排班计数变更记录：预约/暂占号的增删改由触发器写入涉及的 (医生, 日期)（见迁移 7），
+# 计数对账（services.counter_reconciler）只重算这里出现过的 (医生, 日期)，处理完删除
+class ScheduleCounterChange(Base):
+    __tablename__ = "schedule_counter_changes"
+
+    id = Column(Integer, primary_key=True)
+    doctor_id = Column(Integer, nullable=False)
+    date = Column(Date, nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+class WaitlistStatus(str, enum.Enum):
+    waiting = "waiting"
+    promoted = "promoted"    # 有人退号后自动转为预约
+    skipped = "skipped"      # 轮到时不满足挂号条件（如当日预约数已达上限）
+    cancelled = "cancelled"  # 患者退出候补，或轮到时已有该排班的有效预约
+
+# 满员排班的候补队列：退号时在同一事务里按 id 顺序把队首转为预约（见 services.waitlist），索引见迁移 5
+class AppointmentWaitlist(Base):
+    __tablename__ = "appointment_waitlist"
+
+    id = Column(Integer, primary_key=True, index=True)
+    patient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    doctor_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    schedule_id = Column(Integer, ForeignKey("doctor_schedules.id"), nullable=False)
+    status = Column(Enum(WaitlistStatus), nullable=False, default=WaitlistStatus.waiting)
+    appointment_id = Column(Integer, ForeignKey("appointments.id"), nullable=True)
+    detail = Column(String(100), nullable=True)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    resolved_at = Column(TIMESTAMP, nullable=True)
 
 # ==================== 药品管理 ====================
 
@@ -197,6 +293,11 @@ class Prescription(Base):
     created_at = Column(TIMESTAMP, server_default=func.now())
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
 
+    items = relationship("PrescriptionItem", back_populates="prescription", order_by="PrescriptionItem.id")
+    medical_record = relationship("MedicalRecord")
+    patient = relationship("User", foreign_keys=[patient_id])
+    doctor = relationship("User", foreign_keys=[doctor_id])
+
 class PrescriptionItem(Base):
     __tablename__ = "prescription_items"
 
@@ -206,3 +307,32 @@ class PrescriptionItem(Base):
     quantity = Column(Integer, nullable=False, default=1)
     price_at_time = Column(Integer, nullable=False)  # 开药时的单价
     usage_instruction = Column(String(255), nullable=True) # 用法用量
+
+    prescription = relationship("Prescription", back_populates="items")
+    medication = relationship("Medication")
+
+# ==================== 用户搜索 ====================
+
+# 姓名的单字/两字索引，供 1~2 个字符的关键字搜索（更长的关键字走 user_search 的 trigram/ngram 全文索引，见迁移 12）；
+# 由 services.user_search 维护，不设外键，删除用户时与账号在同一次 flush 里清理
+class UserSearchGram(Base):
+    __tablename__ = "user_search_grams"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    gram = Column(String(2), primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+
+# ==================== 幂等键 ====================
+
+# 写接口的 Idempotency-Key 记录（见 core.idempotency）：status_code 为空表示首个请求仍在处理中
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key_hash = Column(String(64), unique=True, nullable=False)     # sha256(调用方用户 id:角色 + 幂等键)
+    fingerprint = Column(String(64), nullable=False)               # sha256(方法 + 路径 + 请求体)
+    status_code = Column(Integer, nullable=True)
+    content_type = Column(String(100), nullable=True)
+    body = Column(LargeBinary, nullable=True)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    expires_at = Column(TIMESTAMP, nullable=False, index=True)
@@ -74,10 +74,10 @@ class PrescriptionResponse(BaseModel):
     class Config:
         from_attributes = True
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import date, time, datetime
-from models import UserRole, UserStatus, ScheduleStatus, AppointmentStatus
+from models import UserRole, UserStatus, ScheduleStatus, AppointmentStatus, WaitlistStatus, HoldStatus
 
 class UserBase(BaseModel):
     phone: str
@@ -123,12 +123,25 @@ class ScheduleResponse(BaseModel):
     end_time: time
     capacity: int
     booked_count: int
+    held_count: int = 0
     status: ScheduleStatus
     fully_booked: Optional[bool] = None
 
     class Config:
         from_attributes = True
 
+class ScheduleTemplateItem(BaseModel):
+    weekday: int = Field(..., ge=0, le=6, description="0=周一 … 6=周日")
+    am_capacity: int = Field(0, ge=0, description="上午号源数，0 表示不出诊")
+    pm_capacity: int = Field(0, ge=0, description="下午号源数，0 表示不出诊")
+
+class ScheduleTemplateResponse(ScheduleTemplateItem):
+    id: int
+    doctor_id: int
+
+    class Config:
+        from_attributes = True
+
 # ==================== 预约 ====================
 
 class AppointmentCreate(BaseModel):
@@ -146,6 +159,41 @@ class AppointmentResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class WaitlistCreate(BaseModel):
+    doctor_id: int
+    schedule_id: int
+
+class WaitlistResponse(BaseModel):
+    id: int
+    patient_id: int
+    doctor_id: int
+    schedule_id: int
+    status: WaitlistStatus
+    appointment_id: Optional[int] = None
+    detail: Optional[str] = None
+    created_at: Optional[datetime] = None
+    position: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+class HoldCreate(BaseModel):
+    doctor_id: int
+    schedule_id: int
+
+class HoldResponse(BaseModel):
+    id: int
+    patient_id: int
+    doctor_id: int
+    schedule_id: int
+    status: HoldStatus
+    expires_at: datetime
+    appointment_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
 # ==================== 药品 ====================
 
 class MedicationBase(BaseModel):
@@ -0,0 +1,3 @@
+"""
+读模型/领域服务：多个接口共用的查询与写入逻辑，路由层只负责参数校验与响应组装
+"""
@@ -0,0 +1,259 @@
+"""
+挂号排队受理（放号高峰削峰）
+- 挂号请求不再各自开写事务抢锁：按 (医生, 日期) 进入进程内 asyncio 队列，每个队列只有一个消费者，
+  成批取出后在同一个事务里逐笔受理（每笔一个 SAVEPOINT，失败只回滚该笔），整批只提交一次
+- 整批在工作线程里用同步会话执行；SQLite 上批事务以 BEGIN IMMEDIATE 开始：一开始就拿到写锁，也让 SAVEPOINT 真正嵌套在外层事务里
+  （pysqlite 在首条 DML 前不发 BEGIN，直接 SAVEPOINT/RELEASE 会变成逐笔提交）
+- 分配方式 BOOKING_ADMISSION_MODE：fifo 先到先得；lottery 在首个请求到达后收集
+  BOOKING_ADMISSION_WINDOW_MS 毫秒内的全部请求，随机排序后再受理
+- 每位患者每天的有效预约数上限见 booking.PATIENT_DAILY_CAP
+- 每个请求对应一张票据：挂号接口在 BOOKING_ADMISSION_WAIT 秒内等到结果就直接返回预约，否则返回 202 和票据，
+  客户端用 GET /appointments/tickets/{ticket_id} 查询排队位置与最终结果
+- 队列只在本进程内：多进程部署时各进程各自排队，正确性仍由条件 UPDATE 与唯一部分索引保证
+"""
+import asyncio
+import logging
+import os
+import random
+import time as _time
+import uuid
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend.services import booking
+from backend.services.slot_inventory import inventory
+
+logger = logging.getLogger("medical-system.admission")
+
+ENABLED = os.getenv("BOOKING_ADMISSION_ENABLED", "1").lower() in ("1", "true", "yes")
+MODE = os.getenv("BOOKING_ADMISSION_MODE", "fifo")
+BATCH_SIZE = int(os.getenv("BOOKING_ADMISSION_BATCH", "50"))
+LOTTERY_WINDOW_SECONDS = float(os.getenv("BOOKING_ADMISSION_WINDOW_MS", "500")) / 1000
+WAIT_SECONDS = float(os.getenv("BOOKING_ADMISSION_WAIT", "10"))
+# 队列空闲多久后消费者退出
+IDLE_SECONDS = 5
+# 已出结果的票据保留时长
+TICKET_TTL_SECONDS = 600
+
+MODES = ("fifo", "lottery")
+
+
+@dataclass
+class Ticket:
+    id: str
+    patient_id: int
+    doctor_id: int
+    schedule_id: int
+    day: date
+    seq: int
+    # queued -> processing -> booked / rejected
+    status: str = "queued"
+    appointment_id: Optional[int] = None
+    created: bool = False
+    detail: Optional[str] = None
+    # 被拒时 booking.BookingError 的原因代码；受理出错（稍后重试）时为 None
+    reason: Optional[str] = None
+    finished_at: Optional[float] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+
+class _Lane:
+    """一个 (医生, 日期) 的队列；seq 单调递增，head 为已被消费者取走的最大 seq"""
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.next_seq = 0
+        self.head = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+class AdmissionController:
+    def __init__(self, mode: str = MODE, batch_size: int = BATCH_SIZE, window: float = LOTTERY_WINDOW_SECONDS,
+                 daily_cap: Optional[int] = None, session_factory: Optional[Callable] = None):
+        if mode not in MODES:
+            raise ValueError(f"未知的受理方式: {mode}")
+        self.mode = mode
+        self.batch_size = max(1, batch_size)
+        self.window = window
+        self.daily_cap = daily_cap
+        self._session_factory = session_factory
+        self._lanes: Dict[Tuple[int, date], _Lane] = {}
+        self._tickets: Dict[str, Ticket] = {}
+        self._submitted = 0
+        self.batches = 0
+        self.admitted = 0
+
+    def configure(self, session_factory: Optional[Callable] = None, mode: Optional[str] = None,
+                  batch_size: Optional[int] = None, daily_cap: Optional[int] = None):
+        """调整受理参数（压测/脚本使用独立数据库或切换模式时调用）"""
+        if mode is not None:
+            if mode not in MODES:
+                raise ValueError(f"未知的受理方式: {mode}")
+            self.mode = mode
+        if session_factory is not None:
+            self._session_factory = session_factory
+        if batch_size is not None:
+            self.batch_size = max(1, batch_size)
+        if daily_cap is not None:
+            self.daily_cap = daily_cap
+
+    # ---------- 入队与查询 ----------
+
+    def submit(self, patient_id: int, doctor_id: int, schedule_id: int, day: date) -> Ticket:
+        key = (doctor_id, day)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane()
+            lane.task = asyncio.get_running_loop().create_task(self._consume(key, lane))
+        lane.next_seq += 1
+        ticket = Ticket(id=uuid.uuid4().hex, patient_id=patient_id, doctor_id=doctor_id,
+                        schedule_id=schedule_id, day=day, seq=lane.next_seq)
+        self._tickets[ticket.id] = ticket
+        lane.queue.put_nowait(ticket)
+        self._submitted += 1
+        if self._submitted % 256 == 0:
+            self._purge()
+        return ticket
+
+    async def wait(self, ticket: Ticket, timeout: float) -> bool:
+        """等待票据出结果，超时返回 False（票据仍在队列里）"""
+        try:
+            await asyncio.wait_for(ticket.done.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def get(self, ticket_id: str) -> Optional[Ticket]:
+        return self._tickets.get(ticket_id)
+
+    def position(self, ticket: Ticket) -> int:
+        """前面还有多少个请求（含自己）；已被取走处理或已出结果为 0。抽签模式下仅供参考"""
+        if ticket.status != "queued":
+            return 0
+        lane = self._lanes.get((ticket.doctor_id, ticket.day))
+        return max(ticket.seq - lane.head, 1) if lane else 0
+
+    def view(self, ticket: Ticket) -> dict:
+        return {
+            "ticket_id": ticket.id,
+            "status": ticket.status,
+            "position": self.position(ticket),
+            "mode": self.mode,
+            "schedule_id": ticket.schedule_id,
+            "appointment_id": ticket.appointment_id,
+            "detail": ticket.detail,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "lanes": len(self._lanes),
+            "queued": sum(lane.queue.qsize() for lane in self._lanes.values()),
+            "tickets": len(self._tickets),
+            "batches": self.batches,
+            "admitted": self.admitted,
+        }
+
+    def _purge(self):
+        expire = _time.monotonic() - TICKET_TTL_SECONDS
+        for ticket_id in [k for k, t in self._tickets.items() if t.finished_at and t.finished_at < expire]:
+            del self._tickets[ticket_id]
+
+    # ---------- 消费 ----------
+
+    async def _collect(self, lane: _Lane, first: Ticket) -> List[Ticket]:
+        batch = [first]
+        if self.mode == "lottery":
+            await asyncio.sleep(self.window)
+            while not lane.queue.empty():
+                batch.append(lane.queue.get_nowait())
+            random.SystemRandom().shuffle(batch)
+        else:
+            while len(batch) < self.batch_size and not lane.queue.empty():
+                batch.append(lane.queue.get_nowait())
+        lane.head = max(lane.head, max(t.seq for t in batch))
+        return batch
+
+    async def _consume(self, key, lane: _Lane):
+        while True:
+            try:
+                first = await asyncio.wait_for(lane.queue.get(), IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                if lane.queue.empty():
+                    self._lanes.pop(key, None)
+                    return
+                continue
+            batch = await self._collect(lane, first)
+            for start in range(0, len(batch), self.batch_size):
+                await self._run(batch[start:start + self.batch_size])
+
+    async def _run(self, tickets: List[Ticket]):
+        for t in tickets:
+            t.status = "processing"
+        try:
+            # 整批在工作线程里用同步会话执行，逐条语句不再经过事件循环往返
+            await asyncio.to_thread(self._run_batch, tickets)
+        except Exception:
+            logger.exception("admission batch failed: %s tickets", len(tickets))
+            for t in tickets:
+                if t.status == "processing":
+                    t.status, t.detail = "rejected", "挂号失败，请稍后重试"
+        self.batches += 1
+        now = _time.monotonic()
+        for t in tickets:
+            t.finished_at = now
+            t.done.set()
+
+    def _run_batch(self, tickets: List[Ticket]):
+        factory = self._session_factory
+        if factory is None:
+            from backend.database import SessionLocal as factory
+        with factory() as db:
+            self.admit_batch(db, tickets)
+
+    def admit_batch(self, db: Session, tickets: List[Ticket]):
+        """一个事务内逐笔受理；每笔在 SAVEPOINT 里执行，占号失败只回滚该笔"""
+        connection = db.connection()
+        if connection.dialect.name == "sqlite":
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+        cap = booking.PATIENT_DAILY_CAP if self.daily_cap is None else self.daily_cap
+        results = {}
+        # 本批内已满的排班：持有写锁期间不会有人退号，后续请求只查一次是否已有预约（重复提交返回原预约），不再走占号
+        full = {}
+        for t in tickets:
+            if t.schedule_id in full:
+                exists = booking.find_active(db, t.patient_id, t.schedule_id)
+                if exists is None:
+                    t.status, t.detail, t.reason = "rejected", full[t.schedule_id], booking.FULL
+                else:
+                    results[t.id] = (exists.id, False)
+                continue
+            try:
+                with db.begin_nested():
+                    appt, created = booking.place(db, t.patient_id, t.doctor_id, t.schedule_id, daily_cap=cap)
+                results[t.id] = (appt.id, created)
+            except booking.BookingError as e:
+                t.status, t.detail, t.reason = "rejected", e.detail, e.reason
+                if e.reason == booking.FULL:
+                    full[t.schedule_id] = e.detail
+            except IntegrityError:
+                # 与本队列之外的挂号并发撞上唯一部分索引：返回已有预约
+                exists = booking.find_active(db, t.patient_id, t.schedule_id)
+                if exists is None:
+                    t.status, t.detail = "rejected", "挂号失败，请稍后重试"
+                else:
+                    results[t.id] = (exists.id, False)
+        db.commit()
+        for t in tickets:
+            if t.id in results:
+                t.appointment_id, t.created = results[t.id]
+                t.status = "booked"
+                self.admitted += t.created
+        inventory.refresh(db, {t.schedule_id for t in tickets})
+
+
+controller = AdmissionController()
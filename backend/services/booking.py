@@ -0,0 +1,294 @@
+"""
+挂号占号/退号
+- 占号是一条条件 UPDATE：booked_count = booked_count + 1 WHERE booked_count < capacity，按 rowcount 判断是否抢到，
+  不再“先读计数、Python 里比较、再写回”，并发下不会超卖
+- 日聚合表（上午/下午）同样用条件 UPDATE 计数，容量为 0 表示不限；缺行时 INSERT IGNORE 补建后重试，并发补建不会撞唯一索引
+- 两段式挂号的暂占号（services.slot_holds）计入 held_count，占号条件为 booked_count + held_count < capacity；
+  日聚合不区分暂占与预约
+- 热点排班切换为分片计数后（services.striped_counters），排班行上的条件 UPDATE 因 stripes = 0 不成立而落空，
+  改为占/退某一个分片，日聚合由分片汇总任务维护
+- 同一患者同一排班只能有一条未取消预约，由唯一部分索引 ux_appointments_active_patient_schedule 兜底（见迁移 3），
+  并发重复提交时返回已有预约
+- 退号先把预约状态从非取消条件更新为取消，只有真正发生状态变化的那次请求才回补容量，重复取消不会多减；
+  回补后在同一事务里把该排班的候补队首转为预约（services.waitlist）
+- 提交后按排班 id 写穿号源库存缓存（services.slot_inventory），占号因满员失败时也回读一次纠正缓存
+- 所有函数只用同步 Session，异步路由通过 AsyncSession.run_sync 调用
+"""
+import os
+from datetime import date, time
+from typing import Optional, Tuple
+
+from sqlalchemy import func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.services import striped_counters
+from backend.services.slot_inventory import inventory
+
+# 每位患者每天最多持有的有效预约数，0 表示不限（挂号接口与排队受理使用）
+PATIENT_DAILY_CAP = int(os.getenv("BOOKING_PATIENT_DAILY_CAP", "3"))
+
+FULL_DETAIL = "排班容量不足"
+
+# BookingError.reason：调用方按它判断失败原因，detail 只用于展示，修改文案不影响分支
+FULL = "full"              # 排班容量不足
+DAY_FULL = "day_full"      # 医生当天上午/下午容量已满
+NOT_FOUND = "not_found"    # 排班不存在
+CLOSED = "closed"          # 排班未开放
+DAILY_CAP = "daily_cap"    # 患者当天有效预约数已达上限
+DUPLICATE = "duplicate"    # 已有该排班的有效预约
+REJECTED = "rejected"      # 其他不满足挂号条件的情况
+
+
+class BookingError(Exception):
+    """占号失败（容量不足、排班未开放等），detail 直接作为接口错误信息，reason 为上面的原因代码"""
+
+    def __init__(self, detail: str, reason: str = REJECTED):
+        super().__init__(detail)
+        self.detail = detail
+        self.reason = reason
+
+
+def is_morning(start_time: time) -> bool:
+    return int(str(start_time).split(":")[0]) < 12
+
+
+def _day_columns(start_time: time):
+    D = models.DoctorDaySchedule
+    if is_morning(start_time):
+        return D.am_booked_count, D.am_capacity, "上午容量已满"
+    return D.pm_booked_count, D.pm_capacity, "下午容量已满"
+
+
+def find_active(db: Session, patient_id: int, schedule_id: int) -> Optional[models.Appointment]:
+    A = models.Appointment
+    return db.scalar(select(A).where(
+        A.patient_id == patient_id,
+        A.schedule_id == schedule_id,
+        A.status != models.AppointmentStatus.cancelled,
+    ))
+
+
+def _take_row(db: Session, schedule_id: int, held: bool) -> bool:
+    S = models.DoctorSchedule
+    counter = S.held_count if held else S.booked_count
+    return bool(db.execute(
+        update(S)
+        .where(S.id == schedule_id, S.status == models.ScheduleStatus.open, S.stripes == 0,
+               S.booked_count + S.held_count < S.capacity)
+        .values({counter: counter + 1})
+        .execution_options(synchronize_session=False)
+    ).rowcount)
+
+
+def reserve_slot(db: Session, schedule_id: int, doctor_id: int, day: date, start_time: time, held: bool = False):
+    """
+    在当前事务里占一个号：排班计数与日聚合计数都用条件 UPDATE，任一失败抛 BookingError（调用方回滚）
+    held=True 为暂占，计入 held_count，否则计入 booked_count
+    """
+    S = models.DoctorSchedule
+    if not _take_row(db, schedule_id, held):
+        stripes = db.scalar(select(S.stripes).where(S.id == schedule_id, S.status == models.ScheduleStatus.open))
+        if not stripes:
+            raise BookingError(FULL_DETAIL, FULL)
+        if striped_counters.take(db, schedule_id, stripes, held):
+            striped_counters.tracker.record(schedule_id)
+            return
+        # 分片全满；也可能刚好合并回了单行，按单行再试一次
+        if db.scalar(select(S.stripes).where(S.id == schedule_id)) or not _take_row(db, schedule_id, held):
+            raise BookingError(FULL_DETAIL, FULL)
+    striped_counters.tracker.record(schedule_id)
+
+    D = models.DoctorDaySchedule
+    booked, capacity, full_detail = _day_columns(start_time)
+    count_day = (
+        update(D)
+        .where(D.doctor_id == doctor_id, D.date == day,
+               or_(capacity.is_(None), capacity == 0, booked < capacity))
+        .values({booked: func.coalesce(booked, 0) + 1})
+        .execution_options(synchronize_session=False)
+    )
+    if db.execute(count_day).rowcount:
+        return
+    # 旧数据可能缺日聚合行：INSERT IGNORE 补建（容量 0 即不限），同一医生同一天并发补建时由唯一索引只留一行，
+    # 再按条件 UPDATE 计数；行已存在仍计不上即为满员
+    db.execute(
+        insert(D).prefix_with("OR IGNORE", dialect="sqlite").prefix_with("IGNORE", dialect="mysql")
+        .values(doctor_id=doctor_id, date=day)
+    )
+    if not db.execute(count_day).rowcount:
+        raise BookingError(full_detail, DAY_FULL)
+
+
+def release_slot(db: Session, schedule_id: int, held: bool = False):
+    """在当前事务里退回一个号（计数不会减到负数）；held=True 退回暂占"""
+    S = models.DoctorSchedule
+    schedule = db.execute(select(S.doctor_id, S.date, S.start_time, S.stripes).where(S.id == schedule_id)).first()
+    if schedule is None:
+        return
+    striped_counters.tracker.record(schedule_id)
+    if schedule.stripes:
+        if striped_counters.give_back(db, schedule_id, schedule.stripes, held) \
+                or db.scalar(select(S.stripes).where(S.id == schedule_id)):
+            return
+        # 刚好合并回了单行：按单行退
+    counter = S.held_count if held else S.booked_count
+    db.execute(
+        update(S)
+        .where(S.id == schedule_id, counter > 0)
+        .values({counter: counter - 1})
+        .execution_options(synchronize_session=False)
+    )
+    D = models.DoctorDaySchedule
+    booked, _, _ = _day_columns(schedule.start_time)
+    db.execute(
+        update(D)
+        .where(D.doctor_id == schedule.doctor_id, D.date == schedule.date, booked > 0)
+        .values({booked: booked - 1})
+        .execution_options(synchronize_session=False)
+    )
+
+
+def check_daily_cap(db: Session, patient_id: int, day: date, cap: int):
+    """患者当天的有效预约数达到上限时抛 BookingError；cap 为 0 表示不限（同一患者跨医生并发挂号时为软上限）"""
+    if not cap:
+        return
+    A, S = models.Appointment, models.DoctorSchedule
+    active = db.scalar(
+        select(func.count(A.id))
+        .join(S, S.id == A.schedule_id)
+        .where(A.patient_id == patient_id, A.status != models.AppointmentStatus.cancelled, S.date == day)
+    )
+    if active >= cap:
+        raise BookingError(f"每位患者每天最多预约 {cap} 个号", DAILY_CAP)
+
+
+def place(
+    db: Session,
+    patient_id: int,
+    doctor_id: int,
+    schedule_id: int,
+    status: models.AppointmentStatus = models.AppointmentStatus.scheduled,
+    daily_cap: int = 0,
+) -> Tuple[models.Appointment, bool]:
+    """
+    在当前事务里查重、检查每日上限、占号并插入预约（只 flush 不提交），返回 (预约, 是否新建)
+    单笔挂号 book() 与批量受理（services.admission，每笔一个 SAVEPOINT）共用
+    """
+    exists = find_active(db, patient_id, schedule_id)
+    if exists:
+        return exists, False
+
+    schedule = db.execute(
+        select(models.DoctorSchedule.date, models.DoctorSchedule.start_time)
+        .where(models.DoctorSchedule.id == schedule_id)
+    ).first()
+    if schedule is None:
+        raise BookingError("排班不存在", NOT_FOUND)
+
+    check_daily_cap(db, patient_id, schedule.date, daily_cap)
+    reserve_slot(db, schedule_id, doctor_id, schedule.date, schedule.start_time)
+    appt = models.Appointment(patient_id=patient_id, doctor_id=doctor_id, schedule_id=schedule_id, status=status)
+    db.add(appt)
+    db.flush()
+    return appt, True
+
+
+def book(
+    db: Session,
+    patient_id: int,
+    doctor_id: int,
+    schedule_id: int,
+    status: models.AppointmentStatus = models.AppointmentStatus.scheduled,
+    daily_cap: int = 0,
+) -> Tuple[models.Appointment, bool]:
+    """
+    占号并创建预约，返回 (预约, 是否新建)；已有未取消预约时幂等返回原预约
+    调用方负责校验医生/排班归属与可预约日期
+    """
+    try:
+        appt, created = place(db, patient_id, doctor_id, schedule_id, status, daily_cap)
+        if not created:
+            return appt, False
+        db.commit()
+    except BookingError:
+        db.rollback()
+        inventory.refresh(db, [schedule_id])
+        raise
+    except IntegrityError:
+        # 并发的重复提交撞上唯一部分索引：本事务的占号一并回滚，返回先提交的那条
+        db.rollback()
+        exists = find_active(db, patient_id, schedule_id)
+        if exists is None:
+            raise
+        return exists, False
+    db.refresh(appt)
+    inventory.refresh(db, [schedule_id])
+    return appt, True
+
+
+def cancel(db: Session, appointment_id: int) -> bool:
+    """取消预约并退号，空出的号在同一事务里给候补队首；返回本次是否真正发生了取消（已取消的重复请求返回 False）"""
+    # waitlist 依赖本模块的 place，这里延迟导入
+    from backend.services import waitlist
+
+    A = models.Appointment
+    changed = db.execute(
+        update(A)
+        .where(A.id == appointment_id, A.status != models.AppointmentStatus.cancelled)
+        .values(status=models.AppointmentStatus.cancelled)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    schedule_id = None
+    promoted = []
+    if changed:
+        schedule_id = db.scalar(select(A.schedule_id).where(A.id == appointment_id))
+        release_slot(db, schedule_id)
+        promoted = waitlist.promote(db, schedule_id)
+    db.commit()
+    inventory.refresh(db, [schedule_id])
+    waitlist.notify(promoted)
+    return bool(changed)
+
+
+def set_status(db: Session, appointment_id: int, status: models.AppointmentStatus) -> bool:
+    """
+    医生端修改预约状态；改为取消时退号，从取消恢复为有效状态时重新占号（满员则 BookingError）
+    返回状态是否发生变化
+    """
+    if status == models.AppointmentStatus.cancelled:
+        return cancel(db, appointment_id)
+
+    A = models.Appointment
+    try:
+        restored = db.execute(
+            update(A)
+            .where(A.id == appointment_id, A.status == models.AppointmentStatus.cancelled)
+            .values(status=status)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if restored:
+            appt = db.execute(
+                select(A.doctor_id, A.schedule_id, models.DoctorSchedule.date, models.DoctorSchedule.start_time)
+                .join(models.DoctorSchedule, models.DoctorSchedule.id == A.schedule_id)
+                .where(A.id == appointment_id)
+            ).one()
+            reserve_slot(db, appt.schedule_id, appt.doctor_id, appt.date, appt.start_time)
+            db.commit()
+            inventory.refresh(db, [appt.schedule_id])
+            return True
+        changed = db.execute(
+            update(A)
+            .where(A.id == appointment_id, A.status != status)
+            .values(status=status)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        return bool(changed)
+    except BookingError:
+        db.rollback()
+        raise
+    except IntegrityError:
+        db.rollback()
+        raise BookingError("患者在该排班已有有效预约，无法恢复", DUPLICATE)
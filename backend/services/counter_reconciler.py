@@ -0,0 +1,198 @@
+"""
+排班计数对账
+- doctor_schedules.booked_count/held_count 与 doctor_day_schedules.am/pm_booked_count 由挂号、退号、暂占等路径增量维护，
+  绕过这些路径的写入（删除用户时整批删预约、手工改库、其它进程的旧代码）会让计数漂移
+- 增量：预约/暂占号的增删改由触发器把涉及的 (医生, 日期) 记到 schedule_counter_changes（见迁移 7），
+  每次只重算出现过的 (医生, 日期)，没有变化的日期不碰
+- 每个 (医生, 日期) 一条分组查询：当天各排班的计数现值，与按有效预约（非取消）、有效暂占号重算的实际值；
+  日聚合按上午/下午把实际值（预约 + 暂占）相加
+- 修复用比较后写入（WHERE 计数仍等于读到的值）：对账期间有并发挂号时该行跳过，
+  挂号本身又会写入新的变更记录，下一轮再对；只删除本轮开始前的变更记录
+- 分片计数的排班（services.striped_counters）按各分片之和核对，修复时按实际值重排分片
+- mark_all 把一段日期内的全部 (医生, 日期) 记为待对账，用于首次上线或怀疑有触发器之外的漂移时做全量核对
+"""
+import asyncio
+import logging
+import os
+from datetime import date
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.services import booking, striped_counters
+from backend.services.slot_inventory import inventory
+
+logger = logging.getLogger("medical-system.counters")
+
+RECONCILE_INTERVAL_SECONDS = float(os.getenv("COUNTER_RECONCILE_INTERVAL", "60"))
+# 每轮最多处理的 (医生, 日期) 数
+RECONCILE_BATCH = int(os.getenv("COUNTER_RECONCILE_BATCH", "500"))
+
+
+def pending(db: Session) -> int:
+    """待对账的 (医生, 日期) 数"""
+    C = models.ScheduleCounterChange
+    return db.scalar(select(func.count()).select_from(
+        select(C.doctor_id, C.date).group_by(C.doctor_id, C.date).subquery()
+    ))
+
+
+def mark_all(db: Session, start: Optional[date] = None, end: Optional[date] = None) -> int:
+    """把 [start, end] 内有排班的全部 (医生, 日期) 记为待对账并提交"""
+    S, C = models.DoctorSchedule, models.ScheduleCounterChange
+    rows = select(S.doctor_id, S.date).distinct()
+    if start is not None:
+        rows = rows.where(S.date >= start)
+    if end is not None:
+        rows = rows.where(S.date <= end)
+    marked = db.execute(insert(C).from_select(["doctor_id", "date"], rows)).rowcount
+    db.commit()
+    return marked
+
+
+def _recount(db: Session, doctor_id: int, day: date):
+    S, A, H = models.DoctorSchedule, models.Appointment, models.SlotHold
+    held = (
+        select(func.count(H.id))
+        .where(H.schedule_id == S.id, H.status == models.HoldStatus.held)
+        .scalar_subquery()
+    )
+    return db.execute(
+        select(S.id, S.start_time, S.stripes,
+               striped_counters.booked_expr().label("booked_count"), striped_counters.held_expr().label("held_count"),
+               func.count(A.id).label("actual_booked"), held.label("actual_held"))
+        .outerjoin(A, and_(A.schedule_id == S.id, A.status != models.AppointmentStatus.cancelled))
+        .where(S.doctor_id == doctor_id, S.date == day)
+        .group_by(S.id, S.start_time, S.stripes, S.booked_count, S.held_count)
+    ).all()
+
+
+def _check_day(db: Session, doctor_id: int, day: date, repair: bool, report: Dict) -> List[int]:
+    """核对一个 (医生, 日期)，返回修复过计数的排班 id"""
+    S, D = models.DoctorSchedule, models.DoctorDaySchedule
+    repaired = []
+    am = pm = 0
+    for row in _recount(db, doctor_id, day):
+        taken = row.actual_booked + row.actual_held
+        if booking.is_morning(row.start_time):
+            am += taken
+        else:
+            pm += taken
+        if (row.booked_count, row.held_count) == (row.actual_booked, row.actual_held):
+            continue
+        report["schedules"].append({
+            "schedule_id": row.id, "doctor_id": doctor_id, "date": day.isoformat(),
+            "booked_count": [row.booked_count, row.actual_booked],
+            "held_count": [row.held_count, row.actual_held],
+        })
+        if not repair:
+            continue
+        if row.stripes:
+            striped_counters.resync(db, row.id)
+            report["repaired"] += 1
+            repaired.append(row.id)
+            continue
+        fixed = db.execute(
+            update(S)
+            .where(S.id == row.id, S.booked_count == row.booked_count, S.held_count == row.held_count)
+            .values(booked_count=row.actual_booked, held_count=row.actual_held)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if fixed:
+            report["repaired"] += 1
+            repaired.append(row.id)
+        else:
+            report["skipped"] += 1
+
+    current = db.execute(select(D.id, D.am_booked_count, D.pm_booked_count)
+                         .where(D.doctor_id == doctor_id, D.date == day)).first()
+    was = (current.am_booked_count, current.pm_booked_count) if current else (0, 0)
+    if was == (am, pm):
+        return repaired
+    report["days"].append({
+        "doctor_id": doctor_id, "date": day.isoformat(),
+        "am_booked_count": [was[0], am], "pm_booked_count": [was[1], pm],
+    })
+    if not repair:
+        return repaired
+    if current is None:
+        # 日聚合行缺失：与挂号时一样按不限容量补建
+        db.add(D(doctor_id=doctor_id, date=day, am_booked_count=am, pm_booked_count=pm))
+        fixed = 1
+    else:
+        fixed = db.execute(
+            update(D)
+            .where(D.id == current.id, D.am_booked_count == was[0], D.pm_booked_count == was[1])
+            .values(am_booked_count=am, pm_booked_count=pm)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    if fixed:
+        report["repaired"] += 1
+    else:
+        report["skipped"] += 1
+    return repaired
+
+
+def reconcile(db: Session, repair: bool = True, limit: int = RECONCILE_BATCH) -> Dict:
+    """
+    对账一轮：取最多 limit 个待对账的 (医生, 日期) 逐个核对，repair=True 时修复并删除已处理的变更记录
+    （每个 (医生, 日期) 一个短事务）；repair=False 只报告漂移，不改任何数据
+    """
+    C = models.ScheduleCounterChange
+    report = {"checked": 0, "repaired": 0, "skipped": 0, "schedules": [], "days": []}
+    upto = db.scalar(select(func.max(C.id)))
+    if upto is None:
+        db.rollback()
+        report["pending"] = 0
+        return report
+    keys = db.execute(
+        select(C.doctor_id, C.date).where(C.id <= upto).group_by(C.doctor_id, C.date).limit(limit)
+    ).all()
+    touched = []
+    for doctor_id, day in keys:
+        touched += _check_day(db, doctor_id, day, repair, report)
+        report["checked"] += 1
+        if repair:
+            db.execute(delete(C).where(C.doctor_id == doctor_id, C.date == day, C.id <= upto))
+            db.commit()
+    db.rollback()
+    inventory.refresh(db, touched)
+    report["pending"] = pending(db)
+    db.rollback()
+    return report
+
+
+def reconcile_all(db: Session, limit: int = RECONCILE_BATCH) -> Dict:
+    """修复模式下一直对账到没有本轮开始前的待对账记录，合并各轮报告"""
+    total = {"checked": 0, "repaired": 0, "skipped": 0, "schedules": [], "days": []}
+    while True:
+        report = reconcile(db, True, limit)
+        for key in ("checked", "repaired", "skipped"):
+            total[key] += report[key]
+        total["schedules"] += report["schedules"]
+        total["days"] += report["days"]
+        total["pending"] = report["pending"]
+        if report["checked"] < limit:
+            return total
+
+
+def run_once() -> Dict:
+    from backend.database import SessionLocal
+    with SessionLocal() as db:
+        report = reconcile_all(db)
+    if report["schedules"] or report["days"]:
+        logger.warning("计数漂移：排班 %d 个、日聚合 %d 个，已修复 %d，跳过 %d",
+                       len(report["schedules"]), len(report["days"]), report["repaired"], report["skipped"])
+    return report
+
+
+async def run_periodically(interval: float = RECONCILE_INTERVAL_SECONDS):
+    """后台任务：每 interval 秒对账一次有变化的 (医生, 日期)"""
+    while True:
+        try:
+            await asyncio.to_thread(run_once)
+        except Exception:
+            logger.exception("counter reconciliation failed")
+        await asyncio.sleep(interval)
@@ -0,0 +1,89 @@
+"""
+医生端预约查询
+- 医生端两个预约列表（/appointments/doctor/{id} 与 /doctor/appointments/my_detailed）共用这里的一条联查：
+  排班 + 预约 + 患者账号 + 患者档案，只取页面用到的列，返回形状由路由各自组装
+- 必须限定日期窗口：未指定时默认前 DEFAULT_PAST_DAYS 天到后 DEFAULT_FUTURE_DAYS 天，跨度不超过 MAX_WINDOW_DAYS；
+  可按状态过滤，按 (日期, 开始时间, 预约 id) 正序游标分页
+- 版本戳：同一 (医生, 窗口, 状态) 内预约的条数、id 之和、revision 之和。挂号、取消、改状态、删除都会改变它；
+  只聚合排班与预约两张表，不联患者表、不序列化，轮询时先比对版本戳，没变化由路由返回 304
+- 患者改名不会改变版本戳，客户端最多在下一次预约变化时看到新名字
+"""
+import os
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.core.pagination import Keyset, PageParams
+
+DEFAULT_PAST_DAYS = int(os.getenv("DOCTOR_APPOINTMENTS_PAST_DAYS", "30"))
+DEFAULT_FUTURE_DAYS = int(os.getenv("DOCTOR_APPOINTMENTS_FUTURE_DAYS", "8"))
+MAX_WINDOW_DAYS = int(os.getenv("DOCTOR_APPOINTMENTS_MAX_WINDOW", "93"))
+
+A, S = models.Appointment, models.DoctorSchedule
+
+KEYSET = Keyset(S.date, S.start_time, A.id, desc=False)
+
+
+class WindowError(Exception):
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def window(date_from: Optional[date], date_to: Optional[date]) -> Tuple[date, date]:
+    """补全并校验 [date_from, date_to) 窗口；缺一端时按默认跨度从另一端推算"""
+    today = datetime.today().date()
+    if date_from is None and date_to is None:
+        return today - timedelta(days=DEFAULT_PAST_DAYS), today + timedelta(days=DEFAULT_FUTURE_DAYS)
+    if date_from is None:
+        date_from = date_to - timedelta(days=DEFAULT_PAST_DAYS + DEFAULT_FUTURE_DAYS)
+    if date_to is None:
+        date_to = date_from + timedelta(days=DEFAULT_PAST_DAYS + DEFAULT_FUTURE_DAYS)
+    if date_to <= date_from:
+        raise WindowError("date_to 须晚于 date_from")
+    if (date_to - date_from).days > MAX_WINDOW_DAYS:
+        raise WindowError(f"日期窗口最长 {MAX_WINDOW_DAYS} 天")
+    return date_from, date_to
+
+
+def _scope(doctor_id: int, start: date, end: date, status: Optional[models.AppointmentStatus]) -> list:
+    # 排班上的 doctor_id 与预约上的一致，按排班 (医生, 日期) 取范围再按排班 id 联到预约
+    conditions = [S.doctor_id == doctor_id, S.date >= start, S.date < end, A.doctor_id == doctor_id]
+    if status is not None:
+        conditions.append(A.status == status)
+    return conditions
+
+
+def version(db: Session, doctor_id: int, start: date, end: date,
+            status: Optional[models.AppointmentStatus] = None) -> str:
+    """窗口内预约的版本戳"""
+    row = db.execute(
+        select(func.count(A.id), func.coalesce(func.sum(A.id), 0), func.coalesce(func.sum(A.revision), 0))
+        .select_from(S).join(A, A.schedule_id == S.id)
+        .where(*_scope(doctor_id, start, end, status))
+    ).one()
+    return "-".join(str(v) for v in row)
+
+
+def fetch(db: Session, doctor_id: int, start: date, end: date,
+          status: Optional[models.AppointmentStatus], page: PageParams) -> List:
+    """一页预约行：id、status、created_at、date、start_time、end_time、patient_id、patient_phone、patient_name"""
+    U, P = models.User, models.PatientProfile
+    q = (
+        select(A.id, A.status, A.created_at, S.date, S.start_time, S.end_time,
+               U.id.label("patient_id"), U.phone.label("patient_phone"), P.name.label("patient_name"))
+        .select_from(S)
+        .join(A, A.schedule_id == S.id)
+        .join(U, A.patient_id == U.id)
+        .outerjoin(P, P.user_id == U.id)
+        .where(and_(*_scope(doctor_id, start, end, status)))
+    )
+    return db.execute(KEYSET.apply(q, page)).all()
+
+
+def display_name(row) -> str:
+    """患者档案姓名，未填写时用手机号"""
+    return (row.patient_name or "").strip() or row.patient_phone
@@ -0,0 +1,225 @@
+"""
+医生名录
+- 患者端可约医生列表、/api/doctor 医生列表、管理端已审核医生列表共用同一条查询：
+  users LEFT JOIN doctor_profiles LEFT JOIN (未来 7 天有余号的排班按医生分组计数)，一次取出全部医生
+- 结果在进程内缓存 DOCTOR_DIRECTORY_TTL 秒；医生账号或医生资料经 ORM 提交变更（注册、审核、停用、删除、改资料）时
+  由 Session 事件立即失效，不依赖各接口逐个调用
+- 科室/职称过滤在缓存上完成；余号数在号源库存缓存新鲜时取实时值，否则用查询里的分组计数
+- 异步路由缓存失效时放到线程里用同步会话重载（与号源库存的 ensure_loaded_async 相同）：
+  不能在 AsyncSession.run_sync 里持有线程锁做 IO，run_sync 跑在事件循环线程上，两个并发冷启动请求会互相卡死整个事件循环
+"""
+import asyncio
+import os
+import threading
+import time as _time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.services import striped_counters
+from backend.services.slot_inventory import inventory
+
+TTL_SECONDS = float(os.getenv("DOCTOR_DIRECTORY_TTL", "10"))
+
+
+@dataclass(frozen=True)
+class DoctorEntry:
+    id: int
+    phone: str
+    status: models.UserStatus
+    has_profile: bool
+    name: Optional[str]
+    department: Optional[str]
+    title: Optional[str]
+    license_number: Optional[str]
+    hospital: Optional[str]
+    available_schedules: int
+
+    @property
+    def is_active(self) -> bool:
+        return self.status == models.UserStatus.active
+
+
+def directory_select():
+    U, P, S = models.User, models.DoctorProfile, models.DoctorSchedule
+    today = datetime.today().date()
+    availability = (
+        select(S.doctor_id, func.count(S.id).label("available"))
+        .where(
+            S.status == models.ScheduleStatus.open,
+            S.date >= today,
+            S.date <= today + timedelta(days=inventory.window_days),
+            S.capacity > striped_counters.booked_expr() + striped_counters.held_expr(),
+        )
+        .group_by(S.doctor_id)
+        .subquery("availability")
+    )
+    return (
+        select(
+            U.id, U.phone, U.status,
+            P.id.label("profile_id"), P.name, P.department, P.title, P.license_number, P.hospital,
+            func.coalesce(availability.c.available, 0).label("available_schedules"),
+        )
+        .outerjoin(P, P.user_id == U.id)
+        .outerjoin(availability, availability.c.doctor_id == U.id)
+        .where(U.role == models.UserRole.doctor)
+        .order_by(U.id)
+    )
+
+
+class DoctorDirectory:
+    def __init__(self, session_factory: Optional[Callable[[], Session]] = None, ttl: float = TTL_SECONDS):
+        self._session_factory = session_factory
+        self.ttl = ttl
+        self._entries: Optional[List[DoctorEntry]] = None
+        self._loaded_at = 0.0
+        # 每次失效加一；加载期间发生失效则本次结果不入缓存
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def configure(self, session_factory: Callable[[], Session]):
+        """指定异步路由重载使用的会话工厂（测试/脚本使用独立数据库时调用）"""
+        self._session_factory = session_factory
+        self.invalidate()
+
+    def invalidate(self):
+        self._generation += 1
+        self._entries = None
+
+    def _cached(self) -> Optional[List[DoctorEntry]]:
+        entries = self._entries
+        if entries is not None and _time.monotonic() - self._loaded_at < self.ttl:
+            return entries
+        return None
+
+    def entries(self, db: Session) -> List[DoctorEntry]:
+        cached = self._cached()
+        if cached is not None:
+            return cached
+        with self._lock:
+            cached = self._cached()
+            if cached is not None:
+                return cached
+            generation = self._generation
+            entries = [
+                DoctorEntry(
+                    id=r.id, phone=r.phone, status=r.status, has_profile=r.profile_id is not None,
+                    name=r.name, department=r.department, title=r.title,
+                    license_number=r.license_number, hospital=r.hospital,
+                    available_schedules=r.available_schedules,
+                )
+                for r in db.execute(directory_select())
+            ]
+            if generation == self._generation:
+                self._entries, self._loaded_at = entries, _time.monotonic()
+            return entries
+
+    def _load(self) -> List[DoctorEntry]:
+        factory = self._session_factory
+        if factory is None:
+            from backend.database import SessionLocal as factory
+        with factory() as db:
+            return self.entries(db)
+
+    async def entries_async(self) -> List[DoctorEntry]:
+        """异步路由使用：需要重载时放到线程里用独立的同步会话执行，不阻塞事件循环"""
+        cached = self._cached()
+        if cached is not None:
+            return cached
+        return await asyncio.to_thread(self._load)
+
+
+directory = DoctorDirectory()
+
+
+def _filter(entries: List[DoctorEntry], department: Optional[str], title: Optional[str], active_only: bool):
+    return [
+        e for e in entries
+        if (not active_only or e.is_active)
+        and (not department or e.department == department)
+        and (not title or e.title == title)
+    ]
+
+
+# ---------- 三种视图 ----------
+
+def public_view(entries: List[DoctorEntry], department: Optional[str] = None, title: Optional[str] = None) -> List[dict]:
+    """患者端可约医生：仅已激活医生，附未来 7 天余号排班数"""
+    live = inventory.available_counts() if inventory.is_fresh() else None
+    result = []
+    for e in _filter(entries, department, title, active_only=True):
+        available = live.get(e.id, 0) if live is not None else e.available_schedules
+        result.append({
+            "id": e.id,
+            "name": e.name,
+            "department": e.department,
+            "title": e.title,
+            "phone": e.phone,
+            "available_schedules": available,
+            "fully_booked": available == 0,
+        })
+    return result
+
+
+def doctor_list_view(entries: List[DoctorEntry], department: Optional[str] = None, title: Optional[str] = None) -> List[dict]:
+    """/api/doctor 医生列表：含待审核医生"""
+    return [
+        {
+            "id": e.id,
+            "name": e.name,
+            "department": e.department,
+            "title": e.title,
+            "license_number": e.license_number,
+            "hospital": e.hospital,
+            "is_approved": e.is_active,
+            "user_id": e.id,
+        }
+        for e in _filter(entries, department, title, active_only=False)
+    ]
+
+
+def admin_view(entries: List[DoctorEntry], department: Optional[str] = None, title: Optional[str] = None) -> List[dict]:
+    """管理端已审核医生：未建资料的医生显示占位"""
+    return [
+        {
+            "id": e.id,
+            "phone": e.phone,
+            "name": e.name if e.has_profile else "未完善信息",
+            "department": e.department if e.has_profile else "",
+            "title": e.title if e.has_profile else "",
+        }
+        for e in _filter(entries, department, title, active_only=True)
+    ]
+
+
+# ---------- 失效 ----------
+
+def _touches_directory(obj) -> bool:
+    if isinstance(obj, models.DoctorProfile):
+        return True
+    return isinstance(obj, models.User) and obj.role in (models.UserRole.doctor, models.UserRole.doctor.value)
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_dirty(session, flush_context):
+    if session.info.get("doctor_directory_dirty"):
+        return
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if _touches_directory(obj):
+            session.info["doctor_directory_dirty"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop("doctor_directory_dirty", False):
+        directory.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("doctor_directory_dirty", None)
@@ -0,0 +1,176 @@
+"""
+处方读模型投影
+- 医生处方列表、药房处方列表、患者我的处方、患者订单共用同一条查询
+- 一条 Core select：处方 LEFT JOIN 明细/药品/病历/患者与医生账号及资料，按处方分组成紧凑的 DTO
+- 同步 Session 与 AsyncSession 都可直接执行 prescription_select() 得到的语句
+- 分页时先在子查询里按 (created_at, id) 取出本页处方 id，再与明细等表联查，页大小按处方而不是明细计
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+
+from backend import models, schemas
+from backend.core.pagination import Keyset, PageParams
+
+
+@dataclass
+class PrescriptionItemView:
+    id: int
+    prescription_id: int
+    medication_id: int
+    quantity: int
+    price_at_time: int
+    usage_instruction: Optional[str]
+    # 药品已被删除时以下均为 None
+    medication_name: Optional[str]
+    specification: Optional[str]
+    unit: Optional[str]
+    manufacturer: Optional[str]
+
+
+@dataclass
+class PrescriptionView:
+    id: int
+    medical_record_id: int
+    doctor_id: int
+    patient_id: int
+    status: models.PrescriptionStatus
+    total_price: int
+    notes: Optional[str]
+    created_at: datetime
+    updated_at: Optional[datetime]
+    record_diagnosis: Optional[str]
+    patient_user_phone: Optional[str]
+    patient_profile_name: Optional[str]
+    doctor_user_phone: Optional[str]
+    doctor_profile_name: Optional[str]
+    items: List[PrescriptionItemView] = field(default_factory=list)
+
+
+_Patient = aliased(models.User, name="patient")
+_Doctor = aliased(models.User, name="doctor")
+_PatientProfile = aliased(models.PatientProfile, name="patient_profile")
+_DoctorProfile = aliased(models.DoctorProfile, name="doctor_profile")
+
+PRESCRIPTION_KEYSET = Keyset(models.Prescription.created_at, models.Prescription.id)
+
+
+def prescription_select(
+    doctor_id: Optional[int] = None,
+    patient_id: Optional[int] = None,
+    status: Optional[str] = None,
+    prescription_id: Optional[int] = None,
+    page: Optional[PageParams] = None,
+):
+    """构造投影查询；每行是一条明细（无明细的处方也有一行），按处方创建时间倒序"""
+    P = models.Prescription
+    I = models.PrescriptionItem
+    M = models.Medication
+    R = models.MedicalRecord
+    conditions = []
+    if doctor_id is not None:
+        conditions.append(P.doctor_id == doctor_id)
+    if patient_id is not None:
+        conditions.append(P.patient_id == patient_id)
+    if status:
+        conditions.append(P.status == status)
+    if prescription_id is not None:
+        conditions.append(P.id == prescription_id)
+
+    stmt = (
+        select(
+            P.id, P.medical_record_id, P.doctor_id, P.patient_id, P.status, P.total_price,
+            P.notes, P.created_at, P.updated_at,
+            R.diagnosis.label("record_diagnosis"),
+            _Patient.phone.label("patient_user_phone"),
+            _PatientProfile.name.label("patient_profile_name"),
+            _Doctor.phone.label("doctor_user_phone"),
+            _DoctorProfile.name.label("doctor_profile_name"),
+            I.id.label("item_id"), I.medication_id, I.quantity, I.price_at_time, I.usage_instruction,
+            M.name.label("medication_name"), M.specification, M.unit, M.manufacturer,
+        )
+        .select_from(_page_source(conditions, page))
+        .outerjoin(R, R.id == P.medical_record_id)
+        .outerjoin(_Patient, _Patient.id == P.patient_id)
+        .outerjoin(_PatientProfile, _PatientProfile.user_id == P.patient_id)
+        .outerjoin(_Doctor, _Doctor.id == P.doctor_id)
+        .outerjoin(_DoctorProfile, _DoctorProfile.user_id == P.doctor_id)
+        .outerjoin(I, I.prescription_id == P.id)
+        .outerjoin(M, M.id == I.medication_id)
+    )
+    if page is None:
+        stmt = stmt.where(*conditions)
+    return stmt.order_by(P.created_at.desc(), P.id.desc(), I.id)
+
+
+def _page_source(conditions: list, page: Optional[PageParams]):
+    """不分页时直接查处方表；分页时用本页处方 id 的派生表驱动联查（MySQL 不支持 IN 子查询里带 LIMIT）"""
+    P = models.Prescription
+    if page is None:
+        return P
+    page_ids = PRESCRIPTION_KEYSET.apply(select(P.id).where(*conditions), page).subquery("page")
+    return page_ids.join(P, P.id == page_ids.c.id)
+
+
+def build_views(rows: Iterable) -> List[PrescriptionView]:
+    """把投影查询的扁平行按处方折叠成 DTO，保持查询顺序"""
+    views = {}
+    for row in rows:
+        view = views.get(row.id)
+        if view is None:
+            view = views[row.id] = PrescriptionView(
+                id=row.id,
+                medical_record_id=row.medical_record_id,
+                doctor_id=row.doctor_id,
+                patient_id=row.patient_id,
+                status=row.status,
+                total_price=row.total_price,
+                notes=row.notes,
+                created_at=row.created_at,
+                updated_at=row.updated_at,
+                record_diagnosis=row.record_diagnosis,
+                patient_user_phone=row.patient_user_phone,
+                patient_profile_name=row.patient_profile_name,
+                doctor_user_phone=row.doctor_user_phone,
+                doctor_profile_name=row.doctor_profile_name,
+            )
+        if row.item_id is not None:
+            view.items.append(PrescriptionItemView(
+                id=row.item_id,
+                prescription_id=row.id,
+                medication_id=row.medication_id,
+                quantity=row.quantity,
+                price_at_time=row.price_at_time,
+                usage_instruction=row.usage_instruction,
+                medication_name=row.medication_name,
+                specification=row.specification,
+                unit=row.unit,
+                manufacturer=row.manufacturer,
+            ))
+    return list(views.values())
+
+
+def fetch_prescriptions(db: Session, **filters) -> List[PrescriptionView]:
+    return build_views(db.execute(prescription_select(**filters)))
+
+
+async def fetch_prescriptions_async(db: AsyncSession, **filters) -> List[PrescriptionView]:
+    return build_views(await db.execute(prescription_select(**filters)))
+
+
+def get_prescription_view(db: Session, prescription_id: int) -> Optional[PrescriptionView]:
+    views = fetch_prescriptions(db, prescription_id=prescription_id)
+    return views[0] if views else None
+
+
+def to_response(view: PrescriptionView) -> schemas.PrescriptionResponse:
+    """转为 PrescriptionResponse（明细带药品名称/规格/单位，药品缺失时显示“未知药品”）"""
+    p_resp = schemas.PrescriptionResponse.from_orm(view)
+    for item in p_resp.items:
+        if item.medication_name is None:
+            item.medication_name = "未知药品"
+    return p_resp
@@ -0,0 +1,162 @@
+"""
+按周模板滚动生成排班
+- 医生维护周模板（每周几上午/下午的号源数），后台任务定期把未来 SCHEDULE_MATERIALIZE_DAYS 天的排班与日聚合行补齐
+- 全部医生一条 INSERT … SELECT：模板 JOIN 日期序列（窗口内每天一行），按上午/下午展开，
+  NOT EXISTS 跳过该医生当天同一时段已有的排班（包括手工建的、开始时间不同的旧排班），不存在逐行查询
+- SQLite 用 INSERT OR IGNORE、MySQL 用 INSERT IGNORE，配合迁移 4 的唯一索引，多进程同时生成也不会重复
+- 日聚合行可能先于生成存在（挂号时按不限容量补建的空行）：生成排班前，对即将生成的时段（当天该时段还没有排班）
+  把容量为 0/NULL 的日聚合容量补成模板值，否则时段限额会被当成不限
+- 只为已激活医生生成；已生成的排班不随模板修改而变化（已有预约），调整已生成排班仍走 /doctor/schedules
+"""
+import asyncio
+import logging
+import os
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import Date, Integer, and_, exists, insert, literal, or_, select, union_all, update
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.services.slot_inventory import inventory
+
+logger = logging.getLogger("medical-system.schedules")
+
+MATERIALIZE_DAYS = int(os.getenv("SCHEDULE_MATERIALIZE_DAYS", "14"))
+MATERIALIZE_INTERVAL_SECONDS = float(os.getenv("SCHEDULE_MATERIALIZE_INTERVAL", "3600"))
+
+# 与 create_schedule 的规范时段一致
+AM_SLOT = (time(9, 0), time(12, 0))
+PM_SLOT = (time(13, 0), time(17, 0))
+NOON = time(12, 0)
+
+
+def _days(start: date, days: int):
+    """窗口内每天一行 (day, weekday) 的派生表"""
+    return union_all(*[
+        select(literal(d, Date).label("day"), literal(d.weekday(), Integer).label("weekday"))
+        for d in (start + timedelta(days=i) for i in range(days))
+    ]).subquery("days")
+
+
+def _doctor_filter(T, doctor_ids: Optional[Iterable[int]]):
+    U = models.User
+    conditions = [
+        U.id == T.doctor_id,
+        U.role == models.UserRole.doctor,
+        U.status == models.UserStatus.active,
+    ]
+    if doctor_ids is not None:
+        conditions.append(T.doctor_id.in_(list(doctor_ids)))
+    return conditions
+
+
+def _insert_ignore(table):
+    return insert(table).prefix_with("OR IGNORE", dialect="sqlite").prefix_with("IGNORE", dialect="mysql")
+
+
+def schedule_insert(start: date, days: int, doctor_ids: Optional[Iterable[int]] = None):
+    """模板 × 日期 → doctor_schedules，上午与下午两段 UNION ALL 成一条 INSERT … SELECT"""
+    T, S, U = models.DoctorScheduleTemplate, models.DoctorSchedule, models.User
+    day = _days(start, days)
+    halves = []
+    for capacity, (start_time, end_time), in_half in (
+        (T.am_capacity, AM_SLOT, S.start_time < NOON),
+        (T.pm_capacity, PM_SLOT, S.start_time >= NOON),
+    ):
+        taken = exists().where(S.doctor_id == T.doctor_id, S.date == day.c.day, in_half)
+        halves.append(
+            select(
+                T.doctor_id, day.c.day,
+                literal(start_time, S.start_time.type), literal(end_time, S.end_time.type),
+                capacity, literal(0, Integer), literal(0, Integer), literal(0, Integer),
+                literal(models.ScheduleStatus.open, S.status.type),
+            )
+            .join(day, day.c.weekday == T.weekday)
+            .join(U, and_(*_doctor_filter(T, doctor_ids)))
+            .where(capacity > 0, ~taken)
+        )
+    return _insert_ignore(S).from_select(
+        ["doctor_id", "date", "start_time", "end_time", "capacity", "booked_count", "held_count", "stripes", "status"],
+        union_all(*halves),
+    )
+
+
+def day_insert(start: date, days: int, doctor_ids: Optional[Iterable[int]] = None):
+    """模板 × 日期 → doctor_day_schedules（上午/下午容量取模板值），已有日聚合行跳过"""
+    T, D, U = models.DoctorScheduleTemplate, models.DoctorDaySchedule, models.User
+    day = _days(start, days)
+    taken = exists().where(D.doctor_id == T.doctor_id, D.date == day.c.day)
+    rows = (
+        select(T.doctor_id, day.c.day, T.am_capacity, literal(0, Integer), T.pm_capacity, literal(0, Integer))
+        .join(day, day.c.weekday == T.weekday)
+        .join(U, and_(*_doctor_filter(T, doctor_ids)))
+        .where((T.am_capacity > 0) | (T.pm_capacity > 0), ~taken)
+    )
+    return _insert_ignore(D).from_select(
+        ["doctor_id", "date", "am_capacity", "am_booked_count", "pm_capacity", "pm_booked_count"], rows,
+    )
+
+
+def day_capacity_update(start: date, days: int, morning: bool, doctor_ids: Optional[Iterable[int]] = None):
+    """已有日聚合行里即将生成的时段（当天该时段还没有排班）容量为 0/NULL 时补成模板值"""
+    T, D, S, U = models.DoctorScheduleTemplate, models.DoctorDaySchedule, models.DoctorSchedule, models.User
+    day = _days(start, days)
+    column, template = (D.am_capacity, T.am_capacity) if morning else (D.pm_capacity, T.pm_capacity)
+    capacity = (
+        select(template)
+        .join(day, day.c.weekday == T.weekday)
+        .join(U, and_(*_doctor_filter(T, doctor_ids)))
+        .where(T.doctor_id == D.doctor_id, day.c.day == D.date)
+        .scalar_subquery()
+    )
+    in_half = S.start_time < NOON if morning else S.start_time >= NOON
+    taken = exists().where(S.doctor_id == D.doctor_id, S.date == D.date, in_half)
+    conditions = [D.date >= start, D.date < start + timedelta(days=days),
+                  or_(column.is_(None), column == 0), capacity > 0, ~taken]
+    if doctor_ids is not None:
+        conditions.append(D.doctor_id.in_(list(doctor_ids)))
+    return update(D).where(*conditions).values({column: capacity}).execution_options(synchronize_session=False)
+
+
+def materialize(db: Session, days: int = MATERIALIZE_DAYS, start: Optional[date] = None,
+                doctor_ids: Optional[Iterable[int]] = None) -> Dict[str, int]:
+    """
+    生成 [start, start + days) 的排班与日聚合行并提交；doctor_ids 为空表示全部医生。
+    返回新插入的行数与补上容量的日聚合时段数
+    """
+    start = start or datetime.today().date()
+    if doctor_ids is not None:
+        doctor_ids = list(doctor_ids)
+        if not doctor_ids:
+            return {"schedules": 0, "day_schedules": 0, "day_capacities": 0}
+    # 先于排班插入执行：此时“该时段还没有排班”即本次要生成的时段
+    day_capacities = sum(
+        db.execute(day_capacity_update(start, days, morning, doctor_ids)).rowcount for morning in (True, False)
+    )
+    schedules = db.execute(schedule_insert(start, days, doctor_ids)).rowcount
+    day_schedules = db.execute(day_insert(start, days, doctor_ids)).rowcount
+    db.commit()
+    if schedules:
+        inventory.invalidate()
+    return {"schedules": schedules, "day_schedules": day_schedules, "day_capacities": day_capacities}
+
+
+def run_once(days: int = MATERIALIZE_DAYS) -> Dict[str, int]:
+    from backend.database import SessionLocal
+    with SessionLocal() as db:
+        result = materialize(db, days)
+    if any(result.values()):
+        logger.info("按周模板生成排班 %(schedules)d 条、日聚合 %(day_schedules)d 条、补日聚合容量 %(day_capacities)d 个时段",
+                    result)
+    return result
+
+
+async def run_periodically(interval: float = MATERIALIZE_INTERVAL_SECONDS):
+    """后台任务：启动后立即生成一次，之后每 interval 秒滚动补齐（跨天后窗口自然后移）"""
+    while True:
+        try:
+            await asyncio.to_thread(run_once)
+        except Exception:
+            logger.exception("schedule materialization failed")
+        await asyncio.sleep(interval)
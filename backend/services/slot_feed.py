@@ -0,0 +1,146 @@
+"""
+号源变化推送（Server-Sent Events）
+- 进程内发布/订阅：号源库存缓存每次写穿/移除/重载后回调 publish（见 SlotInventory.add_listener），
+  挂号、退号、改状态、新建/删除排班、按模板生成排班都会经由这里推给订阅方，患者端不必再轮询排班接口
+- 订阅按医生、科室（订阅时解析为医生集合）或日期过滤，三者可组合
+- 合并：每个订阅只保留每个排班的最新状态，收到变化后再等 SLOT_FEED_COALESCE_MS 毫秒一并发出，
+  同一排班在窗口内被连续挂号 100 次也只推一条；单次推送最多 SLOT_FEED_MAX_BATCH 条，其余留到下一条消息
+- publish 可能在工作线程里调用（成批受理、脚本），通过 call_soon_threadsafe 交给订阅所在的事件循环
+- 只覆盖本进程的写入；其它进程的修改在本进程库存缓存整表重载（SLOT_INVENTORY_MAX_AGE）时补发
+"""
+import asyncio
+import json
+import os
+import threading
+from datetime import date
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from backend.services.slot_inventory import SlotChange, SlotEntry, inventory
+
+COALESCE_SECONDS = float(os.getenv("SLOT_FEED_COALESCE_MS", "500")) / 1000
+MAX_BATCH = int(os.getenv("SLOT_FEED_MAX_BATCH", "500"))
+HEARTBEAT_SECONDS = float(os.getenv("SLOT_FEED_HEARTBEAT", "15"))
+# 断线后客户端重连等待（毫秒），随首条消息下发
+RETRY_MS = 3000
+
+
+def slot_payload(entry: SlotEntry, removed: bool = False) -> dict:
+    return {
+        "id": entry.id,
+        "doctor_id": entry.doctor_id,
+        "date": entry.date.isoformat(),
+        "start_time": entry.start_time.isoformat(),
+        "end_time": entry.end_time.isoformat(),
+        "capacity": entry.capacity,
+        "booked_count": entry.booked_count,
+        "held_count": entry.held_count,
+        "available": 0 if removed else entry.available,
+        "fully_booked": removed or entry.fully_booked,
+        "removed": removed,
+    }
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, doctor_ids: Optional[Set[int]], day: Optional[date]):
+        self.loop = loop
+        self.doctor_ids = doctor_ids
+        self.day = day
+        # schedule_id -> 最新状态；同一排班的多次变化在这里合并
+        self.pending: Dict[int, dict] = {}
+        self.ready = asyncio.Event()
+        self.sent = 0
+
+    def matches(self, entry: SlotEntry) -> bool:
+        return (self.doctor_ids is None or entry.doctor_id in self.doctor_ids) and (self.day is None or entry.date == self.day)
+
+    def _deliver(self, payloads: List[dict]):
+        for payload in payloads:
+            self.pending[payload["id"]] = payload
+        self.ready.set()
+
+    def take(self) -> List[dict]:
+        if len(self.pending) <= MAX_BATCH:
+            batch, self.pending = list(self.pending.values()), {}
+        else:
+            keys = list(self.pending)[:MAX_BATCH]
+            batch = [self.pending.pop(k) for k in keys]
+        if not self.pending:
+            self.ready.clear()
+        return batch
+
+
+class SlotFeed:
+    def __init__(self, coalesce: float = COALESCE_SECONDS, heartbeat: float = HEARTBEAT_SECONDS):
+        self.coalesce = coalesce
+        self.heartbeat = heartbeat
+        self._subscriptions: Set[Subscription] = set()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.messages = 0
+
+    def subscribe(self, doctor_ids: Optional[Set[int]] = None, day: Optional[date] = None) -> Subscription:
+        sub = Subscription(asyncio.get_running_loop(), doctor_ids, day)
+        with self._lock:
+            self._subscriptions.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscriptions.discard(sub)
+
+    def publish(self, changes: List[SlotChange]):
+        """号源库存回调：按订阅过滤后投递到各自的事件循环"""
+        self.published += len(changes)
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for sub in subscriptions:
+            payloads = [slot_payload(entry, removed) for entry, removed in changes if sub.matches(entry)]
+            if not payloads:
+                continue
+            try:
+                sub.loop.call_soon_threadsafe(sub._deliver, payloads)
+            except RuntimeError:
+                # 事件循环已关闭
+                self.unsubscribe(sub)
+
+    def snapshot(self, sub: Subscription) -> List[dict]:
+        """订阅建立时的当前号源（调用方先 ensure_loaded）"""
+        doctor_ids = sub.doctor_ids if sub.doctor_ids is not None else list(inventory.available_counts())
+        entries = [e for d in doctor_ids for e in inventory.schedules(d, sub.day)]
+        return [slot_payload(e) for e in entries]
+
+    async def stream(self, sub: Subscription, is_disconnected=None) -> AsyncIterator[str]:
+        """SSE 消息流：先发 snapshot，之后发合并后的 slots；空闲时发注释行保活并检查断线"""
+        try:
+            yield _message("snapshot", self.snapshot(sub), inventory.version, retry=RETRY_MS)
+            while True:
+                try:
+                    await asyncio.wait_for(sub.ready.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                await asyncio.sleep(self.coalesce)
+                batch = sub.take()
+                if batch:
+                    sub.sent += 1
+                    self.messages += 1
+                    yield _message("slots", batch, inventory.version)
+        finally:
+            self.unsubscribe(sub)
+
+    def stats(self) -> dict:
+        return {"subscribers": len(self._subscriptions), "published": self.published, "messages": self.messages}
+
+
+def _message(event: str, data, event_id: int, retry: Optional[int] = None) -> str:
+    lines = [f"event: {event}", f"id: {event_id}"]
+    if retry is not None:
+        lines.append(f"retry: {retry}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+    return "\n".join(lines) + "\n\n"
+
+
+feed = SlotFeed()
+inventory.add_listener(feed.publish)
@@ -0,0 +1,273 @@
+"""
+两段式挂号：暂占号
+- hold：患者确认/支付前先占住一个号，计入排班的 held_count（占号条件与挂号相同：booked_count + held_count < capacity），
+  日聚合计数一并加一；暂占号 SLOT_HOLD_TTL 秒后过期
+- confirm：在有效期内把暂占号转为预约：暂占状态条件更新为 confirmed，held_count 减一、booked_count 加一，插入预约；
+  容量在暂占时已经占住，确认不会因满员失败
+- release：患者主动放弃，退回暂占号
+- 过期清理（sweep）：按批次整批处理，不逐行加锁：先无锁读出一批过期 id，再一条条件 UPDATE 把其中仍为 held 的标记为
+  expired 并写上批次号，随后按批次号各用一条带关联子查询的 UPDATE 回补排班 held_count 与日聚合计数；
+  与 confirm/release 的竞争由 status = 'held' 条件保证只有一方生效
+- 放弃与过期空出的号在同一事务里给候补队首（services.waitlist），提交后写穿号源库存缓存
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import case, func, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.services import booking, striped_counters, waitlist
+from backend.services.schedule_materializer import NOON
+from backend.services.slot_inventory import inventory
+
+logger = logging.getLogger("medical-system.holds")
+
+HOLD_TTL_SECONDS = int(os.getenv("SLOT_HOLD_TTL", "300"))
+SWEEP_INTERVAL_SECONDS = float(os.getenv("SLOT_HOLD_SWEEP_INTERVAL", "10"))
+SWEEP_BATCH = int(os.getenv("SLOT_HOLD_SWEEP_BATCH", "500"))
+
+
+def find_held(db: Session, patient_id: int, schedule_id: int) -> Optional[models.SlotHold]:
+    H = models.SlotHold
+    return db.scalar(select(H).where(
+        H.patient_id == patient_id, H.schedule_id == schedule_id, H.status == models.HoldStatus.held,
+    ))
+
+
+def hold(db: Session, patient_id: int, doctor_id: int, schedule_id: int,
+         daily_cap: int = 0, ttl: int = HOLD_TTL_SECONDS) -> Tuple[models.SlotHold, bool]:
+    """
+    暂占一个号并提交，返回 (暂占号, 是否新建)；已有未过期的暂占号时幂等返回
+    调用方负责校验医生/排班归属与可预约日期
+    """
+    if booking.find_active(db, patient_id, schedule_id) is not None:
+        raise booking.BookingError("已有该排班的有效预约", booking.DUPLICATE)
+    exists_hold = find_held(db, patient_id, schedule_id)
+    if exists_hold is not None and exists_hold.expires_at > datetime.now():
+        return exists_hold, False
+
+    S = models.DoctorSchedule
+    schedule = db.execute(select(S.date, S.start_time).where(S.id == schedule_id)).first()
+    if schedule is None:
+        raise booking.BookingError("排班不存在", booking.NOT_FOUND)
+    try:
+        if exists_hold is not None:
+            # 已过期但还没被清理：先按过期处理，再重新暂占
+            _expire_one(db, exists_hold)
+        booking.check_daily_cap(db, patient_id, schedule.date, daily_cap)
+        booking.reserve_slot(db, schedule_id, doctor_id, schedule.date, schedule.start_time, held=True)
+        entry = models.SlotHold(patient_id=patient_id, doctor_id=doctor_id, schedule_id=schedule_id,
+                                expires_at=datetime.now() + timedelta(seconds=ttl))
+        db.add(entry)
+        db.commit()
+    except booking.BookingError:
+        db.rollback()
+        inventory.refresh(db, [schedule_id])
+        raise
+    except IntegrityError:
+        # 并发重复暂占撞上唯一部分索引：返回先提交的那条
+        db.rollback()
+        exists_hold = find_held(db, patient_id, schedule_id)
+        if exists_hold is None:
+            raise
+        return exists_hold, False
+    db.refresh(entry)
+    inventory.refresh(db, [schedule_id])
+    return entry, True
+
+
+def _expire_one(db: Session, entry: models.SlotHold):
+    H = models.SlotHold
+    changed = db.execute(
+        update(H)
+        .where(H.id == entry.id, H.status == models.HoldStatus.held)
+        .values(status=models.HoldStatus.expired, resolved_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if changed:
+        booking.release_slot(db, entry.schedule_id, held=True)
+
+
+def confirm(db: Session, hold_id: int, patient_id: int, daily_cap: int = 0) -> models.Appointment:
+    """有效期内把暂占号转为预约并提交"""
+    H, S = models.SlotHold, models.DoctorSchedule
+    now = datetime.now()
+    try:
+        changed = db.execute(
+            update(H)
+            .where(H.id == hold_id, H.patient_id == patient_id,
+                   H.status == models.HoldStatus.held, H.expires_at > now)
+            .values(status=models.HoldStatus.confirmed, resolved_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not changed:
+            raise booking.BookingError("暂占号不存在或已过期")
+        entry = db.execute(
+            select(H.doctor_id, H.schedule_id, S.date, S.stripes).join(S, S.id == H.schedule_id).where(H.id == hold_id)
+        ).one()
+        booking.check_daily_cap(db, patient_id, entry.date, daily_cap)
+        converted = bool(entry.stripes) and striped_counters.convert_held(db, entry.schedule_id, entry.stripes)
+        if not converted:
+            # 未分片，或读到分片数之后排班已合并回单行
+            converted = db.execute(
+                update(S)
+                .where(S.id == entry.schedule_id, S.stripes == 0, S.held_count > 0)
+                .values(held_count=S.held_count - 1, booked_count=S.booked_count + 1)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+        if not converted:
+            # 计数上找不到这张暂占号：不建预约，免得已约数少记一个而超卖
+            raise booking.BookingError("暂占号计数不一致，请稍后重试")
+        appt = models.Appointment(patient_id=patient_id, doctor_id=entry.doctor_id, schedule_id=entry.schedule_id,
+                                  status=models.AppointmentStatus.scheduled)
+        db.add(appt)
+        db.flush()
+        db.execute(update(H).where(H.id == hold_id).values(appointment_id=appt.id)
+                   .execution_options(synchronize_session=False))
+        db.commit()
+    except booking.BookingError:
+        db.rollback()
+        raise
+    except IntegrityError:
+        db.rollback()
+        raise booking.BookingError("已有该排班的有效预约", booking.DUPLICATE)
+    db.refresh(appt)
+    inventory.refresh(db, [entry.schedule_id])
+    return appt
+
+
+def release(db: Session, hold_id: int, patient_id: int) -> bool:
+    """患者放弃暂占号并提交；空出的号给候补队首。返回是否真正释放"""
+    H = models.SlotHold
+    changed = db.execute(
+        update(H)
+        .where(H.id == hold_id, H.patient_id == patient_id, H.status == models.HoldStatus.held)
+        .values(status=models.HoldStatus.released, resolved_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    schedule_id, promoted = None, []
+    if changed:
+        schedule_id = db.scalar(select(H.schedule_id).where(H.id == hold_id))
+        booking.release_slot(db, schedule_id, held=True)
+        promoted = waitlist.promote(db, schedule_id)
+    db.commit()
+    inventory.refresh(db, [schedule_id])
+    waitlist.notify(promoted)
+    return bool(changed)
+
+
+# ---------- 过期清理 ----------
+
+def _swept(token: str):
+    return models.SlotHold.sweep_batch == token
+
+
+def sweep_batch(db: Session, batch: int = SWEEP_BATCH, now: Optional[datetime] = None) -> int:
+    """清理一批过期暂占号并提交，返回本批释放的数量"""
+    H, S, D, W = models.SlotHold, models.DoctorSchedule, models.DoctorDaySchedule, models.AppointmentWaitlist
+    now = now or datetime.now()
+    ids = db.scalars(
+        select(H.id).where(H.status == models.HoldStatus.held, H.expires_at < now).order_by(H.expires_at).limit(batch)
+    ).all()
+    if not ids:
+        db.rollback()
+        return 0
+
+    token = uuid.uuid4().hex
+    marked = db.execute(
+        update(H)
+        .where(H.id.in_(ids), H.status == models.HoldStatus.held)
+        .values(status=models.HoldStatus.expired, sweep_batch=token, resolved_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not marked:
+        db.rollback()
+        return 0
+
+    # 排班 held_count 按本批各排班的过期数整批回补
+    per_schedule = (
+        select(func.count(H.id)).where(_swept(token), H.schedule_id == S.id).scalar_subquery()
+    )
+    db.execute(
+        update(S)
+        .where(S.id.in_(select(H.schedule_id).where(_swept(token))), S.stripes == 0)
+        .values(held_count=case((S.held_count > per_schedule, S.held_count - per_schedule), else_=0))
+        .execution_options(synchronize_session=False)
+    )
+
+    # 日聚合按 (医生, 日期, 上午/下午) 回补；分片排班的日聚合由分片汇总维护
+    def per_half(morning: bool):
+        half = S.start_time < NOON if morning else S.start_time >= NOON
+        return (
+            select(func.count(H.id)).join(S, S.id == H.schedule_id)
+            .where(_swept(token), S.stripes == 0, S.doctor_id == D.doctor_id, S.date == D.date, half)
+            .scalar_subquery()
+        )
+
+    am, pm = per_half(True), per_half(False)
+    db.execute(
+        update(D)
+        .where(tuple_(D.doctor_id, D.date).in_(
+            select(S.doctor_id, S.date).join(H, H.schedule_id == S.id).where(_swept(token))
+        ))
+        .values(
+            am_booked_count=case((D.am_booked_count > am, D.am_booked_count - am), else_=0),
+            pm_booked_count=case((D.pm_booked_count > pm, D.pm_booked_count - pm), else_=0),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    # 空出的号给候补：只对确有候补的排班逐个处理
+    freed = dict(db.execute(
+        select(H.schedule_id, func.count(H.id)).where(_swept(token)).group_by(H.schedule_id)
+    ).all())
+    # 分片排班少见，按实际暂占号逐个重排分片
+    for schedule_id in db.scalars(select(S.id).where(S.id.in_(list(freed)), S.stripes > 0)).all():
+        striped_counters.resync(db, schedule_id)
+    waiting = db.scalars(
+        select(W.schedule_id).distinct()
+        .where(W.schedule_id.in_(list(freed)), W.status == models.WaitlistStatus.waiting)
+    ).all()
+    promoted: List[models.AppointmentWaitlist] = []
+    for schedule_id in waiting:
+        promoted += waitlist.promote(db, schedule_id, freed[schedule_id])
+    db.commit()
+    inventory.refresh(db, freed)
+    waitlist.notify(promoted)
+    return marked
+
+
+def sweep(db: Session, batch: int = SWEEP_BATCH) -> int:
+    """清理全部过期暂占号（每批一个短事务），返回释放总数"""
+    total = 0
+    now = datetime.now()
+    while True:
+        released = sweep_batch(db, batch, now)
+        total += released
+        if released < batch:
+            return total
+
+
+def run_once() -> int:
+    from backend.database import SessionLocal
+    with SessionLocal() as db:
+        released = sweep(db)
+    if released:
+        logger.info("释放过期暂占号 %d 个", released)
+    return released
+
+
+async def run_periodically(interval: float = SWEEP_INTERVAL_SECONDS):
+    """后台任务：每 interval 秒清理一次过期暂占号"""
+    while True:
+        try:
+            await asyncio.to_thread(run_once)
+        except Exception:
+            logger.exception("slot hold sweep failed")
+        await asyncio.sleep(interval)
@@ -0,0 +1,270 @@
+"""
+号源库存缓存（进程内）
+- 常驻内存保存未来 7 天内所有开放排班的容量与已约数，患者端查询排班/可约医生直接读内存，不再每次轮询都查库
+- 写穿：占号、退号、改状态、新建/删除排班在事务提交后按排班 id 回读该行更新缓存（见 services.booking 与排班路由）
+- 版本号：每次写入全局版本号加一并记在条目上；回读/整表加载开始前记下版本号，
+  写回时若条目已被更新的写入覆盖，说明本次读到的是旧值，丢弃并重读，避免旧快照盖住新计数
+- 整表加载有最长存活时间（SLOT_INVENTORY_MAX_AGE 秒）并在跨天时重建窗口，
+  用来收敛其它进程/脚本直接改库造成的偏差；多进程部署时各进程各自缓存，偏差不超过该时间
+- 监听：add_listener 注册的回调在每次写穿/移除/整表重载后收到变化的条目（[(条目, 是否移出)]），
+  号源推送（services.slot_feed）由此获得占号、退号、排班增删改的变化
+"""
+import asyncio
+import os
+import threading
+import time as _time
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.services import striped_counters
+
+WINDOW_DAYS = 7
+MAX_AGE_SECONDS = float(os.getenv("SLOT_INVENTORY_MAX_AGE", "60"))
+# 写回冲突时的重读次数，超过后标记整表重载
+_REFRESH_RETRIES = 3
+
+# (条目, 是否移出缓存)；移出时为移出前的最后状态
+SlotChange = Tuple["SlotEntry", bool]
+
+
+@dataclass(frozen=True)
+class SlotEntry:
+    id: int
+    doctor_id: int
+    date: date
+    start_time: time
+    end_time: time
+    capacity: int
+    booked_count: int
+    held_count: int
+    status: models.ScheduleStatus
+    version: int
+
+    @property
+    def fully_booked(self) -> bool:
+        return self.booked_count + self.held_count >= self.capacity
+
+    @property
+    def available(self) -> int:
+        return max(self.capacity - self.booked_count - self.held_count, 0)
+
+
+def _columns():
+    # 分片计数的排班实时汇总各分片（见 services.striped_counters）
+    S = models.DoctorSchedule
+    return (S.id, S.doctor_id, S.date, S.start_time, S.end_time, S.capacity,
+            striped_counters.booked_expr().label("booked_count"), striped_counters.held_expr().label("held_count"),
+            S.status)
+
+
+def _state(entry: Optional[SlotEntry]):
+    if entry is None:
+        return None
+    return (entry.doctor_id, entry.date, entry.start_time, entry.end_time,
+            entry.capacity, entry.booked_count, entry.held_count, entry.status)
+
+
+class SlotInventory:
+    def __init__(self, session_factory: Optional[Callable[[], Session]] = None,
+                 window_days: int = WINDOW_DAYS, max_age: float = MAX_AGE_SECONDS):
+        self._session_factory = session_factory
+        self.window_days = window_days
+        self.max_age = max_age
+        self.version = 0
+        self._entries: Dict[int, SlotEntry] = {}
+        self._by_doctor: Dict[int, Dict[int, SlotEntry]] = {}
+        # 加载期间被删除的排班：防止加载拿到的旧快照把它们放回来
+        self._removed: Dict[int, int] = {}
+        self._window_start: Optional[date] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._listeners: List[Callable[[List[SlotChange]], None]] = []
+
+    def configure(self, session_factory: Callable[[], Session]):
+        """指定整表加载使用的会话工厂（压测/脚本使用独立数据库时调用）"""
+        self._session_factory = session_factory
+        self.invalidate()
+
+    def add_listener(self, callback: Callable[[List[SlotChange]], None]):
+        """注册变化回调；回调在写入线程里同步调用，应尽快返回"""
+        self._listeners.append(callback)
+
+    def _notify(self, changes: List[SlotChange]):
+        if not changes:
+            return
+        for callback in list(self._listeners):
+            callback(changes)
+
+    # ---------- 读 ----------
+
+    def window(self, today: Optional[date] = None):
+        today = today or datetime.today().date()
+        return today, today + timedelta(days=self.window_days)
+
+    def is_fresh(self) -> bool:
+        return (
+            self._window_start == datetime.today().date()
+            and _time.monotonic() - self._loaded_at < self.max_age
+        )
+
+    def ensure_loaded(self):
+        if self.is_fresh():
+            return
+        with self._load_lock:
+            if self.is_fresh():
+                return
+            factory = self._session_factory
+            if factory is None:
+                from backend.database import SessionLocal as factory
+            with factory() as db:
+                self.load(db)
+
+    async def ensure_loaded_async(self):
+        """异步路由使用：需要重载时放到线程里执行，不阻塞事件循环"""
+        if not self.is_fresh():
+            await asyncio.to_thread(self.ensure_loaded)
+
+    def schedules(self, doctor_id: int, day: Optional[date] = None) -> List[SlotEntry]:
+        """医生在窗口内的开放排班，按日期、开始时间排序"""
+        self.ensure_loaded()
+        with self._lock:
+            entries = list(self._by_doctor.get(doctor_id, {}).values())
+        if day is not None:
+            entries = [e for e in entries if e.date == day]
+        entries.sort(key=lambda e: (e.date, e.start_time, e.id))
+        return entries
+
+    def available_counts(self) -> Dict[int, int]:
+        """每位医生窗口内仍有余号的排班数（调用方先 ensure_loaded/ensure_loaded_async）"""
+        with self._lock:
+            return {
+                doctor_id: sum(1 for e in entries.values() if not e.fully_booked)
+                for doctor_id, entries in self._by_doctor.items()
+            }
+
+    def get(self, schedule_id: int) -> Optional[SlotEntry]:
+        self.ensure_loaded()
+        return self._entries.get(schedule_id)
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "schedules": len(self._entries),
+            "doctors": len(self._by_doctor),
+            "window_start": self._window_start.isoformat() if self._window_start else None,
+            "age_seconds": round(_time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+        }
+
+    # ---------- 写 ----------
+
+    def _accepts(self, row, start: date, end: date) -> bool:
+        return row.status == models.ScheduleStatus.open and start <= row.date <= end
+
+    def _install(self, entry: SlotEntry):
+        old = self._entries.get(entry.id)
+        if old is not None and old.doctor_id != entry.doctor_id:
+            self._by_doctor.get(old.doctor_id, {}).pop(entry.id, None)
+        self._entries[entry.id] = entry
+        self._by_doctor.setdefault(entry.doctor_id, {})[entry.id] = entry
+
+    def _drop(self, schedule_id: int) -> Optional[SlotEntry]:
+        old = self._entries.pop(schedule_id, None)
+        if old is not None:
+            doctor = self._by_doctor.get(old.doctor_id)
+            if doctor is not None:
+                doctor.pop(schedule_id, None)
+                if not doctor:
+                    del self._by_doctor[old.doctor_id]
+        self._removed[schedule_id] = self.version
+        return old
+
+    def load(self, db: Session):
+        """整表加载窗口内的开放排班；加载期间发生的写穿以版本号为准保留"""
+        start, end = self.window()
+        started = self.version
+        S = models.DoctorSchedule
+        rows = db.execute(
+            select(*_columns()).where(S.status == models.ScheduleStatus.open, S.date >= start, S.date <= end)
+        ).all()
+        with self._lock:
+            current, reloading = self._entries, self._window_start is not None
+            self._entries, self._by_doctor = {}, {}
+            for row in rows:
+                if self._removed.get(row.id, -1) > started:
+                    continue
+                newer = current.get(row.id)
+                if newer is not None and newer.version > started:
+                    self._install(newer)
+                else:
+                    self._install(SlotEntry(**row._mapping, version=started))
+            for entry in current.values():
+                if entry.version > started and entry.id not in self._entries and start <= entry.date <= end:
+                    self._install(entry)
+            self._removed = {k: v for k, v in self._removed.items() if v > started}
+            self._window_start = start
+            self._loaded_at = _time.monotonic()
+            # 重载（非首次加载）时找出与旧缓存不同的条目，收敛库外修改的同时通知监听方
+            changes = []
+            if reloading:
+                changes = [
+                    (e, False) for e in self._entries.values()
+                    if _state(current.get(e.id)) != _state(e)
+                ]
+                changes += [(e, True) for i, e in current.items() if i not in self._entries]
+        self._notify(changes)
+
+    def refresh(self, db: Session, schedule_ids: Iterable[int]):
+        """写穿：事务提交后回读排班行更新缓存；行已删除/关闭/不在窗口内则移出缓存"""
+        ids = {i for i in schedule_ids if i is not None}
+        if not ids or self._window_start is None:
+            return
+        S = models.DoctorSchedule
+        for _ in range(_REFRESH_RETRIES):
+            token = self.version
+            rows = {r.id: r for r in db.execute(select(*_columns()).where(S.id.in_(ids))).all()}
+            start, end = self.window()
+            changes = []
+            with self._lock:
+                conflicts = {
+                    i for i in ids
+                    if (i in self._entries and self._entries[i].version > token) or self._removed.get(i, -1) > token
+                }
+                for schedule_id in ids - conflicts:
+                    self.version += 1
+                    row = rows.get(schedule_id)
+                    if row is not None and self._accepts(row, start, end):
+                        entry = SlotEntry(**row._mapping, version=self.version)
+                        self._install(entry)
+                        changes.append((entry, False))
+                    else:
+                        old = self._drop(schedule_id)
+                        if old is not None:
+                            changes.append((old, True))
+            self._notify(changes)
+            if not conflicts:
+                return
+            ids = conflicts
+        # 持续冲突：放弃逐行写回，下次读取时整表重载
+        self.invalidate()
+
+    def drop_doctor(self, doctor_id: int):
+        """医生被删除/停用时移除其全部排班"""
+        changes = []
+        with self._lock:
+            for schedule_id in list(self._by_doctor.get(doctor_id, {})):
+                self.version += 1
+                changes.append((self._drop(schedule_id), True))
+        self._notify(changes)
+
+    def invalidate(self):
+        """标记过期，下次读取时整表重载（批量改排班后调用）"""
+        self._loaded_at = 0.0
+
+
+inventory = SlotInventory()
@@ -0,0 +1,344 @@
+"""
+热点排班分片计数
+- 热门专家的上午排班是全库最热的一行：每次挂号/退号都要条件更新 doctor_schedules 该行，以及同一医生当天的日聚合行，
+  并发挂号在这两行的行锁上排队
+- 分片模式：排班容量按分片拆到 schedule_counter_stripes 的 N 行，占号从随机分片开始依次尝试条件 UPDATE
+  （booked_count + held_count < capacity），退号/暂占确认同样只改一个分片；余号为各分片之和，
+  只要任一分片有余号就能挂上，不会因为分片不均误报满员
+- 自动启用：本进程内同一排班在 SCHEDULE_STRIPE_WINDOW 秒内的计数写入达到 SCHEDULE_STRIPE_THRESHOLD 次即记为热点，
+  由后台任务切换为分片（同一医生同一天同一时段只有这一个排班时才切换，保证日聚合的时段容量不被其它排班挤占）；
+  过期或空闲 SCHEDULE_STRIPE_IDLE 秒后合并回单行
+- 分片占号不经过日聚合的条件 UPDATE：该时段的日聚合容量比排班容量紧时不切换，已分片的排班在日聚合容量改紧后合并回单行
+- 没有分片排班时后台任务只做一次走部分索引的查询，不开写事务（SQLite 上没有命中行的 UPDATE 也要拿写锁）
+- 读：号源库存、可约医生、候补判断用 booked_expr/held_expr 实时汇总分片；排班行上的 booked_count/held_count
+  与日聚合计数由后台任务每 SCHEDULE_STRIPE_FOLD_INTERVAL 秒汇总写回一次，其它直接读排班行的接口最多滞后这么久
+- 过期清理、计数对账、容量修改等低频路径用 resync 按实际预约/暂占号重排各分片
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time as _time
+from datetime import date, datetime, time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, case, delete, func, insert, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from backend import models
+
+logger = logging.getLogger("medical-system.stripes")
+
+STRIPE_COUNT = int(os.getenv("SCHEDULE_STRIPES", "8"))
+# 窗口内写入次数达到阈值即切换为分片；0 表示不自动切换
+STRIPE_THRESHOLD = int(os.getenv("SCHEDULE_STRIPE_THRESHOLD", "50"))
+STRIPE_WINDOW_SECONDS = float(os.getenv("SCHEDULE_STRIPE_WINDOW", "1"))
+STRIPE_IDLE_SECONDS = float(os.getenv("SCHEDULE_STRIPE_IDLE", "300"))
+FOLD_INTERVAL_SECONDS = float(os.getenv("SCHEDULE_STRIPE_FOLD_INTERVAL", "1"))
+
+NOON = time(12, 0)
+
+
+class ContentionTracker:
+    """按排班统计固定窗口内的计数写入次数，达到阈值的排班记为热点"""
+
+    def __init__(self, threshold: int = STRIPE_THRESHOLD, window: float = STRIPE_WINDOW_SECONDS):
+        self.threshold = threshold
+        self.window = window
+        # schedule_id -> (窗口开始, 窗口内次数)
+        self._counts: Dict[int, Tuple[float, int]] = {}
+        self._last: Dict[int, float] = {}
+        self._hot: Set[int] = set()
+        self._started = _time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, schedule_id: int):
+        now = _time.monotonic()
+        with self._lock:
+            started, n = self._counts.get(schedule_id, (now, 0))
+            if now - started >= self.window:
+                started, n = now, 0
+            self._counts[schedule_id] = (started, n + 1)
+            self._last[schedule_id] = now
+            if self.threshold and n + 1 >= self.threshold:
+                self._hot.add(schedule_id)
+
+    def take_hot(self) -> Set[int]:
+        with self._lock:
+            hot, self._hot = self._hot, set()
+        return hot
+
+    def idle_since(self, schedule_id: int) -> float:
+        """距本进程最后一次写入的秒数；本进程没写过时按进程启动起算"""
+        return _time.monotonic() - self._last.get(schedule_id, self._started)
+
+    def prune(self, older_than: float):
+        cutoff = _time.monotonic() - older_than
+        with self._lock:
+            for schedule_id in [k for k, v in self._last.items() if v < cutoff]:
+                self._last.pop(schedule_id, None)
+                self._counts.pop(schedule_id, None)
+
+
+tracker = ContentionTracker()
+
+
+# ---------- 读 ----------
+
+def _stripe_sum(column):
+    T, S = models.ScheduleCounterStripe, models.DoctorSchedule
+    return select(func.coalesce(func.sum(column), 0)).where(T.schedule_id == S.id).scalar_subquery()
+
+
+def booked_expr():
+    """排班的实时已约数：分片时为各分片之和"""
+    S, T = models.DoctorSchedule, models.ScheduleCounterStripe
+    return case((S.stripes > 0, _stripe_sum(T.booked_count)), else_=S.booked_count)
+
+
+def held_expr():
+    S, T = models.DoctorSchedule, models.ScheduleCounterStripe
+    return case((S.stripes > 0, _stripe_sum(T.held_count)), else_=S.held_count)
+
+
+# ---------- 分片占号/退号（在调用方事务里，只 flush 不提交） ----------
+
+def _order(stripes: int) -> List[int]:
+    start = random.randrange(stripes)
+    return [(start + i) % stripes for i in range(stripes)]
+
+
+def take(db: Session, schedule_id: int, stripes: int, held: bool = False) -> bool:
+    """从随机分片开始依次尝试占一个号，全部分片已满返回 False"""
+    T = models.ScheduleCounterStripe
+    counter = T.held_count if held else T.booked_count
+    for stripe in _order(stripes):
+        if db.execute(
+            update(T)
+            .where(T.schedule_id == schedule_id, T.stripe == stripe, T.booked_count + T.held_count < T.capacity)
+            .values({counter: counter + 1})
+            .execution_options(synchronize_session=False)
+        ).rowcount:
+            return True
+    return False
+
+
+def give_back(db: Session, schedule_id: int, stripes: int, held: bool = False) -> bool:
+    """从任一计数大于 0 的分片退回一个号"""
+    T = models.ScheduleCounterStripe
+    counter = T.held_count if held else T.booked_count
+    for stripe in _order(stripes):
+        if db.execute(
+            update(T)
+            .where(T.schedule_id == schedule_id, T.stripe == stripe, counter > 0)
+            .values({counter: counter - 1})
+            .execution_options(synchronize_session=False)
+        ).rowcount:
+            return True
+    return False
+
+
+def convert_held(db: Session, schedule_id: int, stripes: int) -> bool:
+    """暂占号确认：任一分片上的暂占转为已约"""
+    T = models.ScheduleCounterStripe
+    for stripe in _order(stripes):
+        if db.execute(
+            update(T)
+            .where(T.schedule_id == schedule_id, T.stripe == stripe, T.held_count > 0)
+            .values(held_count=T.held_count - 1, booked_count=T.booked_count + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount:
+            return True
+    return False
+
+
+# ---------- 分片重排 ----------
+
+def _distribute(capacity: int, stripes: int, booked: int, held: int) -> List[Tuple[int, int, int]]:
+    """容量均分到各分片，已约/暂占轮流放进还有余量的分片（超出容量的部分放到任意分片），返回 [(容量, 已约, 暂占)]"""
+    caps = [capacity // stripes + (1 if i < capacity % stripes else 0) for i in range(stripes)]
+    used = [[0, 0] for _ in range(stripes)]
+    i = 0
+    for kind, count in ((0, booked), (1, held)):
+        for _ in range(count):
+            for step in range(stripes):
+                k = (i + step) % stripes
+                if sum(used[k]) < caps[k]:
+                    break
+            else:
+                k = i % stripes
+            used[k][kind] += 1
+            i = k + 1
+    return [(caps[k], used[k][0], used[k][1]) for k in range(stripes)]
+
+
+def _write(db: Session, schedule_id: int, capacity: int, stripes: int, booked: int, held: int):
+    T = models.ScheduleCounterStripe
+    existing = dict(db.execute(
+        select(T.stripe, T.id).where(T.schedule_id == schedule_id).with_for_update()
+    ).all())
+    rows = []
+    for stripe, (cap, b, h) in enumerate(_distribute(capacity, stripes, booked, held)):
+        values = {"capacity": cap, "booked_count": b, "held_count": h}
+        if stripe in existing:
+            db.execute(update(T).where(T.id == existing[stripe]).values(**values)
+                       .execution_options(synchronize_session=False))
+        else:
+            rows.append({"schedule_id": schedule_id, "stripe": stripe, **values})
+    if rows:
+        db.execute(insert(T), rows)
+    db.execute(delete(T).where(T.schedule_id == schedule_id, T.stripe >= stripes))
+
+
+def resync(db: Session, schedule_id: int):
+    """按实际有效预约/暂占号与当前容量重排分片（在调用方事务里）；不是分片排班时直接返回"""
+    S, A, H = models.DoctorSchedule, models.Appointment, models.SlotHold
+    schedule = db.execute(
+        select(S.capacity, S.stripes).where(S.id == schedule_id).with_for_update()
+    ).first()
+    if schedule is None or not schedule.stripes:
+        return
+    booked = db.scalar(select(func.count(A.id)).where(
+        A.schedule_id == schedule_id, A.status != models.AppointmentStatus.cancelled))
+    held = db.scalar(select(func.count(H.id)).where(
+        H.schedule_id == schedule_id, H.status == models.HoldStatus.held))
+    _write(db, schedule_id, schedule.capacity, schedule.stripes, booked, held)
+
+
+# ---------- 切换与汇总 ----------
+
+def _half(morning: bool):
+    S = models.DoctorSchedule
+    return S.start_time < NOON if morning else S.start_time >= NOON
+
+
+def _day_limited(db: Session, schedule_id: int) -> bool:
+    """排班所在时段的日聚合容量（0 为不限）比排班容量紧"""
+    S, D = models.DoctorSchedule, models.DoctorDaySchedule
+    row = db.execute(
+        select(S.capacity, S.start_time, D.am_capacity, D.pm_capacity)
+        .join(D, and_(D.doctor_id == S.doctor_id, D.date == S.date))
+        .where(S.id == schedule_id)
+    ).first()
+    if row is None:
+        return False
+    limit = row.am_capacity if row.start_time < NOON else row.pm_capacity
+    return bool(limit) and limit < row.capacity
+
+
+def enable(db: Session, schedule_id: int, stripes: int = STRIPE_COUNT) -> bool:
+    """
+    把单行计数的排班切换为分片并提交；不满足条件（已分片、未开放、同时段还有其它排班、
+    时段日聚合容量比排班容量紧）返回 False
+    """
+    S = models.DoctorSchedule
+    schedule = db.execute(
+        select(S.doctor_id, S.date, S.start_time, S.status, S.stripes).where(S.id == schedule_id)
+    ).first()
+    if schedule is None or schedule.stripes or schedule.status != models.ScheduleStatus.open or stripes < 2:
+        db.rollback()
+        return False
+    morning = schedule.start_time < NOON
+    others = db.scalar(select(func.count(S.id)).where(
+        S.doctor_id == schedule.doctor_id, S.date == schedule.date, S.id != schedule_id, _half(morning)))
+    if others or _day_limited(db, schedule_id):
+        db.rollback()
+        return False
+    # 条件更新拿到排班行锁之后再读计数，切换前已提交的单行占号都包含在内
+    switched = db.execute(
+        update(S).where(S.id == schedule_id, S.stripes == 0).values(stripes=stripes)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not switched:
+        db.rollback()
+        return False
+    row = db.execute(select(S.capacity, S.booked_count, S.held_count).where(S.id == schedule_id)).one()
+    _write(db, schedule_id, row.capacity, stripes, row.booked_count, row.held_count)
+    db.commit()
+    logger.info("排班 %s 切换为 %d 个分片计数", schedule_id, stripes)
+    return True
+
+
+def fold(db: Session, schedule_ids: Optional[Iterable[int]] = None) -> int:
+    """把分片计数汇总写回排班行与日聚合（在调用方事务里），返回汇总的排班数"""
+    S, D, T = models.DoctorSchedule, models.DoctorDaySchedule, models.ScheduleCounterStripe
+    scope = [S.stripes > 0]
+    if schedule_ids is not None:
+        scope.append(S.id.in_(list(schedule_ids)))
+    folded = db.execute(
+        update(S).where(*scope)
+        .values(booked_count=_stripe_sum(T.booked_count), held_count=_stripe_sum(T.held_count))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not folded:
+        return 0
+    # 分片排班所在时段只有它一个排班（见 enable），该时段的日聚合计数就是它的已约 + 暂占
+    for morning, column in ((True, D.am_booked_count), (False, D.pm_booked_count)):
+        striped = select(S.doctor_id, S.date).where(*scope, _half(morning))
+        total = (
+            select(S.booked_count + S.held_count)
+            .where(*scope, _half(morning), S.doctor_id == D.doctor_id, S.date == D.date)
+            .limit(1)
+            .scalar_subquery()
+        )
+        db.execute(
+            update(D).where(tuple_(D.doctor_id, D.date).in_(striped)).values({column: total})
+            .execution_options(synchronize_session=False)
+        )
+    return folded
+
+
+def disable(db: Session, schedule_id: int) -> bool:
+    """合并回单行计数并提交"""
+    S, T = models.DoctorSchedule, models.ScheduleCounterStripe
+    # 先锁住各分片，合并期间不再有分片占号
+    db.execute(select(T.id).where(T.schedule_id == schedule_id).with_for_update()).all()
+    if not fold(db, [schedule_id]):
+        db.rollback()
+        return False
+    db.execute(update(S).where(S.id == schedule_id).values(stripes=0).execution_options(synchronize_session=False))
+    db.execute(delete(T).where(T.schedule_id == schedule_id))
+    db.commit()
+    logger.info("排班 %s 合并回单行计数", schedule_id)
+    return True
+
+
+def stats(db: Session) -> dict:
+    S = models.DoctorSchedule
+    return {
+        "striped": db.scalar(select(func.count(S.id)).where(S.stripes > 0)),
+        "threshold": tracker.threshold,
+        "window_seconds": tracker.window,
+    }
+
+
+def run_once(today: Optional[date] = None) -> Dict[str, int]:
+    """切换热点排班、汇总分片计数、合并过期/空闲的分片排班"""
+    from backend.database import SessionLocal
+    today = today or datetime.today().date()
+    S = models.DoctorSchedule
+    result = {"enabled": 0, "folded": 0, "disabled": 0}
+    with SessionLocal() as db:
+        for schedule_id in tracker.take_hot():
+            result["enabled"] += enable(db, schedule_id)
+        striped = db.execute(select(S.id, S.date).where(S.stripes > 0)).all()
+        if striped:
+            result["folded"] = fold(db, [schedule_id for schedule_id, _ in striped])
+            db.commit()
+        for schedule_id, day in striped:
+            if day < today or tracker.idle_since(schedule_id) > STRIPE_IDLE_SECONDS or _day_limited(db, schedule_id):
+                result["disabled"] += disable(db, schedule_id)
+        db.rollback()
+    tracker.prune(max(STRIPE_IDLE_SECONDS, STRIPE_WINDOW_SECONDS) * 2)
+    return result
+
+
+async def run_periodically(interval: float = FOLD_INTERVAL_SECONDS):
+    """后台任务：每 interval 秒执行一次 run_once"""
+    while True:
+        try:
+            await asyncio.to_thread(run_once)
+        except Exception:
+            logger.exception("striped counter maintenance failed")
+        await asyncio.sleep(interval)
@@ -0,0 +1,169 @@
+"""
+管理端用户列表
+- /api/admin/users（患者）与 /api/admin/all-users（全部角色）共用一条查询：
+  users LEFT JOIN patient_profiles / doctor_profiles / pharmacist_profiles（各按角色限定），姓名取对应角色的资料
+- 关键字按手机号片段、姓名、身份证号尾号走搜索索引（services.user_search），不再对手机号做前置通配 LIKE
+- 服务端排序：创建时间或手机号，正序/倒序，均为 (排序列, id) 游标分页，走 users 上的对应索引（见迁移 1、2、11）
+- 总数：只按角色过滤（或不过滤）时先估算：表的统计行数（SQLite sqlite_stat1 / MySQL information_schema）
+  乘以该角色的占比（按角色分组计数，每 USER_ROLE_SHARE_TTL 秒重算一次），超过 USER_COUNT_EXACT_LIMIT 时
+  直接用估算值（标记为估算），否则精确 COUNT；结果按过滤条件在进程内缓存 USER_COUNT_TTL 秒，
+  经 ORM 提交的用户或资料增删改（注册、审核、停用、删除、改名，按关键字的总数会受影响）由 Session 事件清空缓存
+"""
+import os
+import threading
+import time as _time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, event, func, select, text
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.core.pagination import Keyset, PageParams
+from backend.services import user_search
+
+COUNT_TTL_SECONDS = float(os.getenv("USER_COUNT_TTL", "60"))
+EXACT_COUNT_LIMIT = int(os.getenv("USER_COUNT_EXACT_LIMIT", "50000"))
+ROLE_SHARE_TTL_SECONDS = float(os.getenv("USER_ROLE_SHARE_TTL", "3600"))
+
+U = models.User
+PP, DP, HP = models.PatientProfile, models.DoctorProfile, models.PharmacistProfile
+
+# 排序字段 -> 游标分页键；最后一列 id 保证唯一
+SORT_FIELDS = {
+    "created_at": (U.created_at, U.id),
+    "phone": (U.phone, U.id),
+}
+_KEYSETS = {(field, desc): Keyset(*columns, desc=desc) for field, columns in SORT_FIELDS.items() for desc in (True, False)}
+
+
+def keyset(sort: str) -> Keyset:
+    """sort 形如 created_at / -created_at（- 表示倒序）；不支持的字段抛 ValueError"""
+    desc = sort.startswith("-")
+    field = sort.lstrip("-+")
+    if field not in SORT_FIELDS:
+        raise ValueError(sort)
+    return _KEYSETS[(field, desc)]
+
+
+def _filters(role: Optional[models.UserRole], status: Optional[models.UserStatus]) -> list:
+    conditions = []
+    if role is not None:
+        conditions.append(U.role == role)
+    if status is not None:
+        conditions.append(U.status == status)
+    return conditions
+
+
+def fetch(db: Session, role: Optional[models.UserRole], status: Optional[models.UserStatus],
+          keyword: Optional[str], sort: Keyset, page: PageParams) -> List:
+    """一页用户：id、phone、role、status、created_at、name（对应角色资料的姓名，没有资料为 None）"""
+    name = func.coalesce(PP.name, DP.name, HP.name).label("name")
+    q = (
+        select(U.id, U.phone, U.role, U.status, U.created_at, name)
+        .outerjoin(PP, and_(PP.user_id == U.id, U.role == models.UserRole.user))
+        .outerjoin(DP, and_(DP.user_id == U.id, U.role == models.UserRole.doctor))
+        .outerjoin(HP, and_(HP.user_id == U.id, U.role == models.UserRole.pharmacist))
+        .where(*_filters(role, status))
+    )
+    if user_search.normalize(keyword):
+        q = q.where(user_search.condition(db, keyword, page.limit))
+    return db.execute(sort.apply(q, page)).all()
+
+
+def table_estimate(db: Session) -> Optional[int]:
+    """users 表的统计行数；没有统计信息时返回 None"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        if not db.scalar(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")):
+            return None
+        stat = db.scalar(text("SELECT stat FROM sqlite_stat1 WHERE tbl = 'users' LIMIT 1"))
+        return int(stat.split()[0]) if stat else None
+    if dialect == "mysql":
+        return db.scalar(text(
+            "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'users'"
+        ))
+    return None
+
+
+class UserCounter:
+    """按过滤条件缓存的用户总数"""
+
+    def __init__(self, ttl: float = COUNT_TTL_SECONDS, exact_limit: int = EXACT_COUNT_LIMIT,
+                 share_ttl: float = ROLE_SHARE_TTL_SECONDS):
+        self.ttl = ttl
+        self.exact_limit = exact_limit
+        self.share_ttl = share_ttl
+        self._lock = threading.Lock()
+        self._cache: Dict[tuple, Tuple[float, int, bool]] = {}
+        self._shares: Optional[Tuple[float, Dict[models.UserRole, float]]] = None
+
+    def role_share(self, db: Session, role: models.UserRole) -> float:
+        """该角色占用户总数的比例；按角色分组计数（走 ix_users_role_phone）较慢，结果缓存 share_ttl 秒"""
+        now = _time.monotonic()
+        with self._lock:
+            shares = self._shares
+        if shares is None or now - shares[0] >= self.share_ttl:
+            counts = dict(db.execute(select(U.role, func.count(U.id)).group_by(U.role)).all())
+            total = sum(counts.values())
+            shares = (now, {r: c / total for r, c in counts.items()} if total else {})
+            with self._lock:
+                self._shares = shares
+        return shares[1].get(role, 0.0)
+
+    def count(self, db: Session, role: Optional[models.UserRole] = None, status: Optional[models.UserStatus] = None,
+              keyword: Optional[str] = None) -> Tuple[int, bool]:
+        """返回 (总数, 是否为估算值)"""
+        key = (role, status, user_search.normalize(keyword) or None)
+        now = _time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached and now - cached[0] < self.ttl:
+            return cached[1], cached[2]
+        conditions = _filters(role, status)
+        if user_search.normalize(keyword):
+            # 关键字：只有关键字时直接数索引命中，否则按命中的 id 集合联到 users 再数
+            matched = user_search.matching(db.get_bind().dialect.name, keyword)
+            if conditions:
+                query = select(func.count(U.id)).where(U.id.in_(matched), *conditions)
+            else:
+                query = select(func.count()).select_from(matched.subquery())
+            total, estimated = db.scalar(query), False
+        else:
+            estimate = None if status is not None else table_estimate(db)
+            if estimate is not None and estimate >= self.exact_limit and role is not None:
+                estimate = round(estimate * self.role_share(db, role))
+            if estimate is not None and estimate >= self.exact_limit:
+                total, estimated = estimate, True
+            else:
+                total, estimated = db.scalar(select(func.count(U.id)).where(*conditions)), False
+        with self._lock:
+            if len(self._cache) > 1000:
+                self._cache.clear()
+            self._cache[key] = (now, total, estimated)
+        return total, estimated
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+
+
+counter = UserCounter()
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_dirty(session, flush_context):
+    if not session.info.get("user_count_dirty") and any(
+        isinstance(obj, (models.User, PP, DP, HP)) for obj in (*session.new, *session.dirty, *session.deleted)
+    ):
+        session.info["user_count_dirty"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop("user_count_dirty", False):
+        counter.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("user_count_dirty", None)
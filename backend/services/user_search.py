@@ -0,0 +1,204 @@
+"""
+用户搜索索引
+- 管理端用户列表按手机号片段、姓名、身份证号尾号搜索；phone LIKE '%kw%' 这类前置通配符用不上 B 树索引，每次都全表扫描
+- 关键字不少于 3 个字符：SQLite 用 FTS5 trigram 虚表 user_search（rowid 即用户 id，列 phone/name/id_card），
+  MATCH 一个短语就是子串匹配，中文按字符切分同样适用；MySQL 用同名普通表 + ngram 分词的 FULLTEXT 索引（见迁移 12）。
+  身份证号只认尾号：索引里的身份证号末尾加 ID_CARD_END，匹配短语“尾号 + ID_CARD_END”即为尾号匹配
+- 关键字 1~2 个字符（中文姓名常见，如“张三”“王”）：trigram 索引不了，改查 user_search_grams，
+  其中存放姓名的全部单字与相邻两字；这么短的手机号/身份证号片段没有区分度，不支持
+- 列表过滤（condition）按命中数选路：命中不多时直接以 id 列表过滤（主键查找 + 小排序）；
+  常见的姓、短号段这类高频关键字改为按列表的排序顺序逐行探测索引（两字内查 (gram, user_id) 主键，
+  更长的按 rowid/user_id 取索引行比对），凑满一页即停，耗时不随命中数增长；查主键比取索引行便宜得多，两字内更早改走探测
+- 同步：Session after_flush 时把本次涉及的用户（账号或三类资料的增删改）在同一事务里重写索引行；
+  绕过 ORM 的写入（手工改库、批量 SQL）用 rebuild 全量重建，管理端有对应接口
+"""
+import logging
+import math
+import os
+from typing import Iterable, List, Set
+
+from sqlalchemy import and_, column, delete, event, exists, func, insert, literal_column, or_, select, table, text
+from sqlalchemy.dialects.mysql import match as mysql_match
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from backend import models
+
+logger = logging.getLogger("medical-system.user-search")
+
+TRIGRAM_MIN = 3
+MAX_KEYWORD_LENGTH = 50
+REBUILD_BATCH = 5000
+# 命中数超过 max(它, sqrt(每页条数 * 用户数 / 探测代价比)) 时改为逐行探测
+FREQUENT_HITS = int(os.getenv("USER_SEARCH_FREQUENT_HITS", "1000"))
+# 逐行探测每行的代价相对 id 列表每个命中的倍数的倒数：两字内探测 (gram, user_id) 主键约便宜 8 倍
+GRAM_PROBE_RATIO = 8
+# 与迁移 12 一致：身份证号里不会出现的字母，标记身份证号的结尾
+ID_CARD_END = "z"
+
+INDEX_TABLE = "user_search"
+# SQLite 的 FTS5 虚表以 rowid 关联用户，MySQL 的普通表用 user_id 主键
+_INDEX = {
+    "sqlite": table(INDEX_TABLE, column("rowid"), column("phone"), column("name"), column("id_card")),
+    "mysql": table(INDEX_TABLE, column("user_id"), column("phone"), column("name"), column("id_card")),
+}
+
+
+def _index(dialect: str):
+    if dialect not in _INDEX:
+        raise RuntimeError(f"数据库 {dialect} 暂不支持用户搜索索引")
+    return _INDEX[dialect]
+
+
+def _key(index):
+    return index.c.rowid if "rowid" in index.c else index.c.user_id
+
+
+def normalize(keyword: str) -> str:
+    return (keyword or "").strip().lower()[:MAX_KEYWORD_LENGTH]
+
+
+def grams(name: str) -> Set[str]:
+    """姓名的全部单字与相邻两字"""
+    name = normalize(name)
+    return {name[i:i + n] for n in (1, 2) for i in range(len(name) - n + 1) if not name[i:i + n].isspace()}
+
+
+def _like(keyword: str, suffix: bool = False) -> str:
+    escaped = keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}" if suffix else f"%{escaped}%"
+
+
+def _phrase(keyword: str) -> str:
+    return '"' + keyword.replace('"', '""') + '"'
+
+
+def _id_card_like(keyword: str) -> bool:
+    return all(c.isdigit() or c == "x" for c in keyword)
+
+
+def _indexed_id_card(id_card: str) -> str:
+    id_card = (id_card or "").lower()
+    return id_card + ID_CARD_END if id_card else ""
+
+
+def matching(dialect: str, keyword: str):
+    """匹配关键字的用户 id 子查询；keyword 须非空"""
+    keyword = normalize(keyword)
+    if len(keyword) < TRIGRAM_MIN:
+        G = models.UserSearchGram
+        return select(G.user_id).where(G.gram == keyword)
+    index = _index(dialect)
+    key = _key(index)
+    # trigram 短语即子串：手机号、姓名直接匹配关键字，身份证号匹配“关键字 + 结尾标记”，命中均无需复核
+    phrase, id_card_phrase = _phrase(keyword), _phrase(keyword + ID_CARD_END)
+    if dialect == "sqlite":
+        hit = literal_column(INDEX_TABLE).op("MATCH")("{phone name} : " + phrase)
+        id_card_hit = literal_column(INDEX_TABLE).op("MATCH")("id_card : " + id_card_phrase)
+    else:
+        hit = mysql_match(index.c.phone, index.c.name, against=phrase).in_boolean_mode()
+        id_card_hit = mysql_match(index.c.id_card, against=id_card_phrase).in_boolean_mode()
+    query = select(key).where(hit)
+    if _id_card_like(keyword):
+        query = query.union(select(key).where(id_card_hit))
+    return query
+
+
+def _probe(dialect: str, keyword: str):
+    """逐行探测：users 当前行是否匹配关键字（关联子查询）"""
+    U = models.User
+    keyword = normalize(keyword)
+    if len(keyword) < TRIGRAM_MIN:
+        G = models.UserSearchGram
+        return exists().where(G.gram == keyword, G.user_id == U.id)
+    index = _index(dialect)
+    return exists().where(_key(index) == U.id, or_(
+        index.c.phone.like(_like(keyword), escape="\\"),
+        func.lower(index.c.name).like(_like(keyword), escape="\\"),
+        index.c.id_card.like(_like(keyword + ID_CARD_END, suffix=True), escape="\\"),
+    ))
+
+
+def condition(db: Session, keyword: str, page_size: int):
+    """
+    用户列表按关键字过滤的条件（作用于 User）。命中数 h、用户数 n、每页 k 条时，
+    id 列表的代价约与 h 成正比，逐行探测约与 k * n / h 成正比，两者在 h = sqrt(k * n) 附近持平
+    （探测 gram 主键更便宜，再除以 GRAM_PROBE_RATIO）
+    """
+    dialect = db.get_bind().dialect.name
+    users = db.scalar(select(func.max(models.User.id))) or 0
+    ratio = GRAM_PROBE_RATIO if len(normalize(keyword)) < TRIGRAM_MIN else 1
+    cutoff = max(FREQUENT_HITS, math.isqrt(users * (page_size + 1) // ratio))
+    query = matching(dialect, keyword)
+    ids = db.scalars(select(query.subquery().c[0]).limit(cutoff + 1)).all()
+    if len(ids) <= cutoff:
+        return models.User.id.in_(ids)
+    return _probe(dialect, keyword)
+
+
+def _documents(conn: Connection, user_ids: List[int]) -> list:
+    U, PP, DP, HP = models.User, models.PatientProfile, models.DoctorProfile, models.PharmacistProfile
+    return conn.execute(
+        select(U.id, U.phone, func.coalesce(PP.name, DP.name, HP.name).label("name"), PP.id_card)
+        .outerjoin(PP, and_(PP.user_id == U.id, U.role == models.UserRole.user))
+        .outerjoin(DP, and_(DP.user_id == U.id, U.role == models.UserRole.doctor))
+        .outerjoin(HP, and_(HP.user_id == U.id, U.role == models.UserRole.pharmacist))
+        .where(U.id.in_(user_ids))
+    ).all()
+
+
+def reindex(conn: Connection, user_ids: Iterable[int]) -> int:
+    """重写这些用户的索引行（在调用方事务里）；已删除的用户只删不写，返回写入的用户数"""
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return 0
+    index, G = _index(conn.dialect.name), models.UserSearchGram
+    key = _key(index)
+    conn.execute(delete(index).where(key.in_(user_ids)))
+    conn.execute(delete(G).where(G.user_id.in_(user_ids)))
+    docs = _documents(conn, user_ids)
+    if docs:
+        conn.execute(insert(index), [
+            {key.name: d.id, "phone": d.phone, "name": d.name or "", "id_card": _indexed_id_card(d.id_card)} for d in docs
+        ])
+        rows = [{"gram": g, "user_id": d.id} for d in docs for g in grams(d.name or "")]
+        if rows:
+            conn.execute(insert(G), rows)
+    return len(docs)
+
+
+def rebuild(conn: Connection, batch: int = REBUILD_BATCH) -> int:
+    """清空并按用户 id 分批重建整个索引（在调用方事务里），返回索引的用户数"""
+    index, G, U = _index(conn.dialect.name), models.UserSearchGram, models.User
+    conn.execute(delete(index))
+    conn.execute(delete(G))
+    total, last = 0, 0
+    while True:
+        ids = conn.execute(select(U.id).where(U.id > last).order_by(U.id).limit(batch)).scalars().all()
+        if not ids:
+            break
+        total += reindex(conn, ids)
+        last = ids[-1]
+    if conn.dialect.name == "sqlite":
+        # 合并 FTS5 的段，批量写入后查询更快
+        conn.execute(text(f"INSERT INTO {INDEX_TABLE} ({INDEX_TABLE}) VALUES ('optimize')"))
+    logger.info("用户搜索索引重建完成：%d 个用户", total)
+    return total
+
+
+def _touched_users(session) -> Set[int]:
+    ids = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, models.User):
+            ids.add(obj.id)
+        elif isinstance(obj, (models.PatientProfile, models.DoctorProfile, models.PharmacistProfile)):
+            ids.add(obj.user_id)
+    ids.discard(None)
+    return ids
+
+
+@event.listens_for(Session, "after_flush")
+def _sync_on_flush(session, flush_context):
+    ids = _touched_users(session)
+    if ids:
+        reindex(session.connection(), ids)
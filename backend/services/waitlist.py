@@ -0,0 +1,168 @@
+"""
+满员排班候补
+- 排班满员后患者加入候补队列，不必反复重试挂号；同一患者同一排班只有一条等待中的候补（唯一部分索引，见迁移 5）
+- 退号（患者取消、医生改为取消）在退号的同一事务里调用 promote：按 id 顺序取队首，
+  在 SAVEPOINT 里走与挂号相同的 booking.place 占号，成功即转为预约，退号与转预约一起提交或一起回滚
+- 队首不满足挂号条件（当日预约数达上限）标记 skipped、已有该排班有效预约标记 cancelled，继续看下一位；
+  占号因容量/时段已满失败则停止，候补保持等待
+- 通知钩子：add_listener 注册的回调在事务提交后收到本次转为预约的候补（默认只记日志），
+  短信/站内信等通知在回调里接入
+"""
+import logging
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.services import booking, striped_counters
+
+logger = logging.getLogger("medical-system.waitlist")
+
+# 一次退号最多检查的候补数，避免队首大量不满足条件时长时间占着写事务
+PROMOTE_SCAN_LIMIT = 20
+
+_listeners: List[Callable[[models.AppointmentWaitlist], None]] = []
+
+
+def add_listener(callback: Callable[[models.AppointmentWaitlist], None]):
+    """注册候补转预约通知；回调在提交后调用，异常只记日志"""
+    _listeners.append(callback)
+
+
+def notify(promoted: List[models.AppointmentWaitlist]):
+    for entry in promoted:
+        for callback in list(_listeners):
+            try:
+                callback(entry)
+            except Exception:
+                logger.exception("waitlist listener failed: entry %s", entry.id)
+
+
+def _log_promotion(entry: models.AppointmentWaitlist):
+    logger.info("候补 %s 已转为预约 %s（患者 %s，排班 %s）",
+                entry.id, entry.appointment_id, entry.patient_id, entry.schedule_id)
+
+
+add_listener(_log_promotion)
+
+
+def find_waiting(db: Session, patient_id: int, schedule_id: int) -> Optional[models.AppointmentWaitlist]:
+    W = models.AppointmentWaitlist
+    return db.scalar(select(W).where(
+        W.patient_id == patient_id, W.schedule_id == schedule_id, W.status == models.WaitlistStatus.waiting,
+    ))
+
+
+def position(db: Session, entry: models.AppointmentWaitlist) -> Optional[int]:
+    """排在第几位（含自己）；非等待状态为 None"""
+    if entry.status != models.WaitlistStatus.waiting:
+        return None
+    W = models.AppointmentWaitlist
+    return db.scalar(select(func.count(W.id)).where(
+        W.schedule_id == entry.schedule_id, W.status == models.WaitlistStatus.waiting, W.id <= entry.id,
+    ))
+
+
+def join(db: Session, patient_id: int, doctor_id: int, schedule_id: int) -> models.AppointmentWaitlist:
+    """
+    加入候补并提交；已在候补中时幂等返回原记录
+    排班仍有余号或患者已有该排班的有效预约时抛 BookingError，调用方负责校验医生/排班归属与可预约日期
+    """
+    S = models.DoctorSchedule
+    schedule = db.execute(
+        select(S.status, S.capacity, (striped_counters.booked_expr() + striped_counters.held_expr()).label("taken"))
+        .where(S.id == schedule_id)
+    ).first()
+    if schedule is None:
+        raise booking.BookingError("排班不存在", booking.NOT_FOUND)
+    if schedule.status != models.ScheduleStatus.open:
+        raise booking.BookingError("排班未开放", booking.CLOSED)
+    if schedule.taken < schedule.capacity:
+        raise booking.BookingError("排班仍有余号，请直接挂号")
+    if booking.find_active(db, patient_id, schedule_id) is not None:
+        raise booking.BookingError("已有该排班的有效预约", booking.DUPLICATE)
+    exists = find_waiting(db, patient_id, schedule_id)
+    if exists is not None:
+        return exists
+
+    entry = models.AppointmentWaitlist(patient_id=patient_id, doctor_id=doctor_id, schedule_id=schedule_id)
+    db.add(entry)
+    try:
+        db.commit()
+    except IntegrityError:
+        # 并发重复加入撞上唯一部分索引
+        db.rollback()
+        exists = find_waiting(db, patient_id, schedule_id)
+        if exists is None:
+            raise
+        return exists
+    db.refresh(entry)
+    return entry
+
+
+def leave(db: Session, entry_id: int) -> bool:
+    """退出候补并提交；只有等待中的候补可以退出"""
+    W = models.AppointmentWaitlist
+    changed = db.execute(
+        update(W)
+        .where(W.id == entry_id, W.status == models.WaitlistStatus.waiting)
+        .values(status=models.WaitlistStatus.cancelled, resolved_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return bool(changed)
+
+
+def _resolve(entry: models.AppointmentWaitlist, status: models.WaitlistStatus, detail: Optional[str] = None,
+             appointment_id: Optional[int] = None):
+    entry.status = status
+    entry.detail = detail
+    entry.appointment_id = appointment_id
+    entry.resolved_at = datetime.now()
+
+
+def promote(db: Session, schedule_id: int, slots: int = 1) -> List[models.AppointmentWaitlist]:
+    """
+    在调用方的事务里按顺序把最多 slots 位候补转为预约（只 flush 不提交），返回转为预约的候补
+    调用方在刚退回号（退号、暂占号释放/过期）之后调用，提交后再把返回值交给 notify
+    """
+    W = models.AppointmentWaitlist
+    head = (
+        select(W)
+        .where(W.schedule_id == schedule_id, W.status == models.WaitlistStatus.waiting)
+        .order_by(W.id)
+        .limit(1)
+        .with_for_update()
+    )
+    promoted = []
+    for _ in range(PROMOTE_SCAN_LIMIT):
+        if len(promoted) >= slots:
+            break
+        entry = db.scalar(head)
+        if entry is None:
+            break
+        try:
+            with db.begin_nested():
+                appt, created = booking.place(db, entry.patient_id, entry.doctor_id, schedule_id,
+                                              daily_cap=booking.PATIENT_DAILY_CAP)
+        except booking.BookingError as e:
+            if e.reason in (booking.FULL, booking.DAY_FULL, booking.NOT_FOUND):
+                break
+            _resolve(entry, models.WaitlistStatus.skipped, e.detail)
+            db.flush()
+            continue
+        except IntegrityError:
+            _resolve(entry, models.WaitlistStatus.cancelled, "已有该排班的有效预约")
+            db.flush()
+            continue
+        if not created:
+            _resolve(entry, models.WaitlistStatus.cancelled, "已有该排班的有效预约", appt.id)
+            db.flush()
+            continue
+        _resolve(entry, models.WaitlistStatus.promoted, appointment_id=appt.id)
+        db.flush()
+        promoted.append(entry)
+    return promoted
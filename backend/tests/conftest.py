@@ -0,0 +1,172 @@
+"""
+挂号并发路径的测试夹具
+
+    cd backend
+    python -m pytest -q tests
+
+每个测试一个全新的 SQLite 文件库（bench 配置档：WAL、busy_timeout 30s），create_all 后执行全部迁移，
+与线上一样带唯一部分索引和计数触发器；多线程用例每个线程用自己的会话。
+计数是否正确统一交给计数对账（services.counter_reconciler）的只报告模式核对：
+排班 booked_count/held_count（含分片之和）、日聚合上午/下午计数与实际有效预约、有效暂占号一致。
+走 HTTP 的用例用 api 夹具：挂号路由 + 幂等键中间件，各会话依赖、号源库存、受理队列、幂等键存储都指向本测试的库。
+"""
+import os
+import sys
+import threading
+from datetime import date, time, timedelta
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND)
+sys.path.append(os.path.dirname(BACKEND))
+
+import database
+import models
+from database import build_async_engine, build_engine
+from migrations import apply_migrations
+from appointments.backend.routes import router as appointments_router
+from backend.core import idempotency
+from backend.services import admission, counter_reconciler
+from backend.services.slot_inventory import inventory
+
+DAY = date.today() + timedelta(days=1)
+
+
+@pytest.fixture
+def factory(tmp_path):
+    engine = build_engine(f"sqlite:///{tmp_path / 'test.db'}", profile="bench", name="test")
+    models.Base.metadata.create_all(bind=engine)
+    apply_migrations(engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def async_factory(factory, tmp_path):
+    engine = build_async_engine(f"sqlite:///{tmp_path / 'test.db'}", profile="bench", name="test_async")
+    yield async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    engine.sync_engine.dispose()
+
+
+@pytest.fixture
+def api(factory, async_factory, monkeypatch):
+    """挂号路由 + 幂等键中间件的 TestClient"""
+    def sync_db():
+        with factory() as db:
+            yield db
+
+    async def async_db():
+        async with async_factory() as db:
+            yield db
+
+    monkeypatch.setattr(admission, "controller", admission.AdmissionController(session_factory=factory))
+    monkeypatch.setattr(idempotency, "store", idempotency.IdempotencyStore(session_factory=async_factory))
+    monkeypatch.setattr(inventory, "_session_factory", factory)
+    inventory.invalidate()
+    app = FastAPI()
+    app.include_router(appointments_router)
+    app.middleware("http")(idempotency.idempotency_middleware)
+    app.dependency_overrides.update({
+        database.get_db: sync_db, database.get_read_db: sync_db,
+        database.get_async_db: async_db, database.get_async_read_db: async_db,
+    })
+    with TestClient(app) as client:
+        yield client
+    inventory.invalidate()
+
+
+@pytest.fixture
+def db(factory):
+    with factory() as session:
+        yield session
+
+
+@pytest.fixture
+def clinic(db):
+    """一名医生、20 名患者"""
+    doctor = models.User(phone="15900000000", password="hash", role=models.UserRole.doctor,
+                         status=models.UserStatus.active)
+    patients = [
+        models.User(phone=f"13{i:09d}", password="hash", role=models.UserRole.user, status=models.UserStatus.active)
+        for i in range(20)
+    ]
+    db.add_all([doctor, *patients])
+    db.commit()
+    return SimpleNamespace(doctor_id=doctor.id, patient_ids=[p.id for p in patients])
+
+
+@pytest.fixture
+def make_schedule(db, clinic):
+    """建一个一小时的排班并补齐日聚合行；day_capacity 为该时段（上午/下午）的日聚合容量（0 不限）"""
+
+    def make(capacity: int, hour: int = 9, day_capacity: int = 0, day: date = DAY) -> int:
+        morning = hour < 12
+        schedule = models.DoctorSchedule(doctor_id=clinic.doctor_id, date=day, start_time=time(hour),
+                                         end_time=time(hour + 1), capacity=capacity, status=models.ScheduleStatus.open)
+        db.add(schedule)
+        D = models.DoctorDaySchedule
+        aggregate = db.query(D).filter(D.doctor_id == clinic.doctor_id, D.date == day).first()
+        if aggregate is None:
+            aggregate = D(doctor_id=clinic.doctor_id, date=day)
+            db.add(aggregate)
+        if morning:
+            aggregate.am_capacity = day_capacity
+        else:
+            aggregate.pm_capacity = day_capacity
+        db.commit()
+        return schedule.id
+
+    return make
+
+
+@pytest.fixture
+def drift(db):
+    """返回一个函数：把全部 (医生, 日期) 记为待对账，只报告不修复，返回漂移的排班与日聚合（正确时为空列表）"""
+
+    def check() -> list:
+        db.rollback()
+        counter_reconciler.mark_all(db)
+        report = counter_reconciler.reconcile(db, repair=False)
+        return report["schedules"] + report["days"]
+
+    return check
+
+
+def run_concurrently(factory, jobs, call, retries: int = 20) -> list:
+    """每个 job 一个线程、一个会话，同时开始执行 call(db, job)；SQLite 繁忙时回滚重试，返回各 job 的结果或异常"""
+    results = [None] * len(jobs)
+    start = threading.Barrier(len(jobs))
+
+    def worker(index, job):
+        with factory() as db:
+            start.wait()
+            for _ in range(retries):
+                try:
+                    results[index] = call(db, job)
+                    return
+                except OperationalError:
+                    db.rollback()
+                except Exception as e:
+                    db.rollback()
+                    results[index] = e
+                    return
+            results[index] = RuntimeError("数据库持续繁忙")
+
+    threads = [threading.Thread(target=worker, args=(i, job)) for i, job in enumerate(jobs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+@pytest.fixture
+def concurrently(factory):
+    return lambda jobs, call: run_concurrently(factory, jobs, call)
@@ -0,0 +1,80 @@
+"""批量受理（services.admission.admit_batch）：一个事务逐笔 SAVEPOINT，失败只回滚该笔，与直接挂号并发也不超卖"""
+from datetime import date
+
+from sqlalchemy import func, select
+
+import models
+from backend.services import admission, booking
+
+
+def _tickets(clinic, schedule_id: int, patient_ids) -> list:
+    return [
+        admission.Ticket(id=str(i), patient_id=patient_id, doctor_id=clinic.doctor_id, schedule_id=schedule_id,
+                         day=date.today(), seq=i)
+        for i, patient_id in enumerate(patient_ids)
+    ]
+
+
+def _booked(db, schedule_id: int) -> int:
+    db.rollback()
+    return db.scalar(select(models.DoctorSchedule.booked_count).where(models.DoctorSchedule.id == schedule_id))
+
+
+def test_batch_admits_up_to_capacity(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=3)
+    patients = clinic.patient_ids[:6]
+    tickets = _tickets(clinic, schedule_id, [*patients, patients[0]])
+    admission.AdmissionController(daily_cap=0).admit_batch(db, tickets)
+
+    booked = [t for t in tickets if t.status == "booked"]
+    rejected = [t for t in tickets if t.status == "rejected"]
+    assert [t.created for t in booked] == [True, True, True, False]
+    assert booked[-1].appointment_id == booked[0].appointment_id
+    assert len(rejected) == 3 and all(t.reason == booking.FULL for t in rejected)
+    assert _booked(db, schedule_id) == 3
+    assert drift() == []
+
+
+def test_failed_ticket_rolls_back_only_its_savepoint(db, clinic, make_schedule, drift):
+    # 排班计数先占上、日聚合再失败：该笔的排班计数必须随 SAVEPOINT 一起回滚
+    schedule_id = make_schedule(capacity=5, day_capacity=2)
+    tickets = _tickets(clinic, schedule_id, clinic.patient_ids[:4])
+    admission.AdmissionController(daily_cap=0).admit_batch(db, tickets)
+
+    assert [t.status for t in tickets] == ["booked", "booked", "rejected", "rejected"]
+    assert {t.reason for t in tickets[2:]} == {booking.DAY_FULL}
+    assert _booked(db, schedule_id) == 2
+    assert drift() == []
+
+
+def test_daily_cap_skips_patient_and_continues(db, clinic, make_schedule, drift):
+    first = make_schedule(capacity=5)
+    second = make_schedule(capacity=5, hour=10)
+    booking.book(db, clinic.patient_ids[0], clinic.doctor_id, first)
+    tickets = _tickets(clinic, second, clinic.patient_ids[:3])
+    admission.AdmissionController(daily_cap=1).admit_batch(db, tickets)
+
+    assert [t.status for t in tickets] == ["rejected", "booked", "booked"]
+    assert tickets[0].reason == booking.DAILY_CAP
+    assert _booked(db, second) == 2
+    assert drift() == []
+
+
+def test_batch_and_direct_bookings_never_oversell(db, clinic, make_schedule, concurrently, drift):
+    schedule_id = make_schedule(capacity=5)
+    tickets = _tickets(clinic, schedule_id, clinic.patient_ids[:8])
+    direct = clinic.patient_ids[8:14]
+
+    def run(session, job):
+        if job == "batch":
+            return admission.AdmissionController(daily_cap=0).admit_batch(session, tickets)
+        return booking.book(session, job, clinic.doctor_id, schedule_id)
+
+    concurrently(["batch", *direct], run)
+    A = models.Appointment
+    db.rollback()
+    active = db.scalar(select(func.count(A.id)).where(
+        A.schedule_id == schedule_id, A.status != models.AppointmentStatus.cancelled,
+    ))
+    assert active == _booked(db, schedule_id) == 5
+    assert drift() == []
@@ -0,0 +1,55 @@
+"""挂号接口（POST /appointments）：排队受理开启时经 HTTP 挂号，批事务在另一个会话提交后仍返回预约"""
+from sqlalchemy import func, select
+
+import models
+from backend.services import admission
+
+
+def _book(api, clinic, schedule_id: int, patient_id: int):
+    return api.post("/appointments", json={
+        "patient_id": patient_id, "doctor_id": clinic.doctor_id, "schedule_id": schedule_id,
+    })
+
+
+def test_booking_through_admission_returns_appointment(api, db, clinic, make_schedule, drift, monkeypatch):
+    monkeypatch.setattr(admission, "ENABLED", True)
+    schedule_id = make_schedule(capacity=1)
+    response = _book(api, clinic, schedule_id, clinic.patient_ids[0])
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert (body["patient_id"], body["schedule_id"]) == (clinic.patient_ids[0], schedule_id)
+
+    again = _book(api, clinic, schedule_id, clinic.patient_ids[0])
+    assert again.status_code == 200 and again.json()["id"] == body["id"]
+    full = _book(api, clinic, schedule_id, clinic.patient_ids[1])
+    assert full.status_code == 400
+
+    A = models.Appointment
+    db.rollback()
+    assert db.scalar(select(func.count(A.id)).where(A.schedule_id == schedule_id)) == 1
+    assert drift() == []
+
+
+def test_booked_but_not_yet_visible_returns_ticket(api, clinic, make_schedule, monkeypatch):
+    monkeypatch.setattr(admission, "ENABLED", True)
+    schedule_id = make_schedule(capacity=5)
+
+    def admit_batch(db, tickets):
+        # 模拟本连接暂时读不到批事务里的预约
+        for t in tickets:
+            t.status, t.appointment_id, t.created = "booked", 10 ** 9, True
+
+    monkeypatch.setattr(admission.controller, "admit_batch", admit_batch)
+    response = _book(api, clinic, schedule_id, clinic.patient_ids[0])
+    assert response.status_code == 202
+    ticket = response.json()
+    assert (ticket["status"], ticket["appointment_id"]) == ("booked", 10 ** 9)
+    assert api.get(f"/appointments/tickets/{ticket['ticket_id']}").json()["status"] == "booked"
+
+
+def test_booking_without_admission(api, clinic, make_schedule, drift, monkeypatch):
+    monkeypatch.setattr(admission, "ENABLED", False)
+    schedule_id = make_schedule(capacity=1)
+    assert _book(api, clinic, schedule_id, clinic.patient_ids[0]).status_code == 200
+    assert _book(api, clinic, schedule_id, clinic.patient_ids[1]).status_code == 400
+    assert drift() == []
@@ -0,0 +1,127 @@
+"""挂号占号/退号（services.booking）：条件 UPDATE 不超卖、重复提交幂等、退号只回补一次"""
+from datetime import time
+
+import pytest
+from sqlalchemy import func, select
+
+import models
+from backend.services import booking
+
+
+def _active(db, schedule_id: int) -> int:
+    A = models.Appointment
+    return db.scalar(select(func.count(A.id)).where(
+        A.schedule_id == schedule_id, A.status != models.AppointmentStatus.cancelled,
+    ))
+
+
+def _counts(db, schedule_id: int):
+    db.rollback()
+    S = models.DoctorSchedule
+    return db.execute(select(S.booked_count, S.held_count).where(S.id == schedule_id)).one()
+
+
+def test_concurrent_bookings_never_oversell(db, clinic, make_schedule, concurrently, drift):
+    schedule_id = make_schedule(capacity=5)
+    results = concurrently(
+        clinic.patient_ids[:12],
+        lambda s, patient_id: booking.book(s, patient_id, clinic.doctor_id, schedule_id),
+    )
+    booked = [r for r in results if isinstance(r, tuple)]
+    rejected = [r for r in results if isinstance(r, booking.BookingError)]
+    assert len(booked) == 5 and len(rejected) == 7
+    assert all(e.reason == booking.FULL for e in rejected)
+    assert _counts(db, schedule_id) == (5, 0)
+    assert _active(db, schedule_id) == 5
+    assert drift() == []
+
+
+def test_concurrent_duplicate_submissions_book_once(db, clinic, make_schedule, concurrently, drift):
+    schedule_id = make_schedule(capacity=5)
+    patient_id = clinic.patient_ids[0]
+    results = concurrently(range(6), lambda s, _: booking.book(s, patient_id, clinic.doctor_id, schedule_id))
+    assert len({appt.id for appt, _ in results}) == 1
+    assert sum(created for _, created in results) == 1
+    assert _counts(db, schedule_id) == (1, 0)
+    assert drift() == []
+
+
+def test_cancel_releases_slot_once(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=1)
+    appt, _ = booking.book(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    assert booking.cancel(db, appt.id) is True
+    assert booking.cancel(db, appt.id) is False
+    assert _counts(db, schedule_id) == (0, 0)
+    booking.book(db, clinic.patient_ids[1], clinic.doctor_id, schedule_id)
+    assert _counts(db, schedule_id) == (1, 0)
+    assert drift() == []
+
+
+def test_concurrent_cancels_release_once(db, clinic, make_schedule, concurrently, drift):
+    schedule_id = make_schedule(capacity=3)
+    appt, _ = booking.book(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    booking.book(db, clinic.patient_ids[1], clinic.doctor_id, schedule_id)
+    results = concurrently(range(6), lambda s, _: booking.cancel(s, appt.id))
+    assert results.count(True) == 1
+    assert _counts(db, schedule_id) == (1, 0)
+    assert drift() == []
+
+
+def test_day_capacity_is_shared_by_schedules(db, clinic, make_schedule, drift):
+    first = make_schedule(capacity=5, day_capacity=1)
+    second = make_schedule(capacity=5, hour=10, day_capacity=1)
+    booking.book(db, clinic.patient_ids[0], clinic.doctor_id, first)
+    with pytest.raises(booking.BookingError) as e:
+        booking.book(db, clinic.patient_ids[1], clinic.doctor_id, second)
+    assert e.value.reason == booking.DAY_FULL
+    assert _counts(db, second) == (0, 0)
+    assert drift() == []
+
+
+def test_missing_day_row_is_created_once(db, clinic, make_schedule, concurrently, drift):
+    first = make_schedule(capacity=5)
+    second = make_schedule(capacity=5, hour=14)
+    db.query(models.DoctorDaySchedule).delete()
+    db.commit()
+    jobs = [(patient_id, first if i % 2 else second) for i, patient_id in enumerate(clinic.patient_ids[:8])]
+    results = concurrently(jobs, lambda s, job: booking.book(s, job[0], clinic.doctor_id, job[1]))
+    assert all(isinstance(r, tuple) for r in results)
+    D = models.DoctorDaySchedule
+    db.rollback()
+    assert db.execute(select(D.am_booked_count, D.pm_booked_count)).all() == [(4, 4)]
+    assert drift() == []
+
+
+def test_daily_cap_rejects_extra_bookings(db, clinic, make_schedule):
+    schedules = [make_schedule(capacity=5, hour=hour) for hour in (9, 10, 11)]
+    patient_id = clinic.patient_ids[0]
+    for schedule_id in schedules[:2]:
+        booking.book(db, patient_id, clinic.doctor_id, schedule_id, daily_cap=2)
+    with pytest.raises(booking.BookingError) as e:
+        booking.book(db, patient_id, clinic.doctor_id, schedules[2], daily_cap=2)
+    assert e.value.reason == booking.DAILY_CAP
+    assert _counts(db, schedules[2]) == (0, 0)
+
+
+def test_restoring_cancelled_appointment_retakes_slot(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=1)
+    appt, _ = booking.book(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    booking.cancel(db, appt.id)
+    booking.book(db, clinic.patient_ids[1], clinic.doctor_id, schedule_id)
+    with pytest.raises(booking.BookingError) as e:
+        booking.set_status(db, appt.id, models.AppointmentStatus.confirmed)
+    assert e.value.reason == booking.FULL
+    assert _counts(db, schedule_id) == (1, 0)
+    assert drift() == []
+
+
+def test_morning_and_afternoon_counted_separately(db, clinic, make_schedule):
+    assert booking.is_morning(time(9)) and not booking.is_morning(time(13))
+    am = make_schedule(capacity=2, day_capacity=2)
+    pm = make_schedule(capacity=2, hour=14, day_capacity=2)
+    booking.book(db, clinic.patient_ids[0], clinic.doctor_id, am)
+    booking.book(db, clinic.patient_ids[1], clinic.doctor_id, pm)
+    booking.book(db, clinic.patient_ids[2], clinic.doctor_id, pm)
+    D = models.DoctorDaySchedule
+    db.rollback()
+    assert db.execute(select(D.am_booked_count, D.pm_booked_count)).one() == (1, 2)
@@ -0,0 +1,109 @@
+"""计数对账（services.counter_reconciler）：触发器记下变化的 (医生, 日期)，只重算这些日期，修复绕过挂号路径造成的漂移"""
+from datetime import timedelta
+
+from sqlalchemy import select, update
+
+import models
+from backend.services import booking, counter_reconciler, slot_holds
+from tests.conftest import DAY
+
+
+def _counts(db, schedule_id: int):
+    db.rollback()
+    S = models.DoctorSchedule
+    return db.execute(select(S.booked_count, S.held_count).where(S.id == schedule_id)).one()
+
+
+def _day(db):
+    db.rollback()
+    D = models.DoctorDaySchedule
+    return db.execute(select(D.am_booked_count, D.pm_booked_count).where(D.date == DAY)).one()
+
+
+def test_triggers_mark_changed_days(db, clinic, make_schedule):
+    schedule_id = make_schedule(capacity=5)
+    assert counter_reconciler.pending(db) == 0
+    appt, _ = booking.book(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    slot_holds.hold(db, clinic.patient_ids[1], clinic.doctor_id, schedule_id)
+    booking.cancel(db, appt.id)
+    assert counter_reconciler.pending(db) == 1
+
+    report = counter_reconciler.reconcile_all(db)
+    assert (report["checked"], report["repaired"], report["pending"]) == (1, 0, 0)
+    assert report["schedules"] == report["days"] == []
+
+
+def test_only_changed_days_are_checked(db, clinic, make_schedule):
+    today = make_schedule(capacity=5)
+    make_schedule(capacity=5, day=DAY + timedelta(days=1))
+    booking.book(db, clinic.patient_ids[0], clinic.doctor_id, today)
+    assert counter_reconciler.reconcile(db, repair=False)["checked"] == 1
+    assert counter_reconciler.mark_all(db) == 2
+    assert counter_reconciler.reconcile(db, repair=False)["checked"] == 2
+
+
+def test_bulk_delete_drift_is_reported_then_repaired(db, clinic, make_schedule, drift):
+    am = make_schedule(capacity=5)
+    pm = make_schedule(capacity=5, hour=14)
+    for patient_id in clinic.patient_ids[:3]:
+        booking.book(db, patient_id, clinic.doctor_id, am)
+    booking.book(db, clinic.patient_ids[3], clinic.doctor_id, pm)
+    # 绕过退号路径整批删除，计数不回补
+    db.query(models.Appointment).filter(models.Appointment.patient_id.in_(clinic.patient_ids[:2])).delete()
+    db.commit()
+    assert counter_reconciler.pending(db) == 1
+
+    report = counter_reconciler.reconcile(db, repair=False)
+    assert [(s["schedule_id"], s["booked_count"]) for s in report["schedules"]] == [(am, [3, 1])]
+    assert report["days"][0]["am_booked_count"] == [3, 1]
+    assert report["repaired"] == 0 and report["pending"] == 1
+    assert _counts(db, am) == (3, 0)
+
+    report = counter_reconciler.reconcile_all(db)
+    assert report["repaired"] == 2 and report["pending"] == 0
+    assert _counts(db, am) == (1, 0) and _counts(db, pm) == (1, 0)
+    assert _day(db) == (1, 1)
+    assert drift() == []
+
+
+def test_manual_counter_change_is_repaired_after_mark_all(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=5)
+    booking.book(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    slot_holds.hold(db, clinic.patient_ids[1], clinic.doctor_id, schedule_id)
+    counter_reconciler.reconcile_all(db)
+    S = models.DoctorSchedule
+    db.execute(update(S).where(S.id == schedule_id).values(booked_count=4, held_count=0))
+    db.commit()
+    # 直接改计数不经过触发器，只有全量标记后才会被核对到
+    assert counter_reconciler.pending(db) == 0
+    counter_reconciler.mark_all(db)
+    report = counter_reconciler.reconcile_all(db)
+    assert report["schedules"][0]["held_count"] == [0, 1]
+    assert _counts(db, schedule_id) == (1, 1)
+    assert drift() == []
+
+
+def test_missing_day_row_is_rebuilt(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=5, hour=14)
+    booking.book(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    db.query(models.DoctorDaySchedule).delete()
+    db.commit()
+    counter_reconciler.mark_all(db)
+    assert counter_reconciler.reconcile_all(db)["days"] == [
+        {"doctor_id": clinic.doctor_id, "date": DAY.isoformat(), "am_booked_count": [0, 0], "pm_booked_count": [0, 1]},
+    ]
+    assert _day(db) == (0, 1)
+    assert drift() == []
+
+
+def test_reconcile_alongside_bookings_keeps_counters(db, clinic, make_schedule, concurrently, drift):
+    schedule_id = make_schedule(capacity=6)
+
+    def run(session, job):
+        if job == "reconcile":
+            return counter_reconciler.reconcile_all(session)
+        return booking.book(session, job, clinic.doctor_id, schedule_id)
+
+    concurrently(["reconcile", *clinic.patient_ids[:10], "reconcile"], run)
+    assert _counts(db, schedule_id) == (6, 0)
+    assert drift() == []
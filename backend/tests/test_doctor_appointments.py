@@ -0,0 +1,57 @@
+"""医生端预约列表的条件 GET（GET /appointments/doctor/{id}）：ETag 未变时 304，挂号/退号/改状态后 ETag 变化，旧 ETag 拿到完整响应"""
+from backend.core.security import create_access_token
+from backend.services import admission, booking
+
+
+def _auth(user_id: int, role: str) -> dict:
+    return {"Authorization": f"Bearer {create_access_token(user_id, role)}"}
+
+
+def _list(api, clinic, etag: str = None, **params):
+    headers = {"If-None-Match": etag} if etag else {}
+    return api.get(f"/appointments/doctor/{clinic.doctor_id}", headers=headers, params=params)
+
+
+def test_matching_etag_is_not_modified(api, db, clinic, make_schedule):
+    schedule_id = make_schedule(capacity=5)
+    booking.book(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    first = _list(api, clinic)
+    assert first.status_code == 200 and len(first.json()) == 1
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "private, no-cache"
+
+    again = _list(api, clinic, etag)
+    assert again.status_code == 304 and again.content == b""
+    assert again.headers["ETag"] == etag
+    # 分页参数不同的是另一份响应
+    assert _list(api, clinic, etag, limit=1).status_code == 200
+
+
+def test_etag_changes_after_booking_cancel_and_status_change(api, db, clinic, make_schedule, monkeypatch):
+    monkeypatch.setattr(admission, "ENABLED", False)
+    schedule_id = make_schedule(capacity=5)
+    patient_id = clinic.patient_ids[0]
+    etags = [_list(api, clinic).headers["ETag"]]
+
+    def changed():
+        # 上一个 ETag 已过期：返回 200 和完整响应体，而不是 304
+        response = _list(api, clinic, etags[-1])
+        assert response.status_code == 200
+        assert response.headers["ETag"] not in etags
+        etags.append(response.headers["ETag"])
+        return response.json()
+
+    booked = api.post("/appointments", json={
+        "patient_id": patient_id, "doctor_id": clinic.doctor_id, "schedule_id": schedule_id,
+    }).json()
+    assert [row["id"] for row in changed()] == [booked["id"]]
+
+    response = api.post(f"/appointments/{booked['id']}/status", json={"status": "confirmed"},
+                        headers=_auth(clinic.doctor_id, "doctor"))
+    assert response.status_code == 200, response.text
+    assert [row["status"] for row in changed()] == ["confirmed"]
+
+    response = api.post(f"/appointments/{booked['id']}/cancel", headers=_auth(patient_id, "user"))
+    assert response.status_code == 200, response.text
+    assert [row["status"] for row in changed()] == ["cancelled"]
+    assert _list(api, clinic, etags[-1]).status_code == 304
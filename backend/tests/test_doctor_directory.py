@@ -0,0 +1,38 @@
+"""医生名录（services.doctor_directory）：异步路由冷启动并发重载不卡死事件循环，医生资料提交后失效"""
+import asyncio
+
+import pytest
+
+import models
+from backend.services import doctor_directory
+
+
+@pytest.fixture
+def directory(factory):
+    return doctor_directory.DoctorDirectory(factory)
+
+
+def _gather(directory, n: int):
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(*(directory.entries_async() for _ in range(n))), 10)
+
+    return asyncio.run(run())
+
+
+def test_concurrent_cold_loads_do_not_block_event_loop(directory, clinic):
+    results = _gather(directory, 8)
+    assert all([e.id for e in entries] == [clinic.doctor_id] for entries in results)
+
+
+def test_profile_commit_invalidates_cache(db, directory, clinic, monkeypatch):
+    # Session 事件失效的是模块级名录实例
+    monkeypatch.setattr(doctor_directory, "directory", directory)
+    (entries,) = _gather(directory, 1)
+    assert entries[0].department is None and not entries[0].has_profile
+
+    db.add(models.DoctorProfile(user_id=clinic.doctor_id, name="张医生", department="内科", title="主任医师",
+                                license_number="L001", hospital="一院"))
+    db.commit()
+    (entries,) = _gather(directory, 1)
+    assert (entries[0].department, entries[0].has_profile) == ("内科", True)
+    assert doctor_directory.public_view(entries, department="内科")[0]["name"] == "张医生"
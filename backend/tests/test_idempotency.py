@@ -0,0 +1,114 @@
+"""写接口幂等键（core.idempotency）：同键重试回放、处理中的重复返回 409、同键不同请求返回 422、5xx 后释放键，键按登录用户隔离"""
+import json
+from datetime import datetime, timedelta
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import func, select
+
+import models
+from backend.core import idempotency
+from backend.core.security import create_access_token
+from backend.services import admission
+
+K = models.IdempotencyKey
+
+
+def _auth(user_id: int, role: str = "user") -> dict:
+    return {"Authorization": f"Bearer {create_access_token(user_id, role)}"}
+
+
+def _book(api, clinic, schedule_id: int, patient_id: int, key: str):
+    headers = {**_auth(patient_id), idempotency.HEADER: key}
+    return api.post("/appointments", headers=headers, json={
+        "patient_id": patient_id, "doctor_id": clinic.doctor_id, "schedule_id": schedule_id,
+    })
+
+
+def _appointments(db, schedule_id: int) -> int:
+    db.rollback()
+    A = models.Appointment
+    return db.scalar(select(func.count(A.id)).where(A.schedule_id == schedule_id))
+
+
+def test_retry_replays_stored_response(api, db, clinic, make_schedule, drift, monkeypatch):
+    monkeypatch.setattr(admission, "ENABLED", False)
+    schedule_id = make_schedule(capacity=5)
+    first = _book(api, clinic, schedule_id, clinic.patient_ids[0], "k-1")
+    assert first.status_code == 200, first.text
+    assert idempotency.REPLAYED_HEADER not in first.headers
+
+    again = _book(api, clinic, schedule_id, clinic.patient_ids[0], "k-1")
+    assert again.status_code == 200 and again.headers[idempotency.REPLAYED_HEADER] == "true"
+    assert again.json() == first.json()
+    assert _appointments(db, schedule_id) == 1
+    assert drift() == []
+
+
+def test_duplicate_in_flight_elsewhere_is_conflict(api, db, clinic, make_schedule, monkeypatch):
+    monkeypatch.setattr(admission, "ENABLED", False)
+    schedule_id = make_schedule(capacity=5)
+    patient_id = clinic.patient_ids[0]
+    body = json.dumps({"patient_id": patient_id, "doctor_id": clinic.doctor_id, "schedule_id": schedule_id}).encode()
+    # 另一个进程已用同一个键占住同一个请求、尚未完成
+    db.add(K(key_hash=idempotency.scoped_key(f"{patient_id}:user", "k-1"),
+             fingerprint=idempotency._sha256("POST", "/appointments", "", body),
+             expires_at=datetime.now() + timedelta(seconds=60)))
+    db.commit()
+    headers = {**_auth(patient_id), idempotency.HEADER: "k-1", "Content-Type": "application/json"}
+    response = api.post("/appointments", headers=headers, content=body)
+    assert response.status_code == 409 and response.headers["Retry-After"] == "1"
+    assert _appointments(db, schedule_id) == 0
+
+
+def test_same_key_for_different_request_is_rejected(api, db, clinic, make_schedule, monkeypatch):
+    monkeypatch.setattr(admission, "ENABLED", False)
+    first, second = make_schedule(capacity=5), make_schedule(capacity=5, hour=14)
+    assert _book(api, clinic, first, clinic.patient_ids[0], "k-1").status_code == 200
+    response = _book(api, clinic, second, clinic.patient_ids[0], "k-1")
+    assert response.status_code == 422
+    assert _appointments(db, second) == 0
+
+
+def test_key_is_released_after_server_error(api, db, clinic):
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            return JSONResponse(status_code=503, content={"detail": "暂时不可用"})
+        return {"calls": len(calls)}
+
+    api.app.add_api_route("/flaky", flaky, methods=["POST"])
+    headers = {**_auth(clinic.patient_ids[0]), idempotency.HEADER: "k-1"}
+    assert api.post("/flaky", headers=headers).status_code == 503
+    db.rollback()
+    assert db.scalar(select(func.count(K.id))) == 0
+
+    retry = api.post("/flaky", headers=headers)
+    assert retry.status_code == 200 and retry.json() == {"calls": 2}
+    replay = api.post("/flaky", headers=headers)
+    assert replay.headers[idempotency.REPLAYED_HEADER] == "true" and replay.json() == {"calls": 2}
+    assert len(calls) == 2
+
+
+def test_keys_are_scoped_per_user(api, db, clinic, make_schedule, monkeypatch):
+    monkeypatch.setattr(admission, "ENABLED", False)
+    schedule_id = make_schedule(capacity=5)
+    mine = _book(api, clinic, schedule_id, clinic.patient_ids[0], "k-1")
+    theirs = _book(api, clinic, schedule_id, clinic.patient_ids[1], "k-1")
+    assert mine.status_code == theirs.status_code == 200
+    assert idempotency.REPLAYED_HEADER not in theirs.headers
+    assert mine.json()["id"] != theirs.json()["id"]
+    assert _appointments(db, schedule_id) == 2
+
+
+def test_key_without_valid_token_is_rejected(api, db, clinic, make_schedule, monkeypatch):
+    monkeypatch.setattr(admission, "ENABLED", False)
+    schedule_id = make_schedule(capacity=5)
+    body = {"patient_id": clinic.patient_ids[0], "doctor_id": clinic.doctor_id, "schedule_id": schedule_id}
+    for headers in ({}, {"Authorization": "Bearer not-a-token"}):
+        response = api.post("/appointments", headers={**headers, idempotency.HEADER: "k-1"}, json=body)
+        assert response.status_code == 401
+    assert _appointments(db, schedule_id) == 0
+    # 不带幂等键的匿名请求照常处理
+    assert api.post("/appointments", json=body).status_code == 200
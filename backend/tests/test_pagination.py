@@ -0,0 +1,90 @@
+"""游标分页（core.pagination）：游标编解码、排序键相同时按 id 续页、末页边界、不传 limit 时默认分页"""
+from datetime import date, datetime, time
+
+import pytest
+from fastapi import HTTPException, Response
+from sqlalchemy import select
+
+import models
+from core.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, Keyset, PageParams
+
+U = models.User
+USERS = Keyset(U.created_at, U.id)
+
+
+def _walk(db, keyset: Keyset, limit: int) -> list:
+    """按游标逐页取完，返回每页的 id 列表"""
+    pages, cursor = [], None
+    while True:
+        page, response = PageParams.of(cursor, limit), Response()
+        rows = keyset.page(db.scalars(keyset.apply(select(U), page)).all(), page, response)
+        pages.append([u.id for u in rows])
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            return pages
+
+
+def test_cursor_round_trip():
+    S = models.DoctorSchedule
+    keyset = Keyset(S.date, S.start_time, S.id)
+    row = S(date=date(2026, 3, 1), start_time=time(9, 30), id=42)
+    cursor = keyset.encode(row)
+    assert "=" not in cursor
+    assert [b.value for b in keyset.decode(cursor)] == [date(2026, 3, 1), time(9, 30), 42]
+
+    created = U(created_at=datetime(2026, 3, 1, 8, 0, 0, 123), id=7)
+    assert [b.value for b in USERS.decode(USERS.encode(created))] == ["2026-03-01 08:00:00.000123", 7]
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "WzFd", "W251bGwsMV0", "eyJhIjoxfQ"])
+def test_invalid_cursor_is_rejected(cursor):
+    # WzFd = [1]（列数不符）；W251bGwsMV0 = [null,1]；eyJhIjoxfQ = {"a":1}
+    with pytest.raises(HTTPException) as e:
+        USERS.decode(cursor)
+    assert e.value.status_code == 400
+
+
+def test_limit_is_clamped():
+    assert PageParams.of("", 10 ** 6) == PageParams(cursor=None, limit=MAX_PAGE_SIZE)
+    assert PageParams.of(None, 0).limit == 1
+
+
+def test_equal_sort_keys_continue_by_id(db, clinic):
+    # 同一次提交建的用户 created_at 相同，只能靠 id 区分先后
+    ids = db.scalars(select(U.id).order_by(U.created_at.desc(), U.id.desc())).all()
+    assert len(set(db.scalars(select(U.created_at)).all())) < len(ids)
+    pages = _walk(db, USERS, 4)
+    assert [i for page in pages for i in page] == ids
+    assert [len(page) for page in pages] == [4] * 5 + [1]
+
+
+def test_last_page_boundary(db, clinic):
+    total = len(clinic.patient_ids) + 1
+    assert _walk(db, USERS, total) == [db.scalars(select(U.id).order_by(U.created_at.desc(), U.id.desc())).all()]
+    pages = _walk(db, USERS, total - 1)
+    assert [len(page) for page in pages] == [total - 1, 1]
+
+
+def test_list_endpoint_pages_by_default(api, db, clinic, make_schedule):
+    schedules = [make_schedule(capacity=30, hour=hour) for hour in range(8, 19)]
+    db.add_all([
+        models.Appointment(patient_id=p, doctor_id=clinic.doctor_id, schedule_id=s,
+                           status=models.AppointmentStatus.scheduled)
+        for s in schedules for p in clinic.patient_ids
+    ])
+    db.commit()
+    total = len(schedules) * len(clinic.patient_ids)
+    assert total > DEFAULT_PAGE_SIZE
+
+    url = f"/appointments/doctor/{clinic.doctor_id}"
+    first = api.get(url)
+    assert len(first.json()) == DEFAULT_PAGE_SIZE
+    # 前端 getAll 的做法：按 X-Next-Cursor 逐页取完
+    ids, response = [], first
+    while True:
+        ids += [row["id"] for row in response.json()]
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            break
+        response = api.get(url, params={"cursor": cursor})
+    assert len(ids) == len(set(ids)) == total
@@ -0,0 +1,67 @@
+"""按周模板生成排班（services.schedule_materializer）：已有的空日聚合行补上模板的时段容量，不覆盖已有容量"""
+import pytest
+from sqlalchemy import select
+
+import models
+from backend.services import booking, schedule_materializer
+from tests.conftest import DAY
+
+
+def _template(db, clinic, am: int, pm: int):
+    db.add(models.DoctorScheduleTemplate(doctor_id=clinic.doctor_id, weekday=DAY.weekday(),
+                                         am_capacity=am, pm_capacity=pm))
+    db.commit()
+
+
+def _day(db):
+    db.rollback()
+    D = models.DoctorDaySchedule
+    return db.execute(select(D.am_capacity, D.pm_capacity).where(D.date == DAY)).all()
+
+
+def test_new_day_rows_take_template_capacity(db, clinic):
+    _template(db, clinic, am=3, pm=4)
+    result = schedule_materializer.materialize(db, days=1, start=DAY)
+    assert (result["schedules"], result["day_schedules"]) == (2, 1)
+    assert _day(db) == [(3, 4)]
+
+
+def test_existing_empty_day_row_gets_template_capacity(db, clinic, make_schedule):
+    # 手工建的下午排班上挂过号：日聚合行已存在、容量 0（不限）
+    manual = make_schedule(capacity=10, hour=14)
+    booking.book(db, clinic.patient_ids[0], clinic.doctor_id, manual)
+    assert _day(db) == [(0, 0)]
+
+    _template(db, clinic, am=3, pm=4)
+    result = schedule_materializer.materialize(db, days=1, start=DAY)
+    # 上午按模板生成并补上容量；下午已有手工排班，不生成也不改容量
+    assert (result["schedules"], result["day_schedules"], result["day_capacities"]) == (1, 0, 1)
+    assert _day(db) == [(3, 0)]
+
+    again = schedule_materializer.materialize(db, days=1, start=DAY)
+    assert again == {"schedules": 0, "day_schedules": 0, "day_capacities": 0}
+
+
+def test_existing_day_capacity_is_kept(db, clinic, make_schedule):
+    make_schedule(capacity=5, hour=14, day_capacity=2)
+    db.query(models.DoctorDaySchedule).update({"am_capacity": 7})
+    db.commit()
+    _template(db, clinic, am=3, pm=4)
+    schedule_materializer.materialize(db, days=1, start=DAY)
+    assert _day(db) == [(7, 2)]
+
+
+def test_day_capacity_limits_materialized_half(db, clinic, make_schedule):
+    # 排班容量放大到超过时段容量，只有日聚合容量能拦住
+    make_schedule(capacity=10, hour=14)
+    _template(db, clinic, am=2, pm=0)
+    schedule_materializer.materialize(db, days=1, start=DAY)
+    S = models.DoctorSchedule
+    morning = db.scalar(select(S.id).where(S.date == DAY, S.start_time == schedule_materializer.AM_SLOT[0]))
+    db.query(S).filter(S.id == morning).update({"capacity": 5})
+    db.commit()
+    for patient_id in clinic.patient_ids[:2]:
+        booking.book(db, patient_id, clinic.doctor_id, morning)
+    with pytest.raises(booking.BookingError) as e:
+        booking.book(db, clinic.patient_ids[2], clinic.doctor_id, morning)
+    assert e.value.reason == booking.DAY_FULL
@@ -0,0 +1,162 @@
+"""两段式暂占号（services.slot_holds）：暂占计入容量、确认转预约、放弃与过期清理回补计数并转候补"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select, update
+
+import models
+from backend.services import booking, slot_holds, striped_counters, waitlist
+
+
+def _counts(db, schedule_id: int):
+    db.rollback()
+    S = models.DoctorSchedule
+    return db.execute(select(S.booked_count, S.held_count).where(S.id == schedule_id)).one()
+
+
+def _hold_status(db, hold_id: int):
+    db.rollback()
+    return db.scalar(select(models.SlotHold.status).where(models.SlotHold.id == hold_id))
+
+
+def test_holds_count_against_capacity(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=2)
+    for patient_id in clinic.patient_ids[:2]:
+        slot_holds.hold(db, patient_id, clinic.doctor_id, schedule_id)
+    with pytest.raises(booking.BookingError) as e:
+        booking.book(db, clinic.patient_ids[2], clinic.doctor_id, schedule_id)
+    assert e.value.reason == booking.FULL
+    with pytest.raises(booking.BookingError) as e:
+        slot_holds.hold(db, clinic.patient_ids[3], clinic.doctor_id, schedule_id)
+    assert e.value.reason == booking.FULL
+    assert _counts(db, schedule_id) == (0, 2)
+    assert drift() == []
+
+
+def test_hold_is_idempotent(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=3)
+    first, created = slot_holds.hold(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    again, created_again = slot_holds.hold(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    assert (created, created_again) == (True, False)
+    assert first.id == again.id
+    assert _counts(db, schedule_id) == (0, 1)
+    assert drift() == []
+
+
+def test_confirm_converts_hold_to_booking(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=1)
+    entry, _ = slot_holds.hold(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    appt = slot_holds.confirm(db, entry.id, clinic.patient_ids[0])
+    assert appt.schedule_id == schedule_id
+    assert _hold_status(db, entry.id) == models.HoldStatus.confirmed
+    assert _counts(db, schedule_id) == (1, 0)
+    with pytest.raises(booking.BookingError):
+        slot_holds.confirm(db, entry.id, clinic.patient_ids[0])
+    assert _counts(db, schedule_id) == (1, 0)
+    assert drift() == []
+
+
+def test_confirm_on_striped_schedule(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=3)
+    striped_counters.enable(db, schedule_id, 3)
+    entries = [slot_holds.hold(db, p, clinic.doctor_id, schedule_id)[0] for p in clinic.patient_ids[:2]]
+    for entry in entries:
+        slot_holds.confirm(db, entry.id, entry.patient_id)
+    T = models.ScheduleCounterStripe
+    assert db.execute(select(func.sum(T.booked_count), func.sum(T.held_count))).one() == (2, 0)
+    striped_counters.fold(db)
+    db.commit()
+    assert _counts(db, schedule_id) == (2, 0)
+    assert drift() == []
+
+
+def test_confirm_without_counted_hold_rolls_back(db, clinic, make_schedule):
+    schedule_id = make_schedule(capacity=2)
+    striped_counters.enable(db, schedule_id, 2)
+    entry, _ = slot_holds.hold(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    # 分片上的暂占数被改丢（例如人工修数），确认时两条路径都转不了
+    db.execute(update(models.ScheduleCounterStripe).values(held_count=0))
+    db.commit()
+    with pytest.raises(booking.BookingError):
+        slot_holds.confirm(db, entry.id, clinic.patient_ids[0])
+    assert _hold_status(db, entry.id) == models.HoldStatus.held
+    assert db.scalar(select(func.count(models.Appointment.id))) == 0
+
+
+def test_release_promotes_waitlist(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=1)
+    entry, _ = slot_holds.hold(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    waiting = waitlist.join(db, clinic.patient_ids[1], clinic.doctor_id, schedule_id)
+    assert slot_holds.release(db, entry.id, clinic.patient_ids[0]) is True
+    assert slot_holds.release(db, entry.id, clinic.patient_ids[0]) is False
+
+    assert _hold_status(db, entry.id) == models.HoldStatus.released
+    assert db.scalar(select(models.AppointmentWaitlist.status).where(models.AppointmentWaitlist.id == waiting.id)) \
+        == models.WaitlistStatus.promoted
+    assert _counts(db, schedule_id) == (1, 0)
+    assert drift() == []
+
+
+def test_sweep_expires_holds_and_restores_counts(db, clinic, make_schedule, drift):
+    am = make_schedule(capacity=2, day_capacity=2)
+    pm = make_schedule(capacity=2, hour=14, day_capacity=2)
+    expired = [slot_holds.hold(db, p, clinic.doctor_id, am, ttl=60)[0] for p in clinic.patient_ids[:2]]
+    expired.append(slot_holds.hold(db, clinic.patient_ids[2], clinic.doctor_id, pm, ttl=60)[0])
+    kept, _ = slot_holds.hold(db, clinic.patient_ids[3], clinic.doctor_id, pm, ttl=3600)
+    waiting = waitlist.join(db, clinic.patient_ids[4], clinic.doctor_id, am)
+
+    assert slot_holds.sweep_batch(db, now=datetime.now() + timedelta(seconds=120)) == 3
+    assert [_hold_status(db, e.id) for e in expired] == [models.HoldStatus.expired] * 3
+    assert _hold_status(db, kept.id) == models.HoldStatus.held
+    assert db.scalar(select(models.AppointmentWaitlist.status).where(models.AppointmentWaitlist.id == waiting.id)) \
+        == models.WaitlistStatus.promoted
+    assert _counts(db, am) == (1, 0)
+    assert _counts(db, pm) == (0, 1)
+    assert drift() == []
+
+
+def test_confirm_after_expiry_fails(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=1)
+    entry, _ = slot_holds.hold(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id, ttl=-1)
+    with pytest.raises(booking.BookingError):
+        slot_holds.confirm(db, entry.id, clinic.patient_ids[0])
+    assert slot_holds.sweep_batch(db) == 1
+    assert _counts(db, schedule_id) == (0, 0)
+    booking.book(db, clinic.patient_ids[1], clinic.doctor_id, schedule_id)
+    assert drift() == []
+
+
+def test_concurrent_holds_never_oversell(db, clinic, make_schedule, concurrently, drift):
+    schedule_id = make_schedule(capacity=4)
+    booking.book(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+
+    def run(session, patient_id):
+        if patient_id % 2:
+            return slot_holds.hold(session, patient_id, clinic.doctor_id, schedule_id)
+        return booking.book(session, patient_id, clinic.doctor_id, schedule_id)
+
+    results = concurrently(clinic.patient_ids[1:13], run)
+    taken = [r for r in results if isinstance(r, tuple)]
+    rejected = [r for r in results if isinstance(r, booking.BookingError)]
+    assert len(taken) == 3 and len(rejected) == 9
+    assert all(e.reason == booking.FULL for e in rejected)
+    booked, held = _counts(db, schedule_id)
+    assert booked + held == 4
+    assert drift() == []
+
+
+def test_sweep_races_with_confirm(db, clinic, make_schedule, concurrently, drift):
+    schedule_id = make_schedule(capacity=5)
+    entries = [slot_holds.hold(db, p, clinic.doctor_id, schedule_id, ttl=2)[0] for p in clinic.patient_ids[:4]]
+    later = datetime.now() + timedelta(seconds=60)
+
+    def run(session, job):
+        if job == "sweep":
+            return slot_holds.sweep_batch(session, now=later)
+        return slot_holds.confirm(session, job.id, job.patient_id)
+
+    results = concurrently(["sweep", *entries], run)
+    confirmed = [r for r in results[1:] if isinstance(r, models.Appointment)]
+    assert results[0] + len(confirmed) == 4
+    assert _counts(db, schedule_id) == (len(confirmed), 0)
+    assert drift() == []
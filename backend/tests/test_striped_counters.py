@@ -0,0 +1,165 @@
+"""热点排班分片计数（services.striped_counters）：分片占号不超卖、不误报满员，汇总/合并后计数与实际一致"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, func, select
+
+import database
+import models
+from backend.services import booking, counter_reconciler, slot_holds, striped_counters
+
+
+def _live(db, schedule_id: int):
+    """各分片实时之和"""
+    db.rollback()
+    S = models.DoctorSchedule
+    return db.execute(
+        select(striped_counters.booked_expr(), striped_counters.held_expr()).where(S.id == schedule_id)
+    ).one()
+
+
+def _stripes(db, schedule_id: int) -> list:
+    T = models.ScheduleCounterStripe
+    return db.execute(
+        select(T.capacity, T.booked_count, T.held_count).where(T.schedule_id == schedule_id).order_by(T.stripe)
+    ).all()
+
+
+def _folded_drift(db, drift) -> list:
+    # 排班行与日聚合上的计数由 fold 定期写回，核对前先汇总一次
+    striped_counters.fold(db)
+    db.commit()
+    return drift()
+
+
+def test_enable_distributes_existing_counts(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=7)
+    booking.book(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    booking.book(db, clinic.patient_ids[1], clinic.doctor_id, schedule_id)
+    slot_holds.hold(db, clinic.patient_ids[2], clinic.doctor_id, schedule_id)
+    assert striped_counters.enable(db, schedule_id, 4) is True
+
+    rows = _stripes(db, schedule_id)
+    assert [r.capacity for r in rows] == [2, 2, 2, 1]
+    assert sum(r.booked_count for r in rows) == 2 and sum(r.held_count for r in rows) == 1
+    assert _live(db, schedule_id) == (2, 1)
+    assert _folded_drift(db, drift) == []
+
+
+def test_enable_refuses_shared_half_day(db, clinic, make_schedule):
+    schedule_id = make_schedule(capacity=5)
+    make_schedule(capacity=5, hour=10)
+    afternoon = make_schedule(capacity=5, hour=14)
+    assert striped_counters.enable(db, schedule_id, 4) is False
+    assert striped_counters.enable(db, afternoon, 1) is False
+    assert striped_counters.enable(db, afternoon, 4) is True
+    assert striped_counters.enable(db, afternoon, 4) is False
+
+
+def test_concurrent_bookings_on_striped_schedule_never_oversell(db, clinic, make_schedule, concurrently, drift):
+    schedule_id = make_schedule(capacity=7, day_capacity=7)
+    striped_counters.enable(db, schedule_id, 4)
+    results = concurrently(
+        clinic.patient_ids[:15],
+        lambda s, patient_id: booking.book(s, patient_id, clinic.doctor_id, schedule_id),
+    )
+    rejected = [r for r in results if isinstance(r, booking.BookingError)]
+    # 分片不均时只要任一分片有余号就能挂上：恰好挂满容量
+    assert len(rejected) == 8 and all(e.reason == booking.FULL for e in rejected)
+    assert _live(db, schedule_id) == (7, 0)
+    assert all(r.booked_count <= r.capacity for r in _stripes(db, schedule_id))
+    assert _folded_drift(db, drift) == []
+
+
+def test_cancel_and_hold_on_striped_schedule(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=2)
+    striped_counters.enable(db, schedule_id, 2)
+    appt, _ = booking.book(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    entry, _ = slot_holds.hold(db, clinic.patient_ids[1], clinic.doctor_id, schedule_id)
+    with pytest.raises(booking.BookingError) as e:
+        booking.book(db, clinic.patient_ids[2], clinic.doctor_id, schedule_id)
+    assert e.value.reason == booking.FULL
+
+    assert booking.cancel(db, appt.id) is True
+    assert _live(db, schedule_id) == (0, 1)
+    slot_holds.confirm(db, entry.id, clinic.patient_ids[1])
+    assert _live(db, schedule_id) == (1, 0)
+    booking.book(db, clinic.patient_ids[2], clinic.doctor_id, schedule_id)
+    assert _live(db, schedule_id) == (2, 0)
+    assert _folded_drift(db, drift) == []
+
+
+def test_sweep_resyncs_striped_schedule(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=4)
+    striped_counters.enable(db, schedule_id, 2)
+    for patient_id in clinic.patient_ids[:3]:
+        slot_holds.hold(db, patient_id, clinic.doctor_id, schedule_id, ttl=60)
+    booking.book(db, clinic.patient_ids[3], clinic.doctor_id, schedule_id)
+    assert slot_holds.sweep_batch(db, now=datetime.now() + timedelta(seconds=120)) == 3
+    assert _live(db, schedule_id) == (1, 0)
+    assert _folded_drift(db, drift) == []
+
+
+def test_disable_folds_back_to_single_row(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=3, hour=14, day_capacity=3)
+    striped_counters.enable(db, schedule_id, 3)
+    for patient_id in clinic.patient_ids[:2]:
+        booking.book(db, patient_id, clinic.doctor_id, schedule_id)
+    assert striped_counters.disable(db, schedule_id) is True
+
+    S = models.DoctorSchedule
+    assert db.execute(select(S.stripes, S.booked_count).where(S.id == schedule_id)).one() == (0, 2)
+    assert db.scalar(select(func.count(models.ScheduleCounterStripe.id))) == 0
+    assert db.scalar(select(models.DoctorDaySchedule.pm_booked_count)) == 2
+    booking.book(db, clinic.patient_ids[2], clinic.doctor_id, schedule_id)
+    with pytest.raises(booking.BookingError):
+        booking.book(db, clinic.patient_ids[3], clinic.doctor_id, schedule_id)
+    assert drift() == []
+
+
+def test_reconciler_resyncs_striped_drift(db, clinic, make_schedule, drift):
+    schedule_id = make_schedule(capacity=6)
+    striped_counters.enable(db, schedule_id, 3)
+    for patient_id in clinic.patient_ids[:4]:
+        booking.book(db, patient_id, clinic.doctor_id, schedule_id)
+    db.query(models.Appointment).filter(models.Appointment.patient_id.in_(clinic.patient_ids[:3])).delete()
+    db.commit()
+
+    report = counter_reconciler.reconcile_all(db)
+    assert [s["booked_count"] for s in report["schedules"]] == [[4, 1]]
+    assert _live(db, schedule_id) == (1, 0)
+    assert _folded_drift(db, drift) == []
+
+
+def test_enable_refuses_tighter_day_capacity(db, clinic, make_schedule):
+    limited = make_schedule(capacity=5, day_capacity=3)
+    assert striped_counters.enable(db, limited, 2) is False
+    roomy = make_schedule(capacity=5, hour=14, day_capacity=5)
+    assert striped_counters.enable(db, roomy, 2) is True
+
+
+def test_run_once_without_striped_schedules_does_not_write(factory, clinic, make_schedule, monkeypatch):
+    monkeypatch.setattr(database, "SessionLocal", factory)
+    make_schedule(capacity=5)
+    statements = []
+    event.listen(factory.kw["bind"], "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    assert striped_counters.run_once() == {"enabled": 0, "folded": 0, "disabled": 0}
+    assert statements and not [s for s in statements if not s.lstrip().upper().startswith("SELECT")]
+
+
+def test_run_once_folds_back_when_day_capacity_tightens(db, factory, clinic, make_schedule, drift, monkeypatch):
+    monkeypatch.setattr(database, "SessionLocal", factory)
+    schedule_id = make_schedule(capacity=5, day_capacity=5)
+    striped_counters.enable(db, schedule_id, 2)
+    booking.book(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    assert striped_counters.run_once()["disabled"] == 0
+
+    db.query(models.DoctorDaySchedule).update({"am_capacity": 2})
+    db.commit()
+    assert striped_counters.run_once()["disabled"] == 1
+    booking.book(db, clinic.patient_ids[1], clinic.doctor_id, schedule_id)
+    with pytest.raises(booking.BookingError) as e:
+        booking.book(db, clinic.patient_ids[2], clinic.doctor_id, schedule_id)
+    assert e.value.reason == booking.DAY_FULL
+    assert drift() == []
@@ -0,0 +1,90 @@
+"""用户搜索索引（services.user_search）：三个字符以上走 FTS5 trigram，一两个字的姓名走单字/两字表，改名删号后索引跟着提交更新，角色过滤照常生效"""
+import pytest
+from sqlalchemy import select
+
+import models
+from backend.core.pagination import PageParams
+from backend.services import user_directory, user_search
+
+U = models.User
+
+
+@pytest.fixture
+def people(db, clinic):
+    """三名有资料的患者（张三、张三丰、李四）和一名医生（张医生）"""
+    p = clinic.patient_ids
+    db.add_all([
+        models.PatientProfile(user_id=p[0], name="张三", id_card="11010119900101123X"),
+        models.PatientProfile(user_id=p[1], name="张三丰", id_card="110101199001015678"),
+        models.PatientProfile(user_id=p[2], name="李四"),
+        models.DoctorProfile(user_id=clinic.doctor_id, name="张医生", department="内科", title="主任医师",
+                             license_number="L001", hospital="一院"),
+    ])
+    db.commit()
+    return clinic
+
+
+def _search(db, keyword: str, page_size: int = 100) -> set:
+    db.rollback()
+    return set(db.scalars(select(U.id).where(user_search.condition(db, keyword, page_size))).all())
+
+
+def _listed(db, keyword: str, role=None) -> set:
+    db.rollback()
+    page = PageParams.of(None, 100)
+    return {row.id for row in user_directory.fetch(db, role, None, keyword, user_directory.keyset("-created_at"), page)}
+
+
+def test_trigram_keywords(db, people):
+    p = people.patient_ids
+    assert _search(db, "0000019") == {p[19]}
+    assert _search(db, "张三丰") == {p[1]}
+    # 身份证号只认尾号，大小写不敏感
+    assert _search(db, "123x") == _search(db, "123X") == {p[0]}
+    assert _search(db, "19900101") == set()
+
+
+def test_short_name_keywords_use_gram_table(db, people):
+    p = people.patient_ids
+    assert _search(db, "张") == {p[0], p[1], people.doctor_id}
+    assert _search(db, "张三") == {p[0], p[1]}
+    assert _search(db, "丰") == {p[1]}
+    # 一两个字符的手机号片段没有区分度，不支持
+    assert _search(db, "13") == set()
+
+
+def test_frequent_keywords_probe_row_by_row(db, people, monkeypatch):
+    monkeypatch.setattr(user_search, "FREQUENT_HITS", 0)
+    p = people.patient_ids
+    for keyword, expected in (("张", {p[0], p[1], people.doctor_id}), ("130000000", set(p))):
+        assert "EXISTS" in str(user_search.condition(db, keyword, 1))
+        assert _search(db, keyword, 1) == expected
+
+
+def test_index_follows_updates_and_deletes(db, people):
+    p = people.patient_ids
+    profile = db.scalar(select(models.PatientProfile).where(models.PatientProfile.user_id == p[2]))
+    profile.name = "王五"
+    db.get(U, p[3]).phone = "17712345678"
+    db.commit()
+    assert _search(db, "李四") == set() and _search(db, "王五") == {p[2]}
+    assert _search(db, "12345678") == {p[3]} and _search(db, "0000003") == set()
+
+    db.delete(db.scalar(select(models.PatientProfile).where(models.PatientProfile.user_id == p[0])))
+    db.delete(db.get(U, p[19]))
+    db.commit()
+    assert _search(db, "张三") == {p[1]}
+    assert _search(db, "0000019") == set()
+
+
+def test_role_filter_applies_with_keyword(db, people):
+    p = people.patient_ids
+    assert _listed(db, "张") == {p[0], p[1], people.doctor_id}
+    assert _listed(db, "张", models.UserRole.user) == {p[0], p[1]}
+    assert _listed(db, "张", models.UserRole.doctor) == {people.doctor_id}
+    assert _listed(db, "李四", models.UserRole.doctor) == set()
+
+    counter = user_directory.UserCounter()
+    assert counter.count(db, keyword="张") == (3, False)
+    assert counter.count(db, models.UserRole.user, keyword="张") == (2, False)
+    assert counter.count(db, models.UserRole.doctor, keyword="张三") == (0, False)
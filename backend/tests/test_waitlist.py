@@ -0,0 +1,94 @@
+"""满员候补（services.waitlist）：退号时在同一事务里按顺序转预约，不超卖、不重复转"""
+import pytest
+from sqlalchemy import func, select
+
+import models
+from backend.services import booking, waitlist
+
+
+def _full_schedule(db, clinic, make_schedule, capacity: int = 1, hour: int = 9):
+    schedule_id = make_schedule(capacity=capacity, hour=hour)
+    appointments = [
+        booking.book(db, patient_id, clinic.doctor_id, schedule_id)[0]
+        for patient_id in clinic.patient_ids[:capacity]
+    ]
+    return schedule_id, appointments
+
+
+def _statuses(db, entries) -> list:
+    db.rollback()
+    W = models.AppointmentWaitlist
+    rows = dict(db.execute(select(W.id, W.status).where(W.id.in_([e.id for e in entries]))).all())
+    return [rows[e.id] for e in entries]
+
+
+def _active(db, schedule_id: int) -> int:
+    A = models.Appointment
+    return db.scalar(select(func.count(A.id)).where(
+        A.schedule_id == schedule_id, A.status != models.AppointmentStatus.cancelled,
+    ))
+
+
+def test_join_requires_full_schedule(db, clinic, make_schedule):
+    schedule_id = make_schedule(capacity=2)
+    booking.book(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    with pytest.raises(booking.BookingError) as e:
+        waitlist.join(db, clinic.patient_ids[1], clinic.doctor_id, schedule_id)
+    assert e.value.reason == booking.REJECTED
+
+
+def test_join_is_idempotent(db, clinic, make_schedule):
+    schedule_id, _ = _full_schedule(db, clinic, make_schedule)
+    first = waitlist.join(db, clinic.patient_ids[5], clinic.doctor_id, schedule_id)
+    again = waitlist.join(db, clinic.patient_ids[5], clinic.doctor_id, schedule_id)
+    assert first.id == again.id
+    with pytest.raises(booking.BookingError) as e:
+        waitlist.join(db, clinic.patient_ids[0], clinic.doctor_id, schedule_id)
+    assert e.value.reason == booking.DUPLICATE
+
+
+def test_cancel_promotes_head_in_order(db, clinic, make_schedule, drift):
+    schedule_id, (appt,) = _full_schedule(db, clinic, make_schedule)
+    entries = [waitlist.join(db, p, clinic.doctor_id, schedule_id) for p in clinic.patient_ids[5:7]]
+    assert booking.cancel(db, appt.id) is True
+
+    W = models.WaitlistStatus
+    assert _statuses(db, entries) == [W.promoted, W.waiting]
+    assert booking.find_active(db, clinic.patient_ids[5], schedule_id) is not None
+    assert _active(db, schedule_id) == 1
+    assert drift() == []
+
+
+def test_promotion_skips_patient_over_daily_cap(db, clinic, make_schedule, drift):
+    schedule_id, (appt,) = _full_schedule(db, clinic, make_schedule)
+    busy, next_patient = clinic.patient_ids[5], clinic.patient_ids[6]
+    entries = [waitlist.join(db, p, clinic.doctor_id, schedule_id) for p in (busy, next_patient)]
+    for hour in (10, 11, 14, 15)[:booking.PATIENT_DAILY_CAP]:
+        booking.book(db, busy, clinic.doctor_id, make_schedule(capacity=5, hour=hour))
+    booking.cancel(db, appt.id)
+
+    W = models.WaitlistStatus
+    assert _statuses(db, entries) == [W.skipped, W.promoted]
+    assert _active(db, schedule_id) == 1
+    assert drift() == []
+
+
+def test_concurrent_cancels_promote_without_oversell(db, clinic, make_schedule, concurrently, drift):
+    schedule_id, appointments = _full_schedule(db, clinic, make_schedule, capacity=3)
+    entries = [waitlist.join(db, p, clinic.doctor_id, schedule_id) for p in clinic.patient_ids[5:10]]
+    results = concurrently([a.id for a in appointments], booking.cancel)
+    assert results == [True, True, True]
+
+    W = models.WaitlistStatus
+    assert _statuses(db, entries) == [W.promoted] * 3 + [W.waiting] * 2
+    assert _active(db, schedule_id) == 3
+    assert db.scalar(select(models.DoctorSchedule.booked_count).where(models.DoctorSchedule.id == schedule_id)) == 3
+    assert drift() == []
+
+
+def test_waiting_entries_stay_when_nobody_cancels(db, clinic, make_schedule):
+    schedule_id, _ = _full_schedule(db, clinic, make_schedule)
+    entry = waitlist.join(db, clinic.patient_ids[5], clinic.doctor_id, schedule_id)
+    assert waitlist.promote(db, schedule_id) == []
+    db.commit()
+    assert _statuses(db, [entry]) == [models.WaitlistStatus.waiting]
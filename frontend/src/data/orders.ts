@@ -1,4 +1,4 @@
-import api from '../lib/api'
+import { getAll } from '../lib/api'
 import { useQuery } from '@tanstack/react-query'
 import { QUERY_KEYS } from './queryKeys'
 
@@ -29,7 +29,7 @@ export type Order = {
 
 export async function fetchMyOrders(patientId?: string | number): Promise<Order[]> {
   if (!patientId) return []
-  const res = await api.get('/api/orders/my', { params: { patient_id: patientId } })
+  const res = await getAll('/api/orders/my', { params: { patient_id: patientId } })
   return Array.isArray(res.data) ? res.data : []
 }
 
@@ -1,4 +1,4 @@
-import axios from 'axios'
+import axios, { type AxiosRequestConfig, type AxiosResponse } from 'axios'
 import { initMvpMock } from './mvpMock'
 
 const instance = axios.create({
@@ -18,4 +18,19 @@ instance.interceptors.request.use((config) => {
 // MVP 内置模拟后端，保证核心审核流程在无后端时可运行
 initMvpMock(instance)
 
+// 游标分页的列表接口：下一页游标在响应头 X-Next-Cursor，没有下一页时不返回该头；逐页取完后合并成一个数组
+export async function getAll<T = any>(url: string, config: AxiosRequestConfig = {}): Promise<AxiosResponse<T[]>> {
+  let res = await instance.get(url, config)
+  if (!Array.isArray(res.data)) return res
+  const rows: T[] = [...res.data]
+  let cursor = res.headers?.['x-next-cursor']
+  while (cursor) {
+    res = await instance.get(url, { ...config, params: { ...config.params, cursor } })
+    if (!Array.isArray(res.data)) break
+    rows.push(...res.data)
+    cursor = res.headers?.['x-next-cursor']
+  }
+  return { ...res, data: rows }
+}
+
 export default instance
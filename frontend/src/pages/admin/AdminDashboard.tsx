@@ -91,7 +91,7 @@ const AdminDashboard: React.FC = () => {
 
   const fetchRecentUsers = async () => {
     try {
-      const res = await api.get('/api/admin/users')
+      const res = await api.get('/api/admin/users', { params: { limit: 10 } })
       const users = Array.isArray(res.data) ? res.data : []
       const mapped: RecentUser[] = users.slice(0, 10).map((u: any) => ({
         id: String(u.id),
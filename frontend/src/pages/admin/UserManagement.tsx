@@ -5,7 +5,7 @@ import {
 import {
     SearchOutlined, UserOutlined, MedicineBoxOutlined, ScheduleOutlined, FileTextOutlined
 } from '@ant-design/icons'
-import api from '../../lib/api'
+import api, { getAll } from '../../lib/api'
 import dayjs from 'dayjs'
 
 const { Option } = Select
@@ -23,7 +23,7 @@ export default function UserManagement() {
     const fetchUsers = async () => {
         setLoading(true)
         try {
-            const res = await api.get('/api/admin/all-users', { params: filters })
+            const res = await getAll('/api/admin/all-users', { params: filters })
             setUsers(res.data)
         } catch (error) {
             console.error(error)
@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react'
 import { Table, Tag, Button, Modal, Form, Input, Select, DatePicker, Space, message, Card, Row, Col, Statistic, InputNumber } from 'antd'
 import { CheckOutlined, CloseOutlined, EyeOutlined, CalendarOutlined, UserOutlined, ClockCircleOutlined, MedicineBoxOutlined } from '@ant-design/icons'
-import api from '../../lib/api'
+import api, { getAll } from '../../lib/api'
 import { useAuthStore } from '../../stores/authStore'
 import { useNavigate } from 'react-router-dom'
 import dayjs from 'dayjs'
@@ -52,7 +52,7 @@ const AppointmentManagement: React.FC = () => {
     if (!user?.id) return
     setLoading(true)
     try {
-      const res = await api.get(`/appointments/doctor/${user.id}`)
+      const res = await getAll(`/appointments/doctor/${user.id}`)
       let data: Appointment[] = Array.isArray(res.data) ? res.data : []
       data = data.map(a => {
         const normalizedStatus = (a.status === 'confirmed' || a.status === 'pending') ? 'scheduled' : a.status
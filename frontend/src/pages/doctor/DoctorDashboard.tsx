@@ -24,7 +24,7 @@ import {
   UsergroupAddOutlined,
   FileTextOutlined
 } from '@ant-design/icons'
-import api from '../../lib/api'
+import api, { getAll } from '../../lib/api'
 import { useAuthStore } from '../../stores/authStore'
 import dayjs from 'dayjs'
 import 'dayjs/locale/zh-cn'
@@ -51,7 +51,7 @@ export default function DoctorDashboard() {
       // date_to is exclusive in backend logic: q = q.filter(models.DoctorSchedule.date < dtt)
       // So to get today's appointments, we need date_from=today and date_to=tomorrow
       const tomorrow = dayjs().add(1, 'day').format('YYYY-MM-DD')
-      const res = await api.get(`/appointments/doctor/${user?.id}`, {
+      const res = await getAll(`/appointments/doctor/${user?.id}`, {
         params: {
           date_from: today,
           date_to: tomorrow
@@ -70,7 +70,7 @@ export default function DoctorDashboard() {
     try {
       const tomorrow = dayjs().add(1, 'day').format('YYYY-MM-DD')
       const nextWeek = dayjs().add(8, 'day').format('YYYY-MM-DD')
-      const res = await api.get(`/appointments/doctor/${user?.id}`, {
+      const res = await getAll(`/appointments/doctor/${user?.id}`, {
         params: {
           date_from: tomorrow,
           date_to: nextWeek
@@ -86,7 +86,7 @@ export default function DoctorDashboard() {
   // 获取近期处方
   const fetchRecentPrescriptions = async () => {
     try {
-      const res = await api.get('/api/doctor/prescriptions', { params: { doctor_id: user?.id } })
+      const res = await api.get('/api/doctor/prescriptions', { params: { doctor_id: user?.id, limit: 5 } })
       setRecentPrescriptions(res.data.slice(0, 5) || [])
     } catch (error) {
       console.error('Error fetching recent prescriptions:', error)
@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react'
 import { Table, Tag, Button, Modal, Form, Input, Select, DatePicker, Space, message, Card, Row, Col, Statistic, InputNumber, Divider } from 'antd'
 import { PlusOutlined, EditOutlined, DeleteOutlined, EyeOutlined, MedicineBoxOutlined, FileTextOutlined, UserOutlined } from '@ant-design/icons'
-import api from '../../lib/api'
+import api, { getAll } from '../../lib/api'
 import { useAuthStore } from '../../stores/authStore'
 import { useLocation } from 'react-router-dom'
 import dayjs from 'dayjs'
@@ -82,7 +82,7 @@ const PrescriptionManagement: React.FC = () => {
     try {
       fetchMedicines()
 
-      const response = await api.get('/api/doctor/prescriptions', {
+      const response = await getAll('/api/doctor/prescriptions', {
         params: { doctor_id: user.id }
       })
 
@@ -122,7 +122,7 @@ const PrescriptionManagement: React.FC = () => {
 
   const fetchMedicines = async () => {
     try {
-      const response = await api.get('/api/admin/medications')
+      const response = await getAll('/api/admin/medications')
       setMedicineOptions(response.data || [])
     } catch (error) {
       console.error('获取药品列表失败:', error)
@@ -27,7 +27,7 @@ import {
   CheckCircleOutlined,
   ExclamationCircleOutlined
 } from '@ant-design/icons'
-import api from '../../lib/api'
+import api, { getAll } from '../../lib/api'
 import { useAuthStore } from '../../stores/authStore'
 import dayjs from 'dayjs'
 import 'dayjs/locale/zh-cn'
@@ -114,7 +114,7 @@ export default function AppointmentBooking() {
   // 获取我的预约
   const fetchMyAppointments = async () => {
     try {
-      const res = await api.get('/appointments/my', { params: { patient_id: user?.id } })
+      const res = await getAll('/appointments/my', { params: { patient_id: user?.id } })
       setMyAppointments(Array.isArray(res.data) ? res.data : [])
     } catch (error) {
       message.error('获取预约记录失败')
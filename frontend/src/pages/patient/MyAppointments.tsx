@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react'
 import { Card, Table, Tag, Button, Space, Modal, Form, DatePicker, Select, message, Row, Col } from 'antd'
 import { EyeOutlined, EditOutlined, DeleteOutlined, CalendarOutlined, ClockCircleOutlined } from '@ant-design/icons'
-import api from '../../lib/api'
+import api, { getAll } from '../../lib/api'
 import { useAuthStore } from '../../stores/authStore'
 import dayjs from 'dayjs'
 
@@ -19,7 +19,7 @@ const MyAppointments: React.FC = () => {
   const refetch = async () => {
     if (!user?.id) return
     try {
-      const res = await api.get('/appointments/my', { params: { patient_id: user.id } })
+      const res = await getAll('/appointments/my', { params: { patient_id: user.id } })
       setAppointments(Array.isArray(res.data) ? res.data : [])
     } catch (error) {
       message.error('获取预约列表失败')
@@ -30,7 +30,7 @@ export default function PatientDashboard() {
   React.useEffect(() => {
     const run = async () => {
       try {
-        const apRes = await api.get('/appointments/my', { params: { patient_id: user?.id } })
+        const apRes = await api.get('/appointments/my', { params: { patient_id: user?.id, limit: 5 } })
         const aps = Array.isArray(apRes.data) ? apRes.data.slice(0, 5) : []
         const mapped = aps.map((a: any) => ({
           id: a.id,
@@ -42,7 +42,7 @@ export default function PatientDashboard() {
         setUpcomingAppointments(mapped)
       } catch { }
       try {
-        const orRes = await api.get('/api/pharmacy/prescriptions', { params: { patient_id: user?.id } })
+        const orRes = await api.get('/api/pharmacy/prescriptions', { params: { patient_id: user?.id, limit: 5 } })
         const list = Array.isArray(orRes.data) ? orRes.data.slice(0, 5) : []
         const mapped = list.map((o: any) => ({
           id: o.id,
@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react'
 import { Card, Table, Tag, Button, Space, Modal, Descriptions, message, Popconfirm } from 'antd'
 import { EyeOutlined, MedicineBoxOutlined, PayCircleOutlined } from '@ant-design/icons'
-import api from '../../lib/api'
+import api, { getAll } from '../../lib/api'
 import { useAuthStore } from '../../stores/authStore'
 import dayjs from 'dayjs'
 
@@ -36,7 +36,7 @@ const PatientPrescriptions: React.FC = () => {
         if (!user?.id) return
         setLoading(true)
         try {
-            const res = await api.get('/api/pharmacy/prescriptions', {
+            const res = await getAll('/api/pharmacy/prescriptions', {
                 params: { patient_id: user.id }
             })
             setPrescriptions(res.data || [])
@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react'
 import { Table, Tag, Button, Modal, Form, Input, Select, Space, message, Card, Row, Col, Statistic, InputNumber } from 'antd'
 import { PlusOutlined, EditOutlined, DeleteOutlined, SearchOutlined, MedicineBoxOutlined, StockOutlined } from '@ant-design/icons'
-import api from '../../lib/api'
+import api, { getAll } from '../../lib/api'
 import dayjs from 'dayjs'
 import 'dayjs/locale/zh-cn'
 
@@ -56,7 +56,7 @@ const DrugInventory: React.FC = () => {
   const fetchMedicines = async () => {
     setLoading(true)
     try {
-      const response = await api.get('/api/admin/medications')
+      const response = await getAll('/api/admin/medications')
       setMedicines(response.data || [])
     } catch (error) {
       console.error('获取药品列表失败:', error)
@@ -12,7 +12,7 @@ import {
   HistoryOutlined,
   ExperimentOutlined
 } from '@ant-design/icons'
-import api from '../../lib/api'
+import api, { getAll } from '../../lib/api'
 import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer } from 'recharts'
 import dayjs from 'dayjs'
 import 'dayjs/locale/zh-cn'
@@ -75,11 +75,11 @@ const PharmacyDashboard: React.FC = () => {
       setStats(res.data)
 
       // Fetch recent prescriptions for the table
-      const presRes = await api.get('/api/pharmacy/prescriptions')
+      const presRes = await api.get('/api/pharmacy/prescriptions', { params: { limit: 5 } })
       setRecentPrescriptions(presRes.data.slice(0, 5))
 
       // Fetch low stock medicines
-      const medsRes = await api.get('/api/admin/medications')
+      const medsRes = await getAll('/api/admin/medications')
       const meds: Medicine[] = medsRes.data
       setLowStockMedicines(meds.filter(m => m.stock <= m.min_stock))
 
@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react'
 import { Card, Table, Tag, Button, Space, Modal, Descriptions, message, Popconfirm, Radio } from 'antd'
 import { EyeOutlined, MedicineBoxOutlined, CheckCircleOutlined } from '@ant-design/icons'
-import api from '../../lib/api'
+import api, { getAll } from '../../lib/api'
 import dayjs from 'dayjs'
 
 interface PrescriptionItem {
@@ -40,7 +40,7 @@ const PrescriptionProcessing: React.FC = () => {
             if (statusFilter !== 'all') {
                 params.status = statusFilter
             }
-            const res = await api.get('/api/pharmacy/prescriptions', { params })
+            const res = await getAll('/api/pharmacy/prescriptions', { params })
             setPrescriptions(res.data || [])
         } catch (error) {
             message.error('获取处方列表失败')
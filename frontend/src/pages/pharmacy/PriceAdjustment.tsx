@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react'
 import { Card, Table, Button, InputNumber, Form, Input, Modal, message, Tag, Space, DatePicker, Select } from 'antd'
 import { EditOutlined, HistoryOutlined, SearchOutlined } from '@ant-design/icons'
-import api from '../../lib/api'
+import api, { getAll } from '../../lib/api'
 import { useAuthStore } from '../../stores/authStore'
 import dayjs from 'dayjs'
 
@@ -36,7 +36,7 @@ export default function PriceAdjustment() {
   const fetchMedicines = async () => {
     setLoading(true)
     try {
-      const res = await api.get('/api/admin/medications')
+      const res = await getAll('/api/admin/medications')
       setMedicines(res.data || [])
     } catch (error) {
       message.error('获取药品列表失败')
@@ -85,7 +85,7 @@ export default function PriceAdjustment() {
   const handleSearch = async (values: any) => {
     setLoading(true)
     try {
-      const res = await api.get('/api/admin/medications')
+      const res = await getAll('/api/admin/medications')
       let list: any[] = res.data || []
       if (values.name) {
         list = list.filter(m => (m.name || '').includes(values.name))